@@ -2,13 +2,52 @@
 #include "Arduino_BHY2.h"
 #include <ArduinoBLE.h>
 
-#define PACKET_SIZE 130  // Define the maximum BLE packet size
+#define PACKET_SIZE 244  // Define the maximum BLE packet size (ATT MTU 247 - 3)
 #define BLE_SENSE_UUID(val) ("19b10000-" val "-537e-4f6c-d104768a1214")
 #define SERIAL_DEBUG 1
 #define TEST_SAMPLE_RATE 0
 #define TEST_BLE_RATE 0
 
-const int VERSION = 0x00000000;
+// Packet formats, advertised in the low byte of the version characteristic
+#define PACKET_FORMAT_TEXT 0    // "id,G:x,y,z,A:x,y,z,Q:x,y,z,w" ASCII line (legacy)
+#define PACKET_FORMAT_BINARY 1  // BinaryPacket below
+#define PACKET_FORMAT_BATCH 2   // BatchPacket below, BATCH_SIZE samples per notification
+#define PACKET_FORMAT PACKET_FORMAT_BATCH
+#define QUAT_SCALE 16384.0  // quaternion components sent as Q14 fixed point
+#define BATCH_SIZE 10  // samples per notification, (PACKET_SIZE - 10) / 22 at most
+#define BATCH_TICK_US 100  // resolution of the sample offsets in a batch
+
+// low byte: packet format, second byte: samples per notification
+const int VERSION = PACKET_FORMAT | ((PACKET_FORMAT == PACKET_FORMAT_BATCH ? BATCH_SIZE : 1) << 8);
+
+// Binary packet, little endian: gyro and accel in raw LSB, quaternion in Q14
+typedef struct __attribute__((packed)) {
+  uint8_t version;
+  uint8_t reserved;
+  uint32_t packet_id;
+  int16_t gyro[3];
+  int16_t accel[3];
+  int16_t quat[4];
+} BinaryPacket;
+
+// Batched packet: samples taken at batchSampleRate, each with its offset from base_time
+typedef struct __attribute__((packed)) {
+  uint16_t offset;  // in BATCH_TICK_US ticks from base_time
+  int16_t gyro[3];
+  int16_t accel[3];
+  int16_t quat[4];
+} BatchSample;
+
+typedef struct __attribute__((packed)) {
+  uint8_t version;
+  uint8_t count;
+  uint32_t packet_id;  // id of the first sample, the following ones are consecutive
+  uint32_t base_time;  // micros() of the first sample
+  BatchSample samples[BATCH_SIZE];
+} BatchPacket;
+
+BatchPacket batchPacket;
+uint8_t batchCount = 0;
 int batteryLevel = 0;
 // store led state in a char
 char ledState[10] = "off";
@@ -32,6 +71,11 @@ unsigned long bleLastUpdateTime = 0; // Store the last update time
 unsigned long bleRefreshRate = 30; // rate in Hz
 unsigned long bleRefreshTime = (1.0 / bleRefreshRate) * 1000;
 
+// Set the sampling rate of the batched mode, notifications are sent every BATCH_SIZE samples
+unsigned long batchLastSampleTime = 0; // micros() of the last batched sample
+unsigned long batchSampleRate = 200; // rate in Hz
+unsigned long batchSampleTime = 1000000 / batchSampleRate; // period in us
+
 Sensor temperature(SENSOR_ID_TEMP);
 Sensor humidity(SENSOR_ID_HUM);
 Sensor pressure(SENSOR_ID_BARO);
@@ -136,6 +180,7 @@ void loop() {
     if (programStatus == 1){
       if (!startSaving){
         packet_id = 0;
+        batchCount = 0;
         startSaving = 1;
       } 
 
@@ -174,19 +219,66 @@ void loop() {
 
 
       BHY2.update();
-      if (dataCharacteristic.subscribed()){
+      if (dataCharacteristic.subscribed() && PACKET_FORMAT == PACKET_FORMAT_BATCH){
+        unsigned long currentMicros = micros();
+        if (currentMicros - batchLastSampleTime >= batchSampleTime){
+          if (batchCount == 0){
+            batchPacket.version = PACKET_FORMAT_BATCH;
+            batchPacket.packet_id = packet_id;
+            batchPacket.base_time = currentMicros;
+          }
+          BatchSample &sample = batchPacket.samples[batchCount];
+          sample.offset = (currentMicros - batchPacket.base_time) / BATCH_TICK_US;
+          sample.gyro[0] = toInt16(gyroscope.x());
+          sample.gyro[1] = toInt16(gyroscope.y());
+          sample.gyro[2] = toInt16(gyroscope.z());
+          sample.accel[0] = toInt16(accelerometer.x() - gravity.x());
+          sample.accel[1] = toInt16(accelerometer.y() - gravity.y());
+          sample.accel[2] = toInt16(accelerometer.z() - gravity.z());
+          sample.quat[0] = toInt16(quaternion.x() * QUAT_SCALE);
+          sample.quat[1] = toInt16(quaternion.y() * QUAT_SCALE);
+          sample.quat[2] = toInt16(quaternion.z() * QUAT_SCALE);
+          sample.quat[3] = toInt16(quaternion.w() * QUAT_SCALE);
+          batchCount++;
+          packet_id++;
+
+          if (batchCount == BATCH_SIZE){
+            batchPacket.count = batchCount;
+            dataCharacteristic.writeValue((uint8_t*)&batchPacket, 10 + batchCount * sizeof(BatchSample));
+            batchCount = 0;
+          }
+          batchLastSampleTime = currentMicros;
+        }
+      }
+      else if (dataCharacteristic.subscribed()){
         if (currentTime - bleLastUpdateTime >= bleRefreshTime){
           float gyroValues[3] = {gyroscope.x(), gyroscope.y(), gyroscope.z()};
           float accelValues[3] = {accelerometer.x()-gravity.x(), accelerometer.y()-gravity.y(), accelerometer.z()-gravity.z()};
           float quatValues[4] = {quaternion.x(), quaternion.y(), quaternion.z(), quaternion.w()};
         
-          char dataPacket[PACKET_SIZE];
-          snprintf(dataPacket, sizeof(dataPacket),
-                  "%d,G:%.2f,%.2f,%.2f,A:%.2f,%.2f,%.2f,Q:%.2f,%.2f,%.2f,%.2f",
-                  packet_id, gyroValues[0], gyroValues[1], gyroValues[2],
-                  accelValues[0], accelValues[1], accelValues[2],
-                  quatValues[0], quatValues[1], quatValues[2], quatValues[3]);
-          dataCharacteristic.writeValue(dataPacket);
+          if (PACKET_FORMAT == PACKET_FORMAT_BINARY){
+            BinaryPacket dataPacket;
+            dataPacket.version = PACKET_FORMAT_BINARY;
+            dataPacket.reserved = 0;
+            dataPacket.packet_id = packet_id;
+            for (int i = 0; i < 3; i++){
+              dataPacket.gyro[i] = toInt16(gyroValues[i]);
+              dataPacket.accel[i] = toInt16(accelValues[i]);
+            }
+            for (int i = 0; i < 4; i++){
+              dataPacket.quat[i] = toInt16(quatValues[i] * QUAT_SCALE);
+            }
+            dataCharacteristic.writeValue((uint8_t*)&dataPacket, sizeof(dataPacket));
+          }
+          else{
+            char dataPacket[PACKET_SIZE];
+            snprintf(dataPacket, sizeof(dataPacket),
+                    "%d,G:%.2f,%.2f,%.2f,A:%.2f,%.2f,%.2f,Q:%.2f,%.2f,%.2f,%.2f",
+                    packet_id, gyroValues[0], gyroValues[1], gyroValues[2],
+                    accelValues[0], accelValues[1], accelValues[2],
+                    quatValues[0], quatValues[1], quatValues[2], quatValues[3]);
+            dataCharacteristic.writeValue(dataPacket);
+          }
           
           packet_id++;
 
@@ -205,6 +297,7 @@ void loop() {
         strcpy(ledState, "blue");
       }
       packet_id = 0;
+      batchCount = 0;
     }
   }
   else{
@@ -215,6 +308,7 @@ void loop() {
     if (programStatus == 1){
       if (startSaving){
         packet_id = 0;
+        batchCount = 0;
         startSaving = 0;
       }
       // nicla::saveDataToNvram();
@@ -223,6 +317,7 @@ void loop() {
     // if programStatus is 0, reset the packet_id counter
     else{
       packet_id = 0;
+      batchCount = 0;
     }
 
     if (strcpy(ledState, "red") != 0){
@@ -233,6 +328,11 @@ void loop() {
   }
 }
 
+// Round and saturate a sensor value to the int16 range of the binary packet
+int16_t toInt16(float value){
+  return (int16_t)constrain(lroundf(value), -32768L, 32767L);
+}
+
 void blePeripheralDisconnectHandler(BLEDevice central){
   // Define flashing colors; here: red, blue
   byte colors[2][3] = {
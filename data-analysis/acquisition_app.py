@@ -1,43 +1,45 @@
 import asyncio
-from bleak import BleakClient, BleakScanner
 from influxdb_client import InfluxDBClient, Point, WriteOptions
 from decouple import config
 import paho.mqtt.client as paho
 from datetime import datetime
-import re
 import os
+import sys
+import time
 import pandas as pd
-from datetime import datetime
 
 curr_dir = os.path.dirname(os.path.abspath(__file__))
 save_dir = os.path.join(curr_dir, 'acquisitions')
 
-# Precompiled regular expression pattern
-pattern = re.compile(r'(\d+),G:([\d.-]+),([\d.-]+),([\d.-]+),A:([\d.-]+),([\d.-]+),([\d.-]+),Q:([\d.-]+),([\d.-]+),([\d.-]+),([\d.-]+)')
-
-# 0 means stop notification, 1 means start notification
-PROGRAM_COMMAND_UUID = "19b10000-8002-537e-4f6c-d104768a1214" 
-SENSORS_UUID = "19b10000-A001-537e-4f6c-d104768a1214" # UUID to read from
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(curr_dir, '..')))
+from smartapple.clock import DeviceClock
+from smartapple.packet import decode_packet
+from smartapple.recorder import FSYNC_ROTATE, CsvRecorder
+from smartapple.sequence import SequenceTracker
+from smartapple.session_manager import SessionManager
 
 nicla_address = ["EE:DF:46:E7:08:80", "9C:E3:E6:C9:4A:C8"]
 prod_line_id = ["test", "test"]
-connected_address = None
-device_name = None
-ble_client = None
 mqtt_client = None
-isStarted = False
 send2mqtt = False
 save2local = True
 send2influxdb = True
-file_name = None
-file_path = None
-df = None
-file_name = f"impacts_{datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-file_path = os.path.join(save_dir, file_name)
+columns = ['_time', 'packet_id', 'gyro_x', 'gyro_y', 'gyro_z', 'accel_x', 'accel_y', 'accel_z', 'quat_x', 'quat_y', 'quat_z', 'quat_w']
+start_time = datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')
+# one csv recorder per SmartApple, since they are streamed at the same time
+recorders = {}
+# device clock estimate of each SmartApple, to timestamp its samples
+clocks = {address: DeviceClock() for address in nicla_address}
+# packet_id gap, duplicate and reset accounting of each SmartApple
+sequences = {address: SequenceTracker() for address in nicla_address}
 
 if save2local:
-    df = pd.DataFrame(columns=['_time', 'packet_id', 'gyro_x', 'gyro_y', 'gyro_z', 'accel_x', 'accel_y', 'accel_z', 'quat_x', 'quat_y', 'quat_z', 'quat_w'])
-    df.to_csv(file_path, header=True, index=False)
+    for address in nicla_address:
+        # rows are written by a background thread every second, a new file is started every hour or 100 MB
+        recorders[address] = CsvRecorder(save_dir, f"impacts_{address.replace(':', '')}_{start_time}", columns,
+                                         flush_interval=1.0, max_bytes=100_000_000, max_seconds=3600.0, fsync=FSYNC_ROTATE)
+        recorders[address].start()
 
 # Conversion factors from datasheet
 accel_sensitivity = 4096.0  # Sensitivity for accelerometer in LSB/g
@@ -81,6 +83,18 @@ def write_to_influxdb(address, prod_line_id, data, timestamp):
 
     write_api.write(INFLUXDB_BUCKET, INFLUXDB_ORG, point)
 
+def report_link_stats():
+    for address, sequence in sequences.items():
+        summary = sequence.summary()
+        print(f"[{address}] {summary['lost']} lost in {summary['gaps']} gaps, {summary['duplicates']} duplicates, "
+              f"{summary['reorders']} reordered, {summary['resets']} resets, loss {summary['loss_rate']:.2%} "
+              f"(recent {summary['rolling_loss_rate']:.2%}), inter-arrival {sequence.interarrival.summary()}")
+        if send2influxdb:
+            point = Point("nicla_link").tag("address", address).tag("gateway", "acquisition").time(datetime.utcnow())
+            for key, value in summary.items():
+                point = point.field(key, value)
+            write_api.write(INFLUXDB_BUCKET, INFLUXDB_ORG, point)
+
 if send2mqtt:
     # MQTT Settings
     MQTT_ID = config('MQTT_ID', cast=str)
@@ -95,19 +109,28 @@ if send2mqtt:
     else:
         print("Connected to the mqtt broker")
 
+    # run the paho network loop on its own thread so that publish() never waits on the socket
+    mqtt_client.loop_start()
+
 # send through MQTT
 def send_to_mqtt(topic, data):
     global mqtt_client
     mqtt_client.publish(topic, data, 0)
 
-def notification_handler(sender: int, data: bytearray):
-    global pattern, connected_address, send2mqtt, save2local, file_path, df
+def notification_handler(address, data: bytearray):
+    global send2mqtt, save2local
 
-    raw_data = data.decode('utf-8')
-    match = pattern.match(raw_data)
-    if match:
-        packet_id, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w = match.groups()
+    samples = decode_packet(data)
+    if not samples:
+        print(f"Invalid data received from {address}:", bytes(data))
+        return 0
 
+    # every sample gets its own timestamp from the device clock (ns since the epoch, UTC)
+    receive_ns = time.time_ns()
+    timestamps_ns = clocks[address].timestamps(samples, receive_ns).tolist()
+    sequences[address].observe([sample.packet_id for sample in samples], receive_ns)
+    for timestamp_ns, (packet_id, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w, _) in zip(timestamps_ns, samples):
+        timestamp = pd.Timestamp(timestamp_ns)
         # Convert accelerometer and gyroscope data to standard units
         a_x = float(a_x) / accel_sensitivity
         a_y = float(a_y) / accel_sensitivity
@@ -116,18 +139,14 @@ def notification_handler(sender: int, data: bytearray):
         g_y = float(g_y) / gyro_sensitivity
         g_z = float(g_z) / gyro_sensitivity
 
-        timestamp = datetime.utcnow()
         print(f"{timestamp},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}")
 
         if save2local:
-            df.loc[len(df)] = [timestamp, packet_id, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w]
-            if int(packet_id) % 100 == 0:
-                df.to_csv(file_path, header=False, index=False, mode='a')
-                df = pd.DataFrame(columns=['_time', 'packet_id', 'gyro_x', 'gyro_y', 'gyro_z', 'accel_x', 'accel_y', 'accel_z', 'quat_x', 'quat_y', 'quat_z', 'quat_w'])
+            recorders[address].append(timestamp_ns, (packet_id, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w))
 
         if send2influxdb:
             # Write to InfluxDB
-            write_to_influxdb(connected_address, prod_line_id[nicla_address.index(connected_address)], {
+            write_to_influxdb(address, prod_line_id[nicla_address.index(address)], {
                 "packet_id": int(packet_id),
                 "g_x": g_x,
                 "g_y": g_y,
@@ -142,72 +161,23 @@ def notification_handler(sender: int, data: bytearray):
             }, timestamp)
 
         if send2mqtt:
-            # print(f"nicla/{connected_address}/movement_sensor_data", f"{timestamp},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}")
-            send_to_mqtt(f"nicla/{connected_address}/movement_sensor_data", f"{timestamp},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}")
-    else:
-        print("Invalid data received:", raw_data)
-
-async def main_loop(address):
-    global isStarted, ble_client, connected_address
-    isStarted = False
-    
-    while True:
-        async with BleakClient(address, timeout=10.0) as ble_client:
-            print("Connected successfully!")
-            if not isStarted:
-                # send a byte 1 to start the program to the command characteristic
-                await ble_client.write_gatt_char(PROGRAM_COMMAND_UUID, bytearray([1]))
-                await ble_client.start_notify(SENSORS_UUID, notification_handler)
-                isStarted = True
-
-            while ble_client.is_connected:
-                await asyncio.sleep(0.1)
-            
-            # exit the loop if client is disconnected
-            print("Disconnected from device.")
-            connected_address = None
-            break
-       
+            # print(f"nicla/{address}/movement_sensor_data", f"{timestamp},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}")
+            send_to_mqtt(f"nicla/{address}/movement_sensor_data", f"{timestamp},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}")
+    return len(samples)
+
 async def main():
-    global nicla_address, connected_address, ble_client, isStarted
-    while True:
-        try:
-            # if client is not connected, scan for devices
-            if not ble_client or not ble_client.is_connected:
-                connected_address = None
-                print("Scanning for devices...")
-                # scan for devices
-                while not connected_address:
-                    devices = await BleakScanner.discover(1)
-                    for d in devices:
-                        if d.address in nicla_address:
-                            device_name = d.name
-                            connected_address = d.address
-                            print(f"Found {device_name} at {d.address}")
-                            await main_loop(connected_address)
-                            break
-                    else:
-                        print("No SmartApples available found.")
-        
-            if connected_address is not None:
-                await main_loop(connected_address)        
-
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-        except KeyboardInterrupt:
-            print("Interrupted by user.")
-        finally:
-            print("Disconnected, cleaning up...")
-            if ble_client:
-                try:
-                    await ble_client.stop_notify(SENSORS_UUID)
-                    await ble_client.disconnect()
-                    ble_client = None
-                    connected_address = None
-                    isStarted = False
-                    await asyncio.sleep(1)
-                except Exception as e:
-                    print(f"Error during cleanup: {e}")
+    # stream all the SmartApples, reconnecting as soon as they advertise again
+    manager = SessionManager(nicla_address, notification_handler, reporters=[report_link_stats])
+    try:
+        await manager.run()
+    except KeyboardInterrupt:
+        print("Interrupted by user.")
+    finally:
+        print("Disconnected, cleaning up...")
+        manager.report()
+        for recorder in recorders.values():
+            recorder.stop()
+            print(f"Saved {recorder.rows} rows to {', '.join(recorder.paths)}")
 
 loop = asyncio.get_event_loop()
 
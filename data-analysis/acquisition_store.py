@@ -0,0 +1,119 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Partitioned Parquet store of the acquisitions:
+# <root>/date=YYYYMMDD/device=<device>/production_line=<line>/<run>.parquet
+STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'acquisitions', 'store')
+
+IMU_COLUMNS = ['gyro_x', 'gyro_y', 'gyro_z', 'accel_x', 'accel_y', 'accel_z', 'quat_x', 'quat_y', 'quat_z', 'quat_w']
+SCHEMA = pa.schema([('time_ns', pa.int64()), ('packet_id', pa.int64())]
+                   + [(name, pa.float32()) for name in IMU_COLUMNS]
+                   + [('run', pa.string())])
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string()), ('device', pa.string()), ('production_line', pa.string())]),
+                               flavor='hive')
+ROW_GROUP_SIZE = 65536  # rows, the unit of the time range pushdown
+
+# file name patterns of the existing csv acquisitions
+_apple_run = re.compile(r'^(apple\d+)_(.+)$')
+_gateway_run = re.compile(r'^impacts_([0-9A-Fa-f]{12})_(.+)$')
+
+
+def parse_run_name(file_name):
+    # (device, run) from an acquisition file name
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    for pattern in (_apple_run, _gateway_run):
+        match = pattern.match(stem)
+        if match:
+            return match.group(1), match.group(2)
+    return 'unknown', stem
+
+
+def to_time_ns(time_column):
+    # any _time column (strings, naive or tz aware datetimes) to int64 ns since the epoch, UTC
+    times = pd.to_datetime(time_column, utc=True, format='mixed')
+    return times.dt.tz_localize(None).to_numpy('datetime64[ns]').astype(np.int64)
+
+
+def write_acquisition(df, device, run, production_line='test', root=STORE_DIR, units='lsb'):
+    """Writes one run, split by UTC date, returns the written paths.
+
+    df needs a _time (or time_ns) column and the IMU_COLUMNS; units is kept in the file
+    metadata ('lsb' for raw sensor values, 'si' for g and °/s).
+    """
+    time_ns = df['time_ns'].to_numpy(np.int64) if 'time_ns' in df else to_time_ns(df['_time'])
+    order = np.argsort(time_ns, kind='stable')
+    columns = {'time_ns': time_ns[order],
+               'packet_id': df['packet_id'].to_numpy()[order].astype(np.int64)}
+    for name in IMU_COLUMNS:
+        columns[name] = df[name].to_numpy(np.float32)[order]
+    columns['run'] = np.full(len(order), run, dtype=object)
+    table = pa.table(columns, schema=SCHEMA).replace_schema_metadata({'units': units})
+
+    dates = columns['time_ns'].astype('datetime64[ns]').astype('datetime64[D]')
+    paths = []
+    for date in np.unique(dates):
+        rows = np.flatnonzero(dates == date)
+        directory = os.path.join(root, f"date={str(date).replace('-', '')}", f"device={device}",
+                                 f"production_line={production_line}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{run}.parquet")
+        pq.write_table(table.slice(rows[0], len(rows)), path, row_group_size=ROW_GROUP_SIZE, compression='zstd')
+        paths.append(path)
+    return paths
+
+
+def _filter(start=None, end=None, date=None, device=None, production_line=None, run=None):
+    expression = None
+    conditions = []
+    for name, value in (('date', date), ('device', device), ('production_line', production_line), ('run', run)):
+        if value is not None:
+            conditions.append(ds.field(name) == value if isinstance(value, str) else ds.field(name).isin(list(value)))
+    if start is not None:
+        start_ns = int(pd.Timestamp(start).value)
+        conditions.append(ds.field('time_ns') >= start_ns)
+        # the date partitions before the start can be skipped without opening them
+        conditions.append(ds.field('date') >= pd.Timestamp(start_ns).strftime('%Y%m%d'))
+    if end is not None:
+        end_ns = int(pd.Timestamp(end).value)
+        conditions.append(ds.field('time_ns') < end_ns)
+        conditions.append(ds.field('date') <= pd.Timestamp(end_ns).strftime('%Y%m%d'))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def open_store(root=STORE_DIR):
+    return ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+
+
+def read_acquisition(root=STORE_DIR, columns=None, start=None, end=None, date=None, device=None,
+                     production_line=None, run=None, time_column=True):
+    """Loads the selected rows and columns as a DataFrame sorted by time.
+
+    Partitions (date, device, production_line) are pruned from the directory names,
+    run and the [start, end) time range from the Parquet statistics, so only the
+    matching row groups of the matching files are read. start/end are UTC.
+    """
+    if columns is not None and 'time_ns' not in columns:
+        columns = ['time_ns'] + list(columns)
+    table = open_store(root).to_table(columns=columns,
+                                      filter=_filter(start, end, date, device, production_line, run))
+    df = table.to_pandas()
+    df = df.sort_values('time_ns', kind='stable', ignore_index=True)
+    if time_column:
+        df.insert(0, '_time', df['time_ns'].to_numpy().astype('datetime64[ns]'))
+    return df
+
+
+def list_runs(root=STORE_DIR):
+    # one row per stored run file, from the directory layout only
+    rows = []
+    for fragment in open_store(root).get_fragments():
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        rows.append({**keys, 'run': os.path.splitext(os.path.basename(fragment.path))[0], 'path': fragment.path})
+    return pd.DataFrame(rows, columns=['date', 'device', 'production_line', 'run', 'path'])
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import pandas as pd
+from column_store import META_FILE, is_column_store
+
+# Bump when the dashboard analysis changes, so that old results are not reused
+ANALYSIS_VERSION = 3
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def path_hash(path):
+    # content hash of a file, or of the meta data and column files of a column store
+    # (their sizes and modification times, a multi-GB store is not read for this)
+    digest = hashlib.sha256()
+    if is_column_store(path):
+        with open(os.path.join(path, META_FILE), 'rb') as f:
+            digest.update(f.read())
+        for file_name in sorted(os.listdir(path)):
+            stat = os.stat(os.path.join(path, file_name))
+            digest.update(f"{file_name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def analysis_key(digest, params):
+    key = json.dumps({'content': digest, 'params': params, 'version': ANALYSIS_VERSION}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class AnalysisCache:
+    """Analysed DataFrames by key, in memory (LRU) and on disk as Parquet (LRU by modification time).
+
+    The memory LRU holds at most max_items frames and max_memory_bytes of them, the frame
+    used last is kept even when larger; the others are served from their Parquet file.
+    """
+
+    def __init__(self, directory, max_items=8, max_memory_bytes=1_000_000_000, max_disk_bytes=2_000_000_000):
+        self.directory = directory
+        self.max_items = max_items
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()  # key -> (DataFrame, bytes)
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def _remember(self, key, df):
+        if key in self._memory:
+            self.memory_bytes -= self._memory.pop(key)[1]
+        size = int(df.memory_usage(deep=True).sum())
+        self._memory[key] = (df, size)
+        self.memory_bytes += size
+        while len(self._memory) > 1 and (len(self._memory) > self.max_items or self.memory_bytes > self.max_memory_bytes):
+            self.memory_bytes -= self._memory.popitem(last=False)[1][1]
+
+    def get(self, key):
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        path = self._path(key)
+        if os.path.exists(path):
+            try:
+                df = pd.read_parquet(path)
+            except Exception as e:
+                print(f"Discarding unreadable cached analysis {path}: {e}")
+                os.remove(path)
+            else:
+                # mark it as recently used for the disk eviction
+                os.utime(path)
+                self._remember(key, df)
+                self.disk_hits += 1
+                return df
+        self.misses += 1
+        return None
+
+    def put(self, key, df):
+        self._remember(key, df)
+        tmp_path = self._path(key) + '.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self._path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.parquet'):
+                stat = os.stat(os.path.join(self.directory, file_name))
+                entries.append((stat.st_mtime, stat.st_size, file_name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(os.path.join(self.directory, file_name))
+            total -= size
@@ -0,0 +1,44 @@
+import time
+import numpy as np
+import ruptures as rpt
+from zones import segment, zone_labels
+
+# Synthetic production line runs: zones of different vibration levels with impact spikes
+sizes = [10**4, 10**5, 10**6, 10**7]
+num_zones = 6
+ruptures_max_size = 10**5  # rpt.Window on the full-rate signal, too slow above this
+seed = 0
+
+
+def synthetic_run(n, num_zones, rng):
+    bkps = np.sort(rng.choice(np.arange(n // 20, n - n // 20), num_zones - 1, replace=False))
+    # vibration levels (g) of the zones, at least 0.3 g apart
+    levels = 0.9 + rng.permutation(np.linspace(0, 1.5, num_zones))
+    signal = np.repeat(levels, np.diff(np.concatenate([[0], bkps, [n]]))) + rng.normal(0, 0.15, n)
+    impacts = rng.choice(n, n // 2000, replace=False)
+    signal[impacts] += rng.uniform(1, 4, len(impacts))
+    return signal.astype(np.float32), list(bkps) + [n]
+
+
+def boundary_error(found, true):
+    # mean distance (samples) of each true change point to the closest found one
+    found = np.asarray(found[:-1])
+    if not len(found):
+        return float('nan')
+    return float(np.mean([np.min(np.abs(found - b)) for b in true[:-1]]))
+
+
+rng = np.random.default_rng(seed)
+print(f"{'samples':>9} {'method':>18} {'time (s)':>9} {'zones':>6} {'mean error (samples)':>21}")
+for n in sizes:
+    signal, true = synthetic_run(n, num_zones, rng)
+    runs = [('fixed count', lambda: segment(signal, n_bkps=num_zones - 1)),
+            ('penalty', lambda: segment(signal))]
+    if n <= ruptures_max_size:
+        runs.append(('rpt.Window', lambda: rpt.Window(model='l2').fit(signal).predict(n_bkps=num_zones - 1)))
+    for name, run in runs:
+        start = time.perf_counter()
+        bkps = run()
+        labels = zone_labels(n, bkps)
+        elapsed = time.perf_counter() - start
+        print(f"{n:>9} {name:>18} {elapsed:>9.3f} {labels[-1] + 1:>6} {boundary_error(bkps, true):>21.1f}")
@@ -0,0 +1,151 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from acquisition_store import IMU_COLUMNS, to_time_ns
+
+# Memory-mapped acquisition: a <name>.cols directory with a meta.json and one
+# fixed-width little endian binary file per column, time_ns sorted
+COLUMN_DTYPES = {'time_ns': '<i8', 'packet_id': '<i8', **{name: '<f4' for name in IMU_COLUMNS}}
+META_FILE = 'meta.json'
+
+
+def is_column_store(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+class ColumnStore:
+    """Read-only view of a column store, columns are mapped lazily and never copied."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        self.units = meta.get('units', 'lsb')
+        self.dtypes = meta['columns']
+        self.sorted = meta.get('sorted', True)
+        self._maps = {}
+
+    @property
+    def columns(self):
+        return list(self.dtypes)
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        column = self._maps.get(name)
+        if column is None:
+            if not self.rows:
+                column = np.empty(0, dtype=self.dtypes[name])
+            else:
+                column = np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=self.dtypes[name], mode='r',
+                                   shape=(self.rows,))
+            self._maps[name] = column
+        return column
+
+    def window_rows(self, start=None, end=None):
+        # [first, last) rows of the samples in [start, end), times in ns or anything pd.Timestamp takes
+        time_ns = self.column('time_ns')
+        first = 0 if start is None else int(np.searchsorted(time_ns, _ns(start), side='left'))
+        last = self.rows if end is None else int(np.searchsorted(time_ns, _ns(end), side='left'))
+        return first, max(first, last)
+
+    def window(self, start=None, end=None, columns=None):
+        # zero-copy views of the time window
+        if not self.sorted:
+            raise ValueError(f"{self.path} is not sorted by time, use to_frame()")
+        first, last = self.window_rows(start, end)
+        return {name: self.column(name)[first:last] for name in (columns or self.columns)}
+
+    def to_frame(self, start=None, end=None, columns=None):
+        # DataFrame copy of the window, with a _time column
+        columns = list(columns or self.columns)
+        if self.sorted:
+            window = self.window(start, end, ['time_ns'] + [c for c in columns if c != 'time_ns'])
+        else:
+            time_ns = self.column('time_ns')
+            mask = np.ones(self.rows, dtype=bool)
+            if start is not None:
+                mask &= time_ns >= _ns(start)
+            if end is not None:
+                mask &= time_ns < _ns(end)
+            order = np.flatnonzero(mask)
+            order = order[np.argsort(time_ns[order], kind='stable')]
+            window = {name: self.column(name)[order] for name in ['time_ns'] + [c for c in columns if c != 'time_ns']}
+        df = pd.DataFrame({name: np.asarray(values) for name, values in window.items()})
+        df.insert(0, '_time', df['time_ns'].to_numpy().astype('datetime64[ns]'))
+        return df
+
+
+class ColumnStoreWriter:
+    """Appends chunks of columns to a column store; readers see the rows once meta.json is updated."""
+
+    def __init__(self, path, dtypes=COLUMN_DTYPES, units='lsb'):
+        self.path = path
+        self.dtypes = dict(dtypes)
+        self.units = units
+        self.rows = 0
+        self.sorted = True
+        self._last_time = None
+        os.makedirs(path, exist_ok=True)
+        self._files = {name: open(os.path.join(path, f"{name}.bin"), 'wb') for name in self.dtypes}
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {'rows': self.rows, 'units': self.units, 'sorted': self.sorted, 'columns': self.dtypes}
+        tmp_path = os.path.join(self.path, META_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, META_FILE))
+
+    def append(self, columns):
+        count = len(columns['time_ns'])
+        if not count:
+            return
+        time_ns = np.asarray(columns['time_ns'], dtype=np.int64)
+        if (self._last_time is not None and time_ns[0] < self._last_time) or np.any(np.diff(time_ns) < 0):
+            self.sorted = False
+        self._last_time = int(time_ns[-1])
+        for name, f in self._files.items():
+            f.write(np.ascontiguousarray(columns[name], dtype=self.dtypes[name]).tobytes())
+            f.flush()
+        self.rows += count
+        self._write_meta()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _ns(value):
+    return int(value) if isinstance(value, (int, np.integer)) else int(pd.Timestamp(value).value)
+
+
+def _frame_columns(df):
+    columns = {'time_ns': df['time_ns'].to_numpy(np.int64) if 'time_ns' in df else to_time_ns(df['_time']),
+               'packet_id': df['packet_id'].to_numpy().astype(np.int64)}
+    for name in IMU_COLUMNS:
+        columns[name] = df[name].to_numpy(np.float32)
+    return columns
+
+
+def write_column_store(path, df, units='lsb'):
+    with ColumnStoreWriter(path, units=units) as writer:
+        writer.append(_frame_columns(df))
+    return ColumnStore(path)
+
+
+def convert_csv(csv_path, path, units='lsb', chunksize=500_000):
+    # streams a csv acquisition of any size into a column store
+    with ColumnStoreWriter(path, units=units) as writer:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            writer.append(_frame_columns(chunk))
+    return ColumnStore(path)
@@ -0,0 +1,44 @@
+import os
+import sys
+import pandas as pd
+from acquisition_store import IMU_COLUMNS, STORE_DIR, parse_run_name, write_acquisition
+
+# Converts the csv acquisitions of acquisitions/<campaign>/raw/ into the partitioned
+# Parquet store, acquisitions/store/<campaign>/
+curr_dir = os.path.dirname(os.path.abspath(__file__))
+acquisitions_dir = os.path.join(curr_dir, 'acquisitions')
+campaigns = ['onsite_test', 'synthetic_test']
+production_line = 'test'
+units = 'lsb'  # the raw csv files hold the sensor values as sent by the Nicla
+
+
+def convert_file(csv_path, root):
+    df = pd.read_csv(csv_path)
+    missing = [column for column in ['_time', 'packet_id'] + IMU_COLUMNS if column not in df.columns]
+    if missing:
+        print(f"Skipping {csv_path}: missing {', '.join(missing)}")
+        return []
+    device, run = parse_run_name(csv_path)
+    return write_acquisition(df, device, run, production_line=production_line, root=root, units=units)
+
+
+def main(campaign_names):
+    for campaign in campaign_names:
+        raw_dir = os.path.join(acquisitions_dir, campaign, 'raw')
+        root = os.path.join(STORE_DIR, campaign)
+        csv_size = parquet_size = 0
+        for directory, _, files in sorted(os.walk(raw_dir)):
+            for file_name in sorted(files):
+                if not file_name.endswith('.csv'):
+                    continue
+                csv_path = os.path.join(directory, file_name)
+                paths = convert_file(csv_path, root)
+                if paths:
+                    csv_size += os.path.getsize(csv_path)
+                    parquet_size += sum(os.path.getsize(path) for path in paths)
+                    print(f"{os.path.relpath(csv_path, acquisitions_dir)} -> {', '.join(os.path.relpath(p, root) for p in paths)}")
+        print(f"{campaign}: {csv_size / 1e6:.1f} MB of csv -> {parquet_size / 1e6:.1f} MB of parquet in {root}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or campaigns)
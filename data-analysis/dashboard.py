@@ -3,19 +3,35 @@ from dash import dcc, html, Input, Output, State, callback_context
 import plotly.graph_objs as go
 import plotly.express as px
 import numpy as np
-from scipy.interpolate import interp1d
-import ruptures as rpt
 import pandas as pd
 import base64
 import io
 import os
+from sphere_mesh import get_sphere_mesh
+from playback import PlaybackFrames, TIME_STEP, sphere_patch
+from experimental_curve.stress_curve import get_stress_curve
+from acquisition_store import IMU_COLUMNS
+from column_store import ColumnStore, is_column_store
+from zones import segment, zone_labels
+from impacts import LEVELS, impacts_from_frame
+from analysis_cache import AnalysisCache, analysis_key, content_hash, path_hash
 
 app = dash.Dash(__name__)
 
 df = None
-df_stress = None
+frames = None
 selected_row = 0
 
+# parameters of the analysis, part of the cache key of its results
+ANALYSIS_PARAMS = {
+    'num_zones': 5,  # change points between zones, None for a penalty-based count
+    'critical_accel': 4.0,
+    'apple_mass': 0.2,  # kg
+}
+# impact levels (g), an impact is one event of the impact table, whatever its duration
+critical_thresholds = list(LEVELS)
+analysis_cache = AnalysisCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis_cache'))
+
 # Layout of the app
 app.layout = html.Div([
     html.H1('Apple Impact Analysis', style={
@@ -49,6 +65,17 @@ app.layout = html.Div([
         },
         multiple=False
     ),
+    # acquisitions already on the server (csv, parquet or .cols column store) are opened in place
+    html.Div([
+        dcc.Input(id='acquisition-path', type='text', placeholder='or open an acquisition on the server by path',
+                  debounce=True, style={'width': '40%', 'padding': '8px', 'marginRight': '8px'}),
+        # only this time window of the acquisition is read, the whole acquisition when empty
+        dcc.Input(id='window-start', type='text', placeholder='from, e.g. 2024-02-15 10:00:00',
+                  debounce=True, style={'width': '15%', 'padding': '8px', 'marginRight': '8px'}),
+        dcc.Input(id='window-end', type='text', placeholder='to',
+                  debounce=True, style={'width': '15%', 'padding': '8px', 'marginRight': '8px'}),
+        html.Button('Open', id='open-button', n_clicks=0),
+    ], style={'textAlign': 'center', 'margin': '0 0 10px 0'}),
     html.Div([
         dcc.Graph(id='sphere-plot',
                   style={'display': 'inline-block', 'width': '100%'}),
@@ -80,9 +107,12 @@ app.layout = html.Div([
     html.Div([
         dcc.Graph(id='deformation-plot', style={'display': 'inline-block', 'width': '100%'}),
     ], style={'width': '49%', 'display': 'inline-block', 'vertical-align': 'top'}),
+
+    # faces currently highlighted on the sphere, used to send only the changed colors
+    dcc.Store(id='sphere-highlight'),
 ])
 
-# Callback to parse and load the CSV file and update plots based on sliders
+# Callback to parse and load the CSV file and build the plots
 @app.callback(
     Output('sphere-plot', 'figure'),
     Output('acceleration-plot', 'figure'),
@@ -90,112 +120,60 @@ app.layout = html.Div([
     Output('zone-plot', 'figure'),
     Output('time-slider', 'max'),
     Output('time-slider', 'marks'),
+    Output('sphere-highlight', 'data'),
     [Input('upload-csv', 'contents'),
-     Input('sphere-resolution-slider', 'value'),
-     Input('time-slider', 'value')],
+     Input('open-button', 'n_clicks')],
     [State('upload-csv', 'filename'),
-     State('acceleration-plot', 'figure'),
-     State('deformation-plot', 'figure'),
-     State('sphere-plot', 'figure')]
+     State('acquisition-path', 'value'),
+     State('window-start', 'value'),
+     State('window-end', 'value'),
+     State('sphere-resolution-slider', 'value'),
+     State('time-slider', 'value')]
 )
-def update_output(contents, sphere_resolution, time_slider_value, filename, accel_figure, deformation_figure, sphere_figure):
-    global df, df_stress
+def update_output(contents, n_clicks, filename, acquisition_path, window_start, window_end, sphere_resolution, time_slider_value):
+    global df, frames
     ctx = callback_context
 
-    # Process the CSV file upload
-    if ctx.triggered and ctx.triggered[0]['prop_id'] == 'upload-csv.contents':
-        if contents:
-
-            # get stress-strain curve data
-            curr_dir = os.path.dirname(os.path.abspath(__file__))
-            data_dir = os.path.join(curr_dir, 'experimental_curve', 'stress_deformation_curve.csv')
-            df_stress = pd.read_csv(data_dir, sep=',', header=1, names=['Deformation (mm)', 'Force (N)'])
-            # interpolate points every 0.01 mm
-            interp_x = np.arange(df_stress['Deformation (mm)'].min(), df_stress['Deformation (mm)'].max(), 0.01)
-            interp_y = interp1d(df_stress['Deformation (mm)'], df_stress['Force (N)'], kind='linear')(interp_x)
-            # Create new stress-strain curve DataFrame
-            df_stress = pd.DataFrame({'Deformation (mm)': interp_x, 'Force (N)': interp_y})
+    # Process the CSV file upload or the acquisition opened by path
+    trigger = ctx.triggered[0]['prop_id'] if ctx.triggered else None
+    if trigger in ('upload-csv.contents', 'open-button.n_clicks'):
+        if (contents if trigger == 'upload-csv.contents' else acquisition_path):
 
             # print file name
             # print(filename)
-            content_type, content_string = contents.split(',')
-            decoded = base64.b64decode(content_string)
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
- 
-            # convert the _time column to datetime for time series analysis
-            df['_time'] = pd.to_datetime(df['_time'])
-
-            # drop 'action' column
-            if 'action' in df.columns:
-                df = df.drop(columns=['action'])
-
-            # find the clusters of the zones
-            # calculate the magnitude of the acceleration and gyro
-            df['accel_mag'] = np.sqrt(df['accel_x']**2 + df['accel_y']**2 + df['accel_z']**2)
-            df['gyro_mag'] = np.sqrt(df['gyro_x']**2 + df['gyro_y']**2 + df['gyro_z']**2)
-
-            num_zones = 5
-            model = rpt.Window(model='l2').fit(df['accel_mag'].values)
-            # Predict change points. This method takes the penalty value as an argument.
-            change_points = model.predict(n_bkps=num_zones)
-            # Create an array of zone labels based on the change points
-            zone_labels = np.arange(len(change_points))
-            # Initialize a new column 'infer_zone' in the DataFrame with zeros
-            df['infer_zone'] = 0
-
-            # Loop through the change points and assign the appropriate zone labels
-            for i, change_point in enumerate(change_points):
-                if i == 0:
-                    df.loc[:change_point, 'infer_zone'] = zone_labels[i]
+            try:
+                if trigger == 'upload-csv.contents':
+                    content_type, content_string = contents.split(',')
+                    decoded = base64.b64decode(content_string)
+                    digest = content_hash(decoded)
+                    params = ANALYSIS_PARAMS
                 else:
-                    df.loc[change_points[i-1]:change_point, 'infer_zone'] = zone_labels[i]
-
-            # drop the 'accel_mag' and 'gyro_mag' columns
-            df = df.drop(columns=['accel_mag', 'gyro_mag'])
-            # resample the data to 0.01s intervals
-            sample_time = '0.01S'
-            df = df.resample(sample_time, on='_time').mean()
-            df = df.reset_index()
-
-            # interpolate the data to fill in missing values
-            df = df.interpolate(method='linear', limit_direction='both')
-            df['magnitude'] = np.sqrt(df['accel_x']**2 + df['accel_y']**2 + df['accel_z']**2)
-            critical_accel = 4.0
-            df['critical_magnitude'] = np.clip(df['magnitude'], 0, critical_accel) / critical_accel
-            df['infer_zone'] = df['infer_zone'].astype(int)
-            # Define impact thresholds for impact detection
-            critical_thresholds = [1.0, 2.0, 3.0]
-
-            # Create a new column 'impact' with default value 0
-            df['impact'] = 0
-
-            # Loop through the thresholds and assign the appropriate impact values
-            for i, threshold in enumerate(critical_thresholds):
-                if i == 0:
-                    df.loc[df['magnitude'] > threshold, 'impact'] = i + 1
-                else:
-                    df.loc[df['magnitude'] > threshold, 'impact'] = i + 1
-
-           # Handle the case where magnitude is zero to avoid division by zero
-            mask = df['magnitude'] != 0
-
-            # Normalize the acceleration values only where magnitude is non-zero
-            df.loc[mask, 'norm_accel_x'] = df.loc[mask, 'accel_x'] / df.loc[mask, 'magnitude']
-            df.loc[mask, 'norm_accel_y'] = df.loc[mask, 'accel_y'] / df.loc[mask, 'magnitude']
-            df.loc[mask, 'norm_accel_z'] = df.loc[mask, 'accel_z'] / df.loc[mask, 'magnitude']
-
-            # Where magnitude is zero, set normalized accelerations to zero
-            df.loc[~mask, 'norm_accel_x'] = 0
-            df.loc[~mask, 'norm_accel_y'] = 0
-            df.loc[~mask, 'norm_accel_z'] = 0
-
-            # add deformation and force columns
-            apple_mass = 0.2  # kg
-            df['Force (N)'] = df['magnitude'] * 9.806 * apple_mass
-            df['Deformation (mm)'] = df['Force (N)'].apply(interpolate_deformation)
-
-            # Sphere plot
-            sphere_figure = update_sphere(sphere_resolution)
+                    digest = path_hash(os.path.expanduser(acquisition_path.strip()))
+                    start = pd.Timestamp(window_start.strip()) if window_start and window_start.strip() else None
+                    end = pd.Timestamp(window_end.strip()) if window_end and window_end.strip() else None
+                    params = dict(ANALYSIS_PARAMS, window=[str(start), str(end)])
+
+                # the same content analysed with the same parameters is not analysed again
+                key = analysis_key(digest, params)
+                df = analysis_cache.get(key)
+                if df is None:
+                    if trigger == 'upload-csv.contents':
+                        df = pd.read_csv(io.BytesIO(decoded))
+                    else:
+                        df = load_acquisition(acquisition_path, start, end)
+                    if df.empty:
+                        raise ValueError("no samples in the time window")
+                    df = analyse(df, **ANALYSIS_PARAMS)
+                    analysis_cache.put(key, df)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Couldn't open {filename if trigger == 'upload-csv.contents' else acquisition_path}: {e}")
+                raise dash.exceptions.PreventUpdate
+
+            # one row per impact
+            impacts = impacts_from_frame(df, critical_thresholds)
+
+            # precompute the per-row cursor values for the playback
+            frames = PlaybackFrames(df)
 
             # Acceleration plot
             accel_figure = update_acceleration_plot(df, time_slider_value)
@@ -203,56 +181,150 @@ def update_output(contents, sphere_resolution, time_slider_value, filename, acce
             # Deformation plot
             deformation_figure = update_deformation_plot(df, time_slider_value)
 
+            # Sphere plot
+            sphere_figure = update_sphere(sphere_resolution)
+            highlight = frames.closest_faces(selected_row, sphere_resolution).tolist()
+
             # Zone plot
-            zone_figure = update_zone_plot(df)
+            zone_figure = update_zone_plot(impacts, df['infer_zone'].unique())
 
             # Update time slider max and marks
             max_time = (len(df['_time']) - 1)
-            max_time_seconds = (len(df['_time']) - 1) * 0.01  # 0.01s time step
+            max_time_seconds = (len(df['_time']) - 1) * TIME_STEP
             # set max time slider value to max_time_seconds
             marks = {i: str(round(i, 2)) for i in np.linspace(0, max_time_seconds, 11)}
 
-            return sphere_figure, accel_figure, deformation_figure, zone_figure, max_time_seconds, marks
-
-    # Update sphere resolution
-    elif ctx.triggered and ctx.triggered[0]['prop_id'] == 'sphere-resolution-slider.value' or \
-            ctx.triggered and ctx.triggered[0]['prop_id'] == 'time-slider.value':
-        
-        sphere_figure = update_sphere(sphere_resolution)
-        accel_figure = update_acceleration_plot(df, time_slider_value)
-        deformation_figure = update_deformation_plot(df, time_slider_value)
-        return sphere_figure, accel_figure, deformation_figure, dash.no_update, dash.no_update, dash.no_update
+            return sphere_figure, accel_figure, deformation_figure, zone_figure, max_time_seconds, marks, highlight
 
     raise dash.exceptions.PreventUpdate
 
-def interpolate_deformation(force_n):
-    global df_stress
-    # Use your force-deformation data to interpolate the deformation
-    if force_n < df_stress['Force (N)'].min():
-        return df_stress['Deformation (mm)'].min()
-    elif force_n > df_stress['Force (N)'].max():
-        return df_stress['Deformation (mm)'].max()
-    else:
-        return np.interp(force_n, df_stress['Force (N)'], df_stress['Deformation (mm)'])
-
-def update_zone_plot(df):
+def analyse(df, num_zones, critical_accel, apple_mass):
+    # derived per-row columns and zone segmentation of an acquisition
+    # convert the _time column to datetime for time series analysis
+    df['_time'] = pd.to_datetime(df['_time'])
+
+    # drop 'action' column
+    if 'action' in df.columns:
+        df = df.drop(columns=['action'])
+
+    # find the clusters of the zones
+    # calculate the magnitude of the acceleration and gyro
+    df['accel_mag'] = np.sqrt(df['accel_x']**2 + df['accel_y']**2 + df['accel_z']**2)
+    df['gyro_mag'] = np.sqrt(df['gyro_x']**2 + df['gyro_y']**2 + df['gyro_z']**2)
+
+    # change points found on the coarse signal and refined at full rate, labels by searchsorted
+    change_points = segment(df['accel_mag'].to_numpy(), n_bkps=num_zones)
+    df['infer_zone'] = zone_labels(len(df), change_points)
+
+    # drop the 'accel_mag' and 'gyro_mag' columns
+    df = df.drop(columns=['accel_mag', 'gyro_mag'])
+    # resample the data to 0.01s intervals
+    sample_time = '0.01S'
+    df = df.resample(sample_time, on='_time').mean()
+    df = df.reset_index()
+
+    # interpolate the data to fill in missing values
+    df = df.interpolate(method='linear', limit_direction='both')
+    df['magnitude'] = np.sqrt(df['accel_x']**2 + df['accel_y']**2 + df['accel_z']**2)
+    df['critical_magnitude'] = np.clip(df['magnitude'], 0, critical_accel) / critical_accel
+    df['infer_zone'] = df['infer_zone'].astype(int)
+
+   # Handle the case where magnitude is zero to avoid division by zero
+    mask = df['magnitude'] != 0
+
+    # Normalize the acceleration values only where magnitude is non-zero
+    df.loc[mask, 'norm_accel_x'] = df.loc[mask, 'accel_x'] / df.loc[mask, 'magnitude']
+    df.loc[mask, 'norm_accel_y'] = df.loc[mask, 'accel_y'] / df.loc[mask, 'magnitude']
+    df.loc[mask, 'norm_accel_z'] = df.loc[mask, 'accel_z'] / df.loc[mask, 'magnitude']
+
+    # Where magnitude is zero, set normalized accelerations to zero
+    df.loc[~mask, 'norm_accel_x'] = 0
+    df.loc[~mask, 'norm_accel_y'] = 0
+    df.loc[~mask, 'norm_accel_z'] = 0
+
+    # add deformation and force columns
+    stress_curve = get_stress_curve()
+    df['Force (N)'] = stress_curve.force(df['magnitude'].to_numpy(), apple_mass)
+    df['Deformation (mm)'] = stress_curve.deformation(df['Force (N)'].to_numpy())
+    return df
+
+def load_acquisition(path, start=None, end=None):
+    # read the [start, end) window of a server-side acquisition in place, without the browser upload and its base64 copy
+    path = os.path.expanduser(path.strip())
+    columns = ['packet_id'] + IMU_COLUMNS
+    if is_column_store(path):
+        # memory-mapped columns, only the rows of the window are copied into the DataFrame
+        return ColumnStore(path).to_frame(start, end, columns=columns).drop(columns='time_ns')
+    if path.endswith('.parquet'):
+        filters = ([('time_ns', '>=', start.value)] if start is not None else []) + \
+                  ([('time_ns', '<', end.value)] if end is not None else [])
+        df = pd.read_parquet(path, columns=['time_ns'] + columns, filters=filters or None)
+        df.insert(0, '_time', df.pop('time_ns').to_numpy().astype('datetime64[ns]'))
+        return df
+    df = pd.read_csv(path)
+    if start is not None or end is not None:
+        time = pd.to_datetime(df['_time'])
+        df = df[((time >= start) if start is not None else True) & ((time < end) if end is not None else True)]
+        df = df.reset_index(drop=True)
+    return df
+
+# Callback to rebuild the sphere when its resolution changes
+@app.callback(
+    Output('sphere-plot', 'figure', allow_duplicate=True),
+    Output('sphere-highlight', 'data', allow_duplicate=True),
+    Input('sphere-resolution-slider', 'value'),
+    prevent_initial_call=True
+)
+def update_sphere_resolution(sphere_resolution):
+    if frames is None:
+        raise dash.exceptions.PreventUpdate
+
+    sphere_figure = update_sphere(sphere_resolution)
+    highlight = frames.closest_faces(selected_row, sphere_resolution).tolist()
+    return sphere_figure, highlight
+
+# Callback for the interactive playback, only the cursor and the changed faces are sent
+@app.callback(
+    Output('sphere-plot', 'figure', allow_duplicate=True),
+    Output('acceleration-plot', 'figure', allow_duplicate=True),
+    Output('deformation-plot', 'figure', allow_duplicate=True),
+    Output('sphere-highlight', 'data', allow_duplicate=True),
+    Input('time-slider', 'value'),
+    [State('sphere-resolution-slider', 'value'),
+     State('sphere-highlight', 'data')],
+    prevent_initial_call=True
+)
+def update_playback(time_slider_value, sphere_resolution, highlight):
+    global selected_row
+    if frames is None:
+        raise dash.exceptions.PreventUpdate
+
+    row_index = frames.row_index(time_slider_value)
+    if row_index == selected_row and highlight is not None:
+        raise dash.exceptions.PreventUpdate
+    selected_row = row_index
+
+    current_faces = frames.closest_faces(row_index, sphere_resolution)
+    return (sphere_patch(highlight or [], current_faces),
+            frames.acceleration_patch(row_index),
+            frames.deformation_patch(row_index),
+            current_faces.tolist())
+
+def update_zone_plot(impacts, zones):
     # set colors [green, yellow, orange, red]
     colors = ['#00cc44', '#ffd633', '#ffa31a', '#ff3333']
 
-    # plot histogram of the impact for each zone, zones are the x axis and the impact is the y axis
+    # plot histogram of the impacts for each zone, zones are the x axis and the impact count is the y axis
     fig = px.histogram(
-        df,
-        x='infer_zone',
-        y='impact',
-        color='impact',
-        color_discrete_sequence=colors,
-        # nbins=len(df['infer_zone'].unique()),
-        labels={'infer_zone': 'Zone', 'impact': 'Impact'},
+        impacts,
+        x='zone',
+        color='level',
+        color_discrete_map={level: color for level, color in enumerate(colors)},
+        category_orders={'level': sorted(impacts['level'].unique())},
+        labels={'zone': 'Zone', 'level': 'Impact'},
         title='Impact Distribution',
         # make the bars stacked
         barmode='stack',
-        # remove the gap between bars
-        # barnorm='percent',
         # show the counts
         histfunc='count',
     )
@@ -266,14 +338,14 @@ def update_zone_plot(df):
             'xanchor': 'center',
             'yanchor': 'top'},
         xaxis_title='Zone',
-        yaxis_title='Impact',
+        yaxis_title='Impacts',
         xaxis=dict(showline=True, showgrid=False, showticklabels=True, linecolor='rgb(204, 204, 204)', linewidth=2, ticks='outside', tickfont=dict(family='Arial', size=12, color='rgb(82, 82, 82)')),
         yaxis=dict(showgrid=False, zeroline=False, showline=False, showticklabels=True),
         autosize=True,
         margin=dict(autoexpand=True, l=100, r=20, t=110),
         bargap=0.2,
         # set x ticks
-        xaxis_tickvals=df['infer_zone'].unique(),
+        xaxis_tickvals=zones,
 
     )
 
@@ -303,8 +375,7 @@ def update_deformation_plot(df, time_slider_value):
     ))
 
     # Determine the row index based on the slider value
-    time_step = 0.01  # Time step in seconds
-    row_index = int(time_slider_value / time_step)
+    row_index = int(time_slider_value / TIME_STEP)
     row_index = min(row_index, len(df) - 1)  # Ensure the index doesn't exceed the DataFrame length
 
     selected_row = row_index
@@ -362,8 +433,7 @@ def update_acceleration_plot(df, time_slider_value):
     accel_figure.add_trace(go.Scatter(x=df['_time'], y=df['accel_z'], mode='lines', name='Accel Z'))
 
     # Determine the row index based on the slider value
-    time_step = 0.01  # Time step in seconds
-    row_index = int(time_slider_value / time_step)
+    row_index = int(time_slider_value / TIME_STEP)
     row_index = min(row_index, len(df) - 1)  # Ensure the index doesn't exceed the DataFrame length
 
     selected_row = row_index
@@ -409,65 +479,24 @@ def update_sphere(resolution):
     global selected_row, df
     # Sphere parameters
     radius = 1
-    theta = np.linspace(0, 2 * np.pi, resolution)
-    phi = np.linspace(0, np.pi, resolution)
-    theta, phi = np.meshgrid(theta, phi)
-    x = radius * np.sin(phi) * np.cos(theta)
-    y = radius * np.sin(phi) * np.sin(theta)
-    z = radius * np.cos(phi)
-
-    # Flatten the arrays for triangulation
-    x_flat = x.flatten()
-    y_flat = y.flatten()
-    z_flat = z.flatten()
-
-    # Create a triangulation of the sphere's surface
-    triangles = []
-
-    # Initialize a list to keep track of the closest triangles and their distances
-    closest_triangles = []
-
-    # Loop over the theta and phi angles
-    for i in range(len(theta) - 1):
-        for j in range(len(phi) - 1):
-            # Append the indices of the vertices of each triangle
-            triangles.append([i * len(phi) + j, (i + 1) * len(phi) + j, i * len(phi) + (j + 1)])
-            triangles.append([(i + 1) * len(phi) + j, (i + 1) * len(phi) + (j + 1), i * len(phi) + (j + 1)])
-
-            # Calculate the distance between the current point and the normalized acceleration vector
-            dist = np.sqrt((df['norm_accel_x'].iloc[selected_row] - x[i][j])**2 +
-                        (df['norm_accel_y'].iloc[selected_row] - y[i][j])**2 +
-                        (df['norm_accel_z'].iloc[selected_row] - z[i][j])**2)
-
-            # Append the triangle index and its distance to the list
-            idx_triangle = len(triangles) - 2
-            closest_triangles.append((idx_triangle, dist))
-            closest_triangles.append((idx_triangle + 1, dist))
-
-
-    # Sort the list by distance and get the top N triangles
-    number_closest_triangles = int(df["critical_magnitude"].iloc[selected_row] * 1000)
-
-    closest_triangles.sort(key=lambda x: x[1])
-    top_triangles = [idx for idx, _ in closest_triangles[:number_closest_triangles]]
-
-    # Convert to a numpy array
-    triangles = np.array(triangles)
-
-    # Initialize face colors and set the top N triangles to a shade of red
-    face_colors = ['yellow'] * len(triangles)
-    for idx in top_triangles:
-        # color_intensity = int((1 - df["critical_magnitude"].iloc[selected_row]) * 255)
-        color_intensity = 255
-        face_colors[idx] = f'rgb({color_intensity}, 0, 0)'
+    sphere = get_sphere_mesh(resolution, radius)
+
+    # Normalized acceleration vector at the selected row
+    row = df.iloc[selected_row]
+    direction = (row['norm_accel_x'], row['norm_accel_y'], row['norm_accel_z'])
+
+    # Color the top N triangles closest to the acceleration vector in red
+    number_closest_triangles = int(row['critical_magnitude'] * 1000)
+    face_colors = sphere.face_colors(direction, number_closest_triangles)
+
     # Create the mesh object
     mesh = go.Mesh3d(
-        x=x_flat,
-        y=y_flat,
-        z=z_flat,
-        i=triangles[:,0],
-        j=triangles[:,1],
-        k=triangles[:,2],
+        x=sphere.x,
+        y=sphere.y,
+        z=sphere.z,
+        i=sphere.i,
+        j=sphere.j,
+        k=sphere.k,
         facecolor=face_colors
     )
 
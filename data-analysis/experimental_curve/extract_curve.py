@@ -1,21 +1,18 @@
-import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-import numpy as np
-from scipy.interpolate import interp1d
 import os
+from stress_curve import StressCurve
 
 # get absolute path of the current directory
 curr_dir = os.path.dirname(os.path.abspath(__file__))
 file_name = 'stress_deformation_curve.csv'
 data_dir = os.path.join(curr_dir, file_name)
 
-# Create a DataFrame
-df = pd.read_csv(data_dir, sep=',', header=1, names=['Deformation (mm)', 'Force (N)'])
-
-# Interpolate points every 0.01 mm
-interp_x = np.arange(df['Deformation (mm)'].min(), df['Deformation (mm)'].max(), 0.01)
-interp_y = interp1d(df['Deformation (mm)'], df['Force (N)'], kind='linear')(interp_x)
+# Load the curve and interpolate points every 0.01 mm
+stress_curve = StressCurve(data_dir, step=0.01)
+df = stress_curve.raw
+interp_x = stress_curve.deformation_mm
+interp_y = stress_curve.force_n
 sns.set()
 # Plot using Seaborn
 plt.plot(interp_x, interp_y, linestyle='solid', label='Interpolated Line')
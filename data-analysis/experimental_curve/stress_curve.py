@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from scipy.interpolate import interp1d
+
+# Default experimental force-deformation curve of an apple
+DEFAULT_CURVE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stress_deformation_curve.csv')
+
+GRAVITY = 9.806  # m/s^2
+APPLE_MASS = 0.2  # kg
+
+
+class StressCurve:
+    """Force-deformation curve interpolated once and mapped over whole arrays."""
+
+    def __init__(self, path=DEFAULT_CURVE_PATH, step=0.01):
+        self.path = path
+        self.step = step
+
+        # Original measured points
+        self.raw = pd.read_csv(path, sep=',', header=1, names=['Deformation (mm)', 'Force (N)'])
+
+        # Interpolate points every step mm
+        self.deformation_mm = np.arange(self.raw['Deformation (mm)'].min(), self.raw['Deformation (mm)'].max(), step)
+        self.force_n = interp1d(self.raw['Deformation (mm)'], self.raw['Force (N)'], kind='linear')(self.deformation_mm)
+
+        # Bounds used to clip forces outside the curve
+        self.min_force = self.force_n.min()
+        self.max_force = self.force_n.max()
+        self.min_deformation = self.deformation_mm.min()
+        self.max_deformation = self.deformation_mm.max()
+
+        # np.interp needs increasing forces, so invert the loading envelope of the curve
+        self._force_envelope = np.maximum.accumulate(self.force_n)
+
+        for array in (self.deformation_mm, self.force_n, self._force_envelope):
+            array.setflags(write=False)
+
+    def to_dataframe(self):
+        return pd.DataFrame({'Deformation (mm)': self.deformation_mm, 'Force (N)': self.force_n})
+
+    def deformation(self, force_n):
+        # deformation (mm) for a scalar or an array of forces (N), clipped to the curve
+        return np.interp(np.asarray(force_n, dtype=float), self._force_envelope, self.deformation_mm,
+                         left=self.min_deformation, right=self.max_deformation)
+
+    @staticmethod
+    def force(accel_g, apple_mass=APPLE_MASS):
+        # impact force (N) from the acceleration magnitude (g)
+        return np.asarray(accel_g, dtype=float) * GRAVITY * apple_mass
+
+    def deformation_from_accel(self, accel_g, apple_mass=APPLE_MASS):
+        return self.deformation(self.force(accel_g, apple_mass))
+
+
+@lru_cache(maxsize=4)
+def get_stress_curve(path=DEFAULT_CURVE_PATH, step=0.01):
+    # load and interpolate each curve file only once per process
+    return StressCurve(path, step)
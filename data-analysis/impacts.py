@@ -0,0 +1,92 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# the impact definition (LEVELS, HYSTERESIS, REFRACTORY, the trigger is LEVELS[0]) is shared with the rollups of the master
+from smartapple.impacts import HYSTERESIS, LEVELS, REFRACTORY
+
+# columns of an impact table and their dtypes, empty tables too, so that the tables of all the runs concatenate
+IMPACT_DTYPES = {'start': 'datetime64[ns]', 'end': 'datetime64[ns]', 'duration_s': 'float64',
+                 'peak_time': 'datetime64[ns]', 'peak_g': 'float64', 'level': 'int64', 'energy_g2s': 'float64',
+                 'peak_deformation_mm': 'float64', 'zone': 'int64', 'dir_x': 'float64', 'dir_y': 'float64',
+                 'dir_z': 'float64'}
+IMPACT_COLUMNS = list(IMPACT_DTYPES)
+
+
+def _runs(mask):
+    # [start, end) of the runs of True
+    edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _ranges(starts, ends):
+    # indices of the samples of the sorted, disjoint and non-empty ranges [start, end), and the offset of each range
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum()), offsets
+
+
+def extract_impacts(time_ns, magnitude, levels=LEVELS, trigger=None, hysteresis=HYSTERESIS, refractory=REFRACTORY,
+                    deformation=None, zone=None, direction=None):
+    """One row per impact of a magnitude series (g) sampled at time_ns (sorted int64 ns).
+
+    The trigger is the lowest of the levels by default (TRIGGER for the default levels), so
+    every impact has a level. deformation, zone (per sample) and direction (n x 3 unit
+    vectors) are read at the peak.
+    """
+    trigger = min(levels) if trigger is None else trigger
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    magnitude = np.asarray(magnitude, dtype=np.float64)
+
+    starts, ends = _runs(magnitude > trigger - hysteresis)
+    # runs that never reach the trigger are noise around the release level
+    if len(starts):
+        samples, offsets = _ranges(starts, ends)
+        keep = np.maximum.reduceat(magnitude[samples], offsets) > trigger
+        starts, ends = starts[keep], ends[keep]
+    if not len(starts):
+        return pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in IMPACT_DTYPES.items()})
+
+    # merge the runs separated by less than the refractory period
+    first = np.concatenate([[True], time_ns[starts[1:]] - time_ns[ends[:-1] - 1] >= refractory * 1e9])
+    starts = starts[first]
+    ends = ends[np.concatenate([first[1:], [True]])]
+
+    # sample periods, the last sample takes the one before it
+    dt = np.diff(time_ns, append=2 * time_ns[-1] - time_ns[-2] if len(time_ns) > 1 else time_ns[-1]) / 1e9
+    samples, offsets = _ranges(starts, ends)
+    peak_g = np.maximum.reduceat(magnitude[samples], offsets)
+    energy = np.add.reduceat(magnitude[samples] ** 2 * dt[samples], offsets)
+    # first sample of each event at its peak
+    event = np.repeat(np.arange(len(starts)), ends - starts)
+    at_peak = magnitude[samples] == peak_g[event]
+    _, first_peak = np.unique(event[at_peak], return_index=True)
+    peak_index = samples[at_peak][first_peak]
+
+    table = pd.DataFrame({
+        'start': time_ns[starts].astype('datetime64[ns]'),
+        'end': (time_ns[ends - 1] + (dt[ends - 1] * 1e9).astype(np.int64)).astype('datetime64[ns]'),
+        'peak_time': time_ns[peak_index].astype('datetime64[ns]'),
+        'peak_g': peak_g,
+        'level': np.searchsorted(np.sort(levels), peak_g, side='left'),
+        'energy_g2s': energy,
+        'peak_deformation_mm': np.asarray(deformation, dtype=np.float64)[peak_index] if deformation is not None else np.nan,
+        'zone': np.asarray(zone)[peak_index] if zone is not None else -1,
+    })
+    table.insert(2, 'duration_s', (table['end'] - table['start']).dt.total_seconds())
+    direction = np.asarray(direction, dtype=np.float64)[peak_index] if direction is not None else np.full((len(starts), 3), np.nan)
+    table['dir_x'], table['dir_y'], table['dir_z'] = direction[:, 0], direction[:, 1], direction[:, 2]
+    return table[IMPACT_COLUMNS].astype(IMPACT_DTYPES)
+
+
+def impacts_from_frame(df, levels=LEVELS, trigger=None, hysteresis=HYSTERESIS, refractory=REFRACTORY):
+    # impact table of an analysed dashboard frame (_time, magnitude and the derived columns)
+    return extract_impacts(df['_time'].to_numpy('datetime64[ns]').astype(np.int64), df['magnitude'].to_numpy(),
+                           levels, trigger, hysteresis, refractory,
+                           deformation=df['Deformation (mm)'].to_numpy() if 'Deformation (mm)' in df else None,
+                           zone=df['infer_zone'].to_numpy() if 'infer_zone' in df else None,
+                           direction=df[['norm_accel_x', 'norm_accel_y', 'norm_accel_z']].to_numpy()
+                           if 'norm_accel_x' in df else None)
@@ -0,0 +1,60 @@
+import numpy as np
+from dash import Patch
+from sphere_mesh import get_sphere_mesh, BASE_COLOR, IMPACT_COLOR
+
+# Time step of the resampled data and of the time slider (s)
+TIME_STEP = 0.01
+
+
+class PlaybackFrames:
+    """Per-row cursor values precomputed after an upload for interactive playback."""
+
+    def __init__(self, df):
+        # compact copies of the columns needed to move the cursor
+        self.time = df['_time'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').to_numpy()
+        self.accel = df[['accel_x', 'accel_y', 'accel_z']].to_numpy(dtype=np.float32)
+        self.deformation = df['Deformation (mm)'].to_numpy(dtype=np.float32)
+        self.direction = df[['norm_accel_x', 'norm_accel_y', 'norm_accel_z']].to_numpy(dtype=np.float32)
+        self.n_closest = (df['critical_magnitude'].to_numpy() * 1000).astype(np.int32)
+
+    def __len__(self):
+        return len(self.time)
+
+    def row_index(self, time_slider_value):
+        row_index = int(round((time_slider_value or 0) / TIME_STEP))
+        return min(max(row_index, 0), len(self) - 1)
+
+    def closest_faces(self, row_index, resolution):
+        sphere = get_sphere_mesh(resolution)
+        return sphere.closest_faces(self.direction[row_index], self.n_closest[row_index])
+
+    def acceleration_patch(self, row_index):
+        # move the three markers and the vertical line of the acceleration plot
+        current_time = self.time[row_index]
+        patch = Patch()
+        for trace_idx, value in zip((3, 4, 5), self.accel[row_index]):
+            patch['data'][trace_idx]['x'] = [current_time]
+            patch['data'][trace_idx]['y'] = [float(value)]
+        patch['layout']['shapes'][0]['x0'] = current_time
+        patch['layout']['shapes'][0]['x1'] = current_time
+        return patch
+
+    def deformation_patch(self, row_index):
+        # move the marker and the vertical line of the deformation plot
+        current_time = self.time[row_index]
+        patch = Patch()
+        patch['data'][1]['x'] = [current_time]
+        patch['data'][1]['y'] = [float(self.deformation[row_index])]
+        patch['layout']['shapes'][0]['x0'] = current_time
+        patch['layout']['shapes'][0]['x1'] = current_time
+        return patch
+
+
+def sphere_patch(previous_faces, current_faces):
+    # recolor only the faces that entered or left the highlighted set
+    patch = Patch()
+    for idx in np.setdiff1d(previous_faces, current_faces, assume_unique=True):
+        patch['data'][0]['facecolor'][int(idx)] = BASE_COLOR
+    for idx in np.setdiff1d(current_faces, previous_faces, assume_unique=True):
+        patch['data'][0]['facecolor'][int(idx)] = IMPACT_COLOR
+    return patch
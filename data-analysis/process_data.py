@@ -1,107 +1,240 @@
+import argparse
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from experimental_curve.stress_curve import get_stress_curve
+from impacts import LEVELS, extract_impacts
+from zones import segment, zone_labels
 
-# Get current directory and file directory
+# Get current directory and the default acquisitions root (raw/ and processed/ trees)
 curr_dir = os.path.dirname(os.path.abspath(__file__))
-date_folder = '20240215'
-file_dir = os.path.join(curr_dir, 'acquisitions/onsite_test/raw/', date_folder)
-processed_dir = os.path.join(curr_dir, 'acquisitions/onsite_test/processed', date_folder)
-
-# file_dir = os.path.join(curr_dir, 'acquisitions/synthetic_test/raw/')
-# processed_dir = os.path.join(curr_dir, 'acquisitions/synthetic_test/processed')
-
-# Create the processed directory if it does not exist
-if not os.path.exists(processed_dir):
-    os.makedirs(processed_dir)
-
-file_name = 'apple1_rangetest_zone4.csv'
-# Read CSV file into a Pandas DataFrame
-df = pd.read_csv(file_dir+'/'+file_name)
+acquisitions_root = os.path.join(curr_dir, 'acquisitions/onsite_test')
+# acquisitions_root = os.path.join(curr_dir, 'acquisitions/synthetic_test')
 
 # Conversion factors from datasheet
 accel_sensitivity = 4096.0  # Sensitivity for accelerometer in LSB/g
 gyro_sensitivity = 16.4    # Sensitivity for gyroscope in LSB/°/s
-
-# Convert accelerometer and gyroscope data to standard units
-df['accel_x'] /= accel_sensitivity
-df['accel_y'] /= accel_sensitivity
-df['accel_z'] /= accel_sensitivity
-df['gyro_x'] /= gyro_sensitivity
-df['gyro_y'] /= gyro_sensitivity
-df['gyro_z'] /= gyro_sensitivity
-
-# Convert '_time' to datetime
-df['_time'] = pd.to_datetime(df['_time'])
-
-# add 1 hour to '_time' to convert from UTC to EST
-df['_time'] += pd.Timedelta(hours=1)
-
-# Calculate the time difference between each row and add it as a new column called 'time_diff'
-df['time_diff'] = df['_time'].diff().dt.total_seconds().fillna(0)
-
-# Exclude non-numeric columns from calculations
-numeric_columns = df.select_dtypes(include=['float64']).columns
-# remove 'packet_id' and 'quat_x', 'quat_y', 'quat_z', 'quat_w' from numeric_columns
-numeric_columns = numeric_columns.drop(['quat_x', 'quat_y', 'quat_z', 'quat_w', 'time_diff'])
-
-# save the processed data to a new csv file
-df.to_csv(processed_dir +'/'+ file_name, index=False)
-
-# Create a subplot with 3 rows and 1 column
-fig = make_subplots(rows=5, cols=1)
-
-# Define dropdown buttons for each sensor type
-accel_dropdown = [dict(label='X direction', method='update', args=[{'visible': [True, False, False, True, False, False, True, False, False]}, {'title': 'X direction'}]),
-                  dict(label='Y direction', method='update', args=[{'visible': [False, True, False, False, True, False, False, True, False]}, {'title': 'Y direction'}]),
-                  dict(label='Z direction', method='update', args=[{'visible': [False, False, True, False, False, True, False, False, True]}, {'title': 'Z direction'}])]
-
-# Add traces for each sensor type
-fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_x'], mode='lines', name='accel_x', visible=True, connectgaps=False), row=1, col=1)
-fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_y'], mode='lines', name='accel_y', visible=True, connectgaps=False), row=1, col=1)
-fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_z'], mode='lines', name='accel_z', visible=True, connectgaps=False), row=1, col=1)
-
-fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_x'], mode='lines', name='gyro_x', visible=True, connectgaps=False), row=2, col=1)
-fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_y'], mode='lines', name='gyro_y', visible=True, connectgaps=False), row=2, col=1)
-fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_z'], mode='lines', name='gyro_z', visible=True, connectgaps=False), row=2, col=1)
-
-fig.add_trace(go.Scatter(x=df['_time'], y=df['quat_x'], mode='lines', name='quat_x', visible=True, connectgaps=False), row=3, col=1)
-fig.add_trace(go.Scatter(x=df['_time'], y=df['quat_y'], mode='lines', name='quat_y', visible=True, connectgaps=False), row=3, col=1)
-fig.add_trace(go.Scatter(x=df['_time'], y=df['quat_z'], mode='lines', name='quat_z', visible=True, connectgaps=False), row=3, col=1)
-
-# plot the acceleration magnitude
-df['accel_magnitude'] = (df['accel_x']**2 + df['accel_y']**2 + df['accel_z']**2)**0.5
-fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_magnitude'], mode='lines', name='accel_magnitude', visible=True, connectgaps=False), row=4, col=1)
-
-# plot gyro magnitude
-df['gyro_magnitude'] = (df['gyro_x']**2 + df['gyro_y']**2 + df['gyro_z']**2)**0.5
-fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_magnitude'], mode='lines', name='gyro_magnitude', visible=True, connectgaps=False), row=5, col=1)
-
-# Add dropdown buttons for each sensor type
-fig.update_layout(
-    updatemenus=[
-        dict(type='buttons', showactive=True, buttons=[dict(label='Show All', method='update', args=[{'visible': [True]*9}, {'title': 'Show All'}])], x=0.2, xanchor='left', y=1.1, yanchor='top'),
-        dict(type='dropdown', active=0, buttons=accel_dropdown, x=0.3, xanchor='left', y=1.1, yanchor='top'),
-    ]
-)
-
-# Update xaxis properties
-fig.update_xaxes(title_text='Time', row=1, col=1)
-fig.update_xaxes(title_text='Time', row=2, col=1)
-fig.update_xaxes(title_text='Time', row=3, col=1)
-fig.update_xaxes(title_text='Time', row=4, col=1)
-fig.update_xaxes(title_text='Time', row=5, col=1)
-
-# Update yaxis properties
-fig.update_yaxes(title_text='Acceleration (g)', row=1, col=1)
-fig.update_yaxes(title_text='Gyroscope (°/s)', row=2, col=1)
-fig.update_yaxes(title_text='Quaternions', row=3, col=1)
-fig.update_yaxes(title_text='Acceleration Magnitude (g)', row=4, col=1)
-fig.update_yaxes(title_text='Gyroscope Magnitude (°/s)', row=5, col=1)
-
-# Update title and height
-fig.update_layout(title_text='Sensor Data', height=1000)
-
-# Show plot
-fig.show()
+# add 1 hour to '_time' to convert from UTC to local time
+time_offset = pd.Timedelta(hours=1)
+# impact table of each file: zone change points and impact levels (g), as in the dashboard
+num_zones = 5
+critical_thresholds = list(LEVELS)
+
+# Bump when the processing changes, so that every file is processed again
+PROCESSING_VERSION = 5
+MANIFEST_FILE = '.manifest.json'
+
+
+def process_file(raw_path, processed_path, impacts_path, run):
+    # Read CSV file into a Pandas DataFrame
+    df = pd.read_csv(raw_path)
+
+    # Convert accelerometer and gyroscope data to standard units
+    df['accel_x'] /= accel_sensitivity
+    df['accel_y'] /= accel_sensitivity
+    df['accel_z'] /= accel_sensitivity
+    df['gyro_x'] /= gyro_sensitivity
+    df['gyro_y'] /= gyro_sensitivity
+    df['gyro_z'] /= gyro_sensitivity
+
+    # Convert '_time' to datetime
+    df['_time'] = pd.to_datetime(df['_time'])
+    df['_time'] += time_offset
+
+    # Calculate the time difference between each row and add it as a new column called 'time_diff'
+    df['time_diff'] = df['_time'].diff().dt.total_seconds().fillna(0)
+
+    # Calculate the acceleration and gyro magnitude
+    df['accel_magnitude'] = (df['accel_x']**2 + df['accel_y']**2 + df['accel_z']**2)**0.5
+    df['gyro_magnitude'] = (df['gyro_x']**2 + df['gyro_y']**2 + df['gyro_z']**2)**0.5
+
+    # Map the acceleration magnitude to the apple deformation with the stress curve
+    df['deformation'] = get_stress_curve().deformation_from_accel(df['accel_magnitude'].to_numpy())
+
+    # save the processed data to the processed tree
+    os.makedirs(os.path.dirname(processed_path), exist_ok=True)
+    df.to_csv(processed_path, index=False)
+
+    # and one row per impact to the impacts tree
+    magnitude = df['accel_magnitude'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        direction = np.nan_to_num(df[['accel_x', 'accel_y', 'accel_z']].to_numpy() / magnitude[:, None])
+    impacts = extract_impacts(df['_time'].to_numpy('datetime64[ns]').astype(np.int64), magnitude, critical_thresholds,
+                              deformation=df['deformation'].to_numpy(),
+                              zone=zone_labels(len(df), segment(magnitude, n_bkps=num_zones)), direction=direction)
+    # a string column even when the run has no impacts, an empty object column is written as null
+    impacts.insert(0, 'run', pd.Series(run, index=impacts.index, dtype='string'))
+    os.makedirs(os.path.dirname(impacts_path), exist_ok=True)
+    impacts.to_parquet(impacts_path, index=False)
+    return len(df)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def discover(raw_dir):
+    # relative paths of every raw csv under raw_dir
+    found = []
+    for directory, _, files in os.walk(raw_dir):
+        for file_name in files:
+            if file_name.endswith('.csv'):
+                found.append(os.path.relpath(os.path.join(directory, file_name), raw_dir))
+    return sorted(found)
+
+
+def load_manifest(processed_dir):
+    try:
+        with open(os.path.join(processed_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(processed_dir, manifest):
+    os.makedirs(processed_dir, exist_ok=True)
+    tmp_path = os.path.join(processed_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(processed_dir, MANIFEST_FILE))
+
+
+def run_id(relative_path):
+    # the raw path without extension, e.g. 20240215/apple1_test1, file names repeat across the date folders
+    return os.path.splitext(relative_path)[0].replace(os.sep, '/')
+
+
+def impacts_file(impacts_dir, relative_path):
+    return os.path.join(impacts_dir, os.path.splitext(relative_path)[0] + '.parquet')
+
+
+def process_tree(root, processed_dir=None, workers=None, force=False, impacts_dir=None):
+    """Processes every raw csv of root/raw into processed_dir (root/processed by default),
+    and its impact table into impacts_dir (root/impacts by default).
+
+    Files whose content hash and processing version match the manifest of the
+    previous run, and whose output still exists, are skipped.
+    """
+    raw_dir = os.path.join(root, 'raw')
+    processed_dir = processed_dir or os.path.join(root, 'processed')
+    impacts_dir = impacts_dir or os.path.join(root, 'impacts')
+    manifest = load_manifest(processed_dir)
+
+    raw_files = discover(raw_dir)
+    jobs = {}
+    for relative_path in raw_files:
+        digest = file_hash(os.path.join(raw_dir, relative_path))
+        entry = manifest.get(relative_path)
+        up_to_date = (entry and entry['sha256'] == digest and entry['version'] == PROCESSING_VERSION
+                      and os.path.exists(os.path.join(processed_dir, relative_path))
+                      and os.path.exists(impacts_file(impacts_dir, relative_path)))
+        if force or not up_to_date:
+            jobs[relative_path] = digest
+    print(f"{len(jobs)} files to process, {len(raw_files) - len(jobs)} unchanged")
+
+    processed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_file, os.path.join(raw_dir, path), os.path.join(processed_dir, path),
+                                   impacts_file(impacts_dir, path), run_id(path)): path
+                   for path in jobs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                print(f"{path}: failed, {e}")
+                continue
+            manifest[path] = {'sha256': jobs[path], 'version': PROCESSING_VERSION, 'rows': rows}
+            processed.append(path)
+            print(f"{path}: {rows} rows")
+    save_manifest(processed_dir, manifest)
+    return processed
+
+
+def plot_processed(df):
+    # Create a subplot with 3 rows and 1 column
+    fig = make_subplots(rows=5, cols=1)
+
+    # Define dropdown buttons for each sensor type
+    accel_dropdown = [dict(label='X direction', method='update', args=[{'visible': [True, False, False, True, False, False, True, False, False]}, {'title': 'X direction'}]),
+                      dict(label='Y direction', method='update', args=[{'visible': [False, True, False, False, True, False, False, True, False]}, {'title': 'Y direction'}]),
+                      dict(label='Z direction', method='update', args=[{'visible': [False, False, True, False, False, True, False, False, True]}, {'title': 'Z direction'}])]
+
+    # Add traces for each sensor type
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_x'], mode='lines', name='accel_x', visible=True, connectgaps=False), row=1, col=1)
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_y'], mode='lines', name='accel_y', visible=True, connectgaps=False), row=1, col=1)
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_z'], mode='lines', name='accel_z', visible=True, connectgaps=False), row=1, col=1)
+
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_x'], mode='lines', name='gyro_x', visible=True, connectgaps=False), row=2, col=1)
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_y'], mode='lines', name='gyro_y', visible=True, connectgaps=False), row=2, col=1)
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_z'], mode='lines', name='gyro_z', visible=True, connectgaps=False), row=2, col=1)
+
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['quat_x'], mode='lines', name='quat_x', visible=True, connectgaps=False), row=3, col=1)
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['quat_y'], mode='lines', name='quat_y', visible=True, connectgaps=False), row=3, col=1)
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['quat_z'], mode='lines', name='quat_z', visible=True, connectgaps=False), row=3, col=1)
+
+    # plot the acceleration magnitude
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['accel_magnitude'], mode='lines', name='accel_magnitude', visible=True, connectgaps=False), row=4, col=1)
+
+    # plot gyro magnitude
+    fig.add_trace(go.Scatter(x=df['_time'], y=df['gyro_magnitude'], mode='lines', name='gyro_magnitude', visible=True, connectgaps=False), row=5, col=1)
+
+    # Add dropdown buttons for each sensor type
+    fig.update_layout(
+        updatemenus=[
+            dict(type='buttons', showactive=True, buttons=[dict(label='Show All', method='update', args=[{'visible': [True]*9}, {'title': 'Show All'}])], x=0.2, xanchor='left', y=1.1, yanchor='top'),
+            dict(type='dropdown', active=0, buttons=accel_dropdown, x=0.3, xanchor='left', y=1.1, yanchor='top'),
+        ]
+    )
+
+    # Update xaxis properties
+    fig.update_xaxes(title_text='Time', row=1, col=1)
+    fig.update_xaxes(title_text='Time', row=2, col=1)
+    fig.update_xaxes(title_text='Time', row=3, col=1)
+    fig.update_xaxes(title_text='Time', row=4, col=1)
+    fig.update_xaxes(title_text='Time', row=5, col=1)
+
+    # Update yaxis properties
+    fig.update_yaxes(title_text='Acceleration (g)', row=1, col=1)
+    fig.update_yaxes(title_text='Gyroscope (°/s)', row=2, col=1)
+    fig.update_yaxes(title_text='Quaternions', row=3, col=1)
+    fig.update_yaxes(title_text='Acceleration Magnitude (g)', row=4, col=1)
+    fig.update_yaxes(title_text='Gyroscope Magnitude (°/s)', row=5, col=1)
+
+    # Update title and height
+    fig.update_layout(title_text='Sensor Data', height=1000)
+
+    # Show plot
+    fig.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process the raw acquisitions of a tree into its processed tree.')
+    parser.add_argument('--root', default=acquisitions_root, help='folder holding raw/ (default: %(default)s)')
+    parser.add_argument('--processed', default=None, help='output folder (default: <root>/processed)')
+    parser.add_argument('--impacts', default=None,
+                        help='impact tables folder (default: <root>/impacts), read by the ML Predictions page from SMARTAPPLE_IMPACTS')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--force', action='store_true', help='process unchanged files too')
+    parser.add_argument('--plot', nargs='*', metavar='FILE',
+                        help='plot these processed files, relative to the processed folder (default: the ones just processed)')
+    args = parser.parse_args()
+
+    processed = process_tree(args.root, args.processed, args.workers, args.force, args.impacts)
+    if args.plot is not None:
+        processed_dir = args.processed or os.path.join(args.root, 'processed')
+        for path in args.plot or processed:
+            plot_processed(pd.read_csv(os.path.join(processed_dir, path), parse_dates=['_time']))
+
+
+if __name__ == '__main__':
+    main()
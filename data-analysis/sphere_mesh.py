@@ -0,0 +1,66 @@
+import numpy as np
+from functools import lru_cache
+
+# colors used for the impact heat-map on the sphere
+BASE_COLOR = 'yellow'
+IMPACT_COLOR = 'rgb(255, 0, 0)'
+
+
+class SphereMesh:
+    """Triangulated unit sphere with vectorized nearest-face selection."""
+
+    def __init__(self, resolution, radius=1):
+        self.resolution = resolution
+        self.radius = radius
+
+        # Sphere vertices on a (phi, theta) grid, flattened row by row
+        theta = np.linspace(0, 2 * np.pi, resolution)
+        phi = np.linspace(0, np.pi, resolution)
+        theta, phi = np.meshgrid(theta, phi)
+        self.x = (radius * np.sin(phi) * np.cos(theta)).ravel()
+        self.y = (radius * np.sin(phi) * np.sin(theta)).ravel()
+        self.z = (radius * np.cos(phi)).ravel()
+        self.vertices = np.column_stack((self.x, self.y, self.z))
+
+        # Two triangles per grid cell, anchored at the cell's top-left vertex
+        rows, cols = np.meshgrid(np.arange(resolution - 1), np.arange(resolution - 1), indexing='ij')
+        anchor = (rows * resolution + cols).ravel()
+        below = anchor + resolution
+        first = np.column_stack((anchor, below, anchor + 1))
+        second = np.column_stack((below, below + 1, anchor + 1))
+        # interleave so that faces 2n and 2n+1 belong to the same cell
+        self.triangles = np.stack((first, second), axis=1).reshape(-1, 3)
+        self.face_anchor = np.repeat(anchor, 2)
+        self.i, self.j, self.k = self.triangles.T
+        self._base_colors = np.full(self.n_faces, BASE_COLOR, dtype=object)
+
+        for array in (self.x, self.y, self.z, self.vertices, self.triangles, self.face_anchor):
+            array.setflags(write=False)
+
+    @property
+    def n_faces(self):
+        return len(self.triangles)
+
+    def closest_faces(self, direction, n):
+        # indices of the n faces whose anchor vertex is closest to direction
+        n = int(np.clip(n, 0, self.n_faces))
+        if n == 0:
+            return np.empty(0, dtype=np.intp)
+        if n == self.n_faces:
+            return np.arange(self.n_faces)
+        # all vertices lie on the sphere, so |v - d|^2 = r^2 + |d|^2 - 2 v.d and the
+        # distance ordering is the reverse of the dot product ordering
+        vertex_dist = -(self.vertices @ np.asarray(direction, dtype=float))
+        face_dist = vertex_dist[self.face_anchor]
+        return np.argpartition(face_dist, n - 1)[:n]
+
+    def face_colors(self, direction, n):
+        colors = self._base_colors.copy()
+        colors[self.closest_faces(direction, n)] = IMPACT_COLOR
+        return colors
+
+
+@lru_cache(maxsize=8)
+def get_sphere_mesh(resolution, radius=1):
+    # the triangulation only depends on the resolution, build it once
+    return SphereMesh(resolution, radius)
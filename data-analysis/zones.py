@@ -0,0 +1,154 @@
+import math
+import numpy as np
+
+# Production line zone segmentation: piecewise constant mean (l2) change points.
+# Binary segmentation on the block sums of at most COARSE_POINTS blocks proposes
+# candidates, each is refined at full rate in a few blocks around it and the exact
+# best subset of the refined candidates is chosen by dynamic programming
+COARSE_POINTS = 4096
+REFINE_BLOCKS = 2  # blocks searched on each side of a coarse change point
+MIN_SIZE = 100  # samples, shortest zone
+CANDIDATES_PER_BKP = 4  # binary segmentation candidates per requested change point
+MAX_CANDIDATES = 100  # candidates of the penalty-based count, also its cap
+PENALTY_SCALE = 2.0  # default penalty is PENALTY_SCALE * noise variance * log(n)
+
+
+def noise_variance(signal, pairs=1_000_000):
+    # noise variance from the differences of up to `pairs` neighbouring samples, blind to the level
+    # changes but not to the impact spikes, so that single impacts do not open zones of their own
+    if len(signal) < 2:
+        return 0.0
+    index = np.unique(np.linspace(0, len(signal) - 2, min(pairs, len(signal) - 1)).astype(np.int64))
+    diff = signal[index + 1].astype(np.float64) - signal[index]
+    return float(np.mean(diff ** 2) / 2)
+
+
+def default_penalty(signal):
+    return PENALTY_SCALE * noise_variance(signal) * math.log(max(len(signal), 2))
+
+
+def _best_split(sums, counts, first, last, min_blocks):
+    # best block split of blocks [first, last): (gain, split) or None
+    # the l2 cost drop of a split only depends on the sums and counts of both sides
+    seg_sums = np.cumsum(sums[first:last])
+    seg_counts = np.cumsum(counts[first:last])
+    total_sum, total_count = seg_sums[-1], seg_counts[-1]
+    candidates = slice(min_blocks - 1, last - first - min_blocks)
+    left_sum, left_count = seg_sums[candidates], seg_counts[candidates]
+    if not len(left_sum):
+        return None
+    right_sum, right_count = total_sum - left_sum, total_count - left_count
+    gains = left_sum ** 2 / left_count + right_sum ** 2 / right_count - total_sum ** 2 / total_count
+    best = int(np.argmax(gains))
+    return float(gains[best]), first + min_blocks + best
+
+
+def _binary_segmentation(sums, counts, max_bkps, min_blocks):
+    # up to max_bkps candidate change points in blocks, greedily by l2 gain
+    segments = {(0, len(sums)): _best_split(sums, counts, 0, len(sums), min_blocks)}
+    bkps = []
+    while len(bkps) < max_bkps:
+        candidates = [(split[0], bounds, split[1]) for bounds, split in segments.items() if split is not None]
+        if not candidates:
+            break
+        gain, (first, last), split = max(candidates)
+        if gain <= 0:
+            break
+        del segments[(first, last)]
+        segments[(first, split)] = _best_split(sums, counts, first, split, min_blocks)
+        segments[(split, last)] = _best_split(sums, counts, split, last, min_blocks)
+        bkps.append(split)
+    return sorted(bkps)
+
+
+def _select(positions, sums, n_bkps, penalty, min_size):
+    # exact best subset of the candidate positions (0 and n included, sums between them),
+    # n_bkps change points or the penalized optimum
+    cum_sums = np.concatenate([[0.0], np.cumsum(sums)])
+    bounds = np.asarray(positions, dtype=np.float64)
+    # cost[i, j] of the zone between positions i < j, up to the constant sum of squares
+    seg_sums = cum_sums[None, :] - cum_sums[:, None]
+    seg_counts = bounds[None, :] - bounds[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost = np.where(seg_counts >= min_size, -seg_sums ** 2 / seg_counts, np.inf)
+
+    m = len(positions)
+    if n_bkps is not None:
+        best = cost[0].copy()
+        previous = []
+        for _ in range(min(n_bkps, m - 2)):
+            total = best[:, None] + cost
+            previous.append(np.argmin(total, axis=0))
+            best = total[previous[-1], np.arange(m)]
+        chosen, j = [], m - 1
+        for step in reversed(previous):
+            j = int(step[j])
+            chosen.append(j)
+    else:
+        best = np.full(m, np.inf)
+        best[0] = -penalty
+        previous = np.zeros(m, dtype=np.int64)
+        for j in range(1, m):
+            total = best[:j] + cost[:j, j] + penalty
+            previous[j] = np.argmin(total)
+            best[j] = total[previous[j]]
+        chosen, j = [], m - 1
+        while j > 0:
+            j = int(previous[j])
+            chosen.append(j)
+        chosen = chosen[:-1]
+    return sorted(int(positions[j]) for j in chosen)
+
+
+def _refine(signal, previous, bkp, following, radius):
+    # full-rate l2 split of signal[previous:following] searched in bkp +- radius
+    lo = max(previous + 1, bkp - radius)
+    hi = min(following - 1, bkp + radius)
+    if hi <= lo:
+        return bkp
+    left_sum = signal[previous:lo].sum(dtype=np.float64)
+    window = signal[lo:hi].astype(np.float64)
+    total_sum = left_sum + window.sum() + signal[hi:following].sum(dtype=np.float64)
+    split = np.arange(lo + 1, hi + 1)  # split before these samples
+    left = left_sum + np.cumsum(window)
+    left_count = split - previous
+    right_count = following - split
+    gains = left ** 2 / left_count + (total_sum - left) ** 2 / right_count
+    return int(split[np.argmax(gains)])
+
+
+def segment(signal, n_bkps=None, penalty=None, min_size=MIN_SIZE, coarse_points=COARSE_POINTS):
+    """Change points of a 1-D signal, as ruptures returns them (sorted end indices, the last one is len(signal)).
+
+    n_bkps gives a fixed number of change points; otherwise they are kept while each lowers the
+    l2 cost by more than penalty (default_penalty(signal) when None).
+    """
+    signal = np.asarray(signal)
+    n = len(signal)
+    if n < 2 * min_size:
+        return [n]
+    if n_bkps is None and penalty is None:
+        penalty = default_penalty(signal)
+
+    # candidates from the block sums of the coarse signal, the last block may be shorter
+    factor = max(1, math.ceil(n / coarse_points))
+    starts = np.arange(0, n, factor)
+    block_sums = np.add.reduceat(signal, starts, dtype=np.float64)
+    counts = np.diff(np.append(starts, n)).astype(np.float64)
+    min_blocks = max(1, min_size // factor)
+    max_candidates = min(CANDIDATES_PER_BKP * n_bkps, MAX_CANDIDATES) if n_bkps is not None else MAX_CANDIDATES
+    coarse = [b * factor for b in _binary_segmentation(block_sums, counts, max_candidates, min_blocks)]
+
+    # refine each candidate at full rate between its neighbours, then choose among them with exact costs
+    if factor > 1:
+        bounds = [0] + coarse + [n]
+        coarse = sorted({_refine(signal, bounds[i], bkp, bounds[i + 2], REFINE_BLOCKS * factor)
+                         for i, bkp in enumerate(coarse)})
+    positions = [0] + coarse + [n]
+    sums = np.add.reduceat(signal, positions[:-1], dtype=np.float64)
+    return _select(positions, sums, n_bkps, penalty, min_size) + [n]
+
+
+def zone_labels(n, bkps):
+    # zone index of each of the n samples, zone i ends (exclusive) at bkps[i]
+    return np.searchsorted(np.asarray(bkps), np.arange(n), side='right').astype(np.int64)
@@ -0,0 +1,44 @@
+import os
+import sys
+import streamlit as st
+import plotly.graph_objects as go
+from decouple import config
+
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from smartapple.live import LiveFeed
+
+# MQTT broker of the master, the same messages the InfluxDB bridge receives
+MQTT_HOST = config('MQTT_HOST', default='localhost')
+MQTT_PORT = config('MQTT_PORT', default=1883, cast=int)
+refresh_interval = 1.0  # s between the updates of the live charts
+window_points = 1000  # points per trace, about the pixel width of a chart
+window_ranges = {"Last 10 s": 10.0, "Last 30 s": 30.0, "Last minute": 60.0}
+
+@st.cache_resource
+def live_feed():
+    # one MQTT subscription and one set of ring buffers for the whole server, whatever the pages and tabs open
+    return LiveFeed(MQTT_HOST, MQTT_PORT).start()
+
+def live_chart(key, series, seconds, title, yaxis_title):
+    # series: (address, channel, trace name) tuples. The figure is kept in the session and only
+    # the traces whose window changed are replaced, the decimated windows are shared by every session
+    feed = live_feed()
+    state = st.session_state.setdefault(f"{key}_figure", {"figure": None, "versions": {}, "seconds": None})
+    names = [name for _, _, name in series]
+    figure = state["figure"]
+    if figure is None or state["seconds"] != seconds or [trace.name for trace in figure.data] != names:
+        figure = state["figure"] = go.Figure([go.Scatter(mode='lines', name=name) for name in names])
+        figure.update_layout(title=title, xaxis_title='Time (UTC)', yaxis_title=yaxis_title, template="plotly_white", uirevision=key)
+        state["versions"], state["seconds"] = {}, seconds
+    for trace, (address, channel, name) in zip(figure.data, series):
+        version, times, channels = feed.window(address, seconds, window_points)
+        if state["versions"].get(name) != version:
+            trace.x, trace.y = times, channels[channel]
+            state["versions"][name] = version
+    st.plotly_chart(figure, use_container_width=True, key=key)
+
+def waiting_message():
+    feed = live_feed()
+    status = "connected to" if feed.connected else "connecting to"
+    st.info(f"No SmartApple data yet, {status} the MQTT broker at {MQTT_HOST}:{MQTT_PORT}")
@@ -1,8 +1,14 @@
+import os
+import sys
 import streamlit as st
 import plotly.graph_objects as go
 import numpy as np
 import pandas as pd
 
+# live_feed sits next to Home.py
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from live_feed import live_chart, live_feed, refresh_interval, waiting_message, window_ranges
+
 # Set page config
 st.set_page_config(
     page_title="SmartApple Dashboard",
@@ -18,14 +24,8 @@ def local_css(file_name):
 # Apply the custom styles defined in the 'style.css' file
 local_css('style.css')
 
-# Generate placeholder data
+# Generate placeholder data, the environmental sensors are not streamed yet
 dates = pd.date_range(start="2023-01-01", periods=30, freq="D")
-accel_x = np.random.uniform(low=30, high=70, size=len(dates))  # Simulate acceleration data
-accel_y = np.random.uniform(low=30, high=70, size=len(dates))  # Simulate acceleration data
-accel_z = np.random.uniform(low=350, high=450, size=len(dates))  # Simulate acceleration data
-gyro_x = np.random.uniform(low=0, high=100, size=len(dates))  # Simulate gyro data
-gyro_y = np.random.uniform(low=0, high=100, size=len(dates))  # Simulate gyro data
-gyro_z = np.random.uniform(low=0, high=100, size=len(dates))  # Simulate gyro data
 temperature = np.random.normal(loc=20, scale=3, size=len(dates))  # Simulate temperature data
 humidity = np.random.uniform(low=30, high=70, size=len(dates))  # Simulate humidity data
 co2_levels = np.random.uniform(low=350, high=450, size=len(dates))  # Simulate CO2 levels
@@ -38,38 +38,31 @@ air_quality_color_scale = [
     (1.0, "green"),  # Air quality index 100
 ]
 
-# Main container for Nicla 1
+@st.fragment(run_every=refresh_interval)
+def live_sensors():
+    # reruns alone every refresh_interval, reading the shared ring buffers instead of InfluxDB
+    addresses = live_feed().devices()
+    if not addresses:
+        st.title("SmartApple - Sensors")
+        waiting_message()
+        return
+    col1, col2 = st.columns(2)
+    address = col1.selectbox("SmartApple", addresses, key="live_address")
+    seconds = window_ranges[col2.selectbox("Window", list(window_ranges), key="live_window")]
+    st.title(f"SmartApple {address} - Sensors")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        live_chart("live_accel", [(address, axis, axis) for axis in ('a_x', 'a_y', 'a_z')], seconds,
+                   'Acceleration', 'Acceleration (g)')
+    with col2:
+        live_chart("live_gyro", [(address, axis, axis) for axis in ('g_x', 'g_y', 'g_z')], seconds,
+                   'Gyroscope', 'Gyroscope (°/s)')
+
+# Main container of the selected Nicla
 with st.container():
-    st.title("SmartApple 1 - Sensors")
+    live_sensors()
 
-    with st.container():
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            fig1 = go.Figure()
-            # plot accel_x, accel_y, accel_z in the same figure
-            fig1.add_trace(go.Scatter(x=dates, y=accel_x, mode='lines+markers', name='accel_x',
-                                        line=dict(color='#1f77b4')))
-            fig1.add_trace(go.Scatter(x=dates, y=accel_y, mode='lines+markers', name='accel_y',
-                                        line=dict(color='#ff7f0e')))
-            fig1.add_trace(go.Scatter(x=dates, y=accel_z, mode='lines+markers', name='accel_z',
-                                        line=dict(color='#2ca02c')))
-            fig1.update_layout(title='Acceleration', xaxis_title='Date', yaxis_title='Acceleration (m/s^2)', template="plotly_white")
-            st.plotly_chart(fig1, use_container_width=True)
-        
-        # Create a line chart for Humidity
-        with col2:
-            fig2 = go.Figure()
-            # plot gyro_x, gyro_y, gyro_z in the same figure
-            fig2.add_trace(go.Scatter(x=dates, y=gyro_x, mode='lines+markers', name='gyro_x',
-                                        line=dict(color='#1f77b4')))
-            fig2.add_trace(go.Scatter(x=dates, y=gyro_y, mode='lines+markers', name='gyro_y',
-                                        line=dict(color='#ff7f0e')))
-            fig2.add_trace(go.Scatter(x=dates, y=gyro_z, mode='lines+markers', name='gyro_z',
-                                        line=dict(color='#2ca02c')))
-            fig2.update_layout(title='Gyroscope', xaxis_title='Date', yaxis_title='Gyroscope (°/s)', template="plotly_white")
-            st.plotly_chart(fig2, use_container_width=True)
-    
     with st.container():
         col3, col4 = st.columns(2)
         with col3:
@@ -1,7 +1,17 @@
+import os
+import sys
 import streamlit as st
 import plotly.graph_objects as go
 import numpy as np
 import pandas as pd
+from decouple import config
+
+# make the shared smartapple package and live_feed, next to Home.py, importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from smartapple.impacts import TRIGGER
+from smartapple.rollups import query_overview
+from live_feed import live_chart, live_feed, refresh_interval, waiting_message, window_ranges
 
 # Set page config
 st.set_page_config(
@@ -18,14 +28,28 @@ def local_css(file_name):
 # Apply the custom styles defined in the 'style.css' file
 local_css('style.css')
 
-# Generate placeholder data
+# InfluxDB Settings, the overview is hidden without them
+INFLUXDB_URL = config('INFLUXDB_URL', default='')
+INFLUXDB_TOKEN = config('INFLUXDB_TOKEN', default='')
+INFLUXDB_ORG = config('INFLUXDB_ORG', default='')
+INFLUXDB_BUCKET = config('INFLUXDB_BUCKET', default='')
+overview_ranges = {"Last hour": pd.Timedelta(hours=1), "Last day": pd.Timedelta(days=1), "Last week": pd.Timedelta(weeks=1)}
+overview_width = 1200  # points per device, about the pixel width of a chart
+
+@st.cache_resource
+def influxdb_query_api():
+    from influxdb_client import InfluxDBClient
+    return InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG).query_api()
+
+@st.cache_data(ttl=60)
+def load_overview(range_name, production_line):
+    # statistics from the coarsest downsampled tier that still has a point per pixel
+    stop = pd.Timestamp.now(tz='UTC').floor('min')
+    return query_overview(influxdb_query_api(), INFLUXDB_ORG, INFLUXDB_BUCKET, stop - overview_ranges[range_name], stop,
+                          overview_width, production_lines=[production_line] if production_line else None)
+
+# Generate placeholder data, the environmental sensors are not streamed yet
 dates = pd.date_range(start="2023-01-01", periods=30, freq="D")
-accel_x = np.random.uniform(low=30, high=70, size=len(dates))  # Simulate acceleration data
-accel_y = np.random.uniform(low=30, high=70, size=len(dates))  # Simulate acceleration data
-accel_z = np.random.uniform(low=350, high=450, size=len(dates))  # Simulate acceleration data
-gyro_x = np.random.uniform(low=0, high=100, size=len(dates))  # Simulate gyro data
-gyro_y = np.random.uniform(low=0, high=100, size=len(dates))  # Simulate gyro data
-gyro_z = np.random.uniform(low=0, high=100, size=len(dates))  # Simulate gyro data
 temperature = np.random.normal(loc=20, scale=3, size=len(dates))  # Simulate temperature data
 humidity = np.random.uniform(low=30, high=70, size=len(dates))  # Simulate humidity data
 co2_levels = np.random.uniform(low=350, high=450, size=len(dates))  # Simulate CO2 levels
@@ -38,40 +62,33 @@ air_quality_color_scale = [
     (1.0, "green"),  # Air quality index 100
 ]
 
-# Main container for Nicla 1
+@st.fragment(run_every=refresh_interval)
+def live_production_line():
+    # every apple of the line, one trace each, from the shared ring buffers
+    col1, col2 = st.columns(2)
+    production_line = col1.text_input("Production line", value="test", key="live_production_line")
+    seconds = window_ranges[col2.selectbox("Window", list(window_ranges), key="line_window")]
+    # apples that never published their line are shown on every line
+    feed = live_feed()
+    addresses = [address for address in feed.devices() if feed.production_lines.get(address, production_line) == production_line]
+    if not addresses:
+        waiting_message()
+        return
+    col1, col2 = st.columns(2)
+    with col1:
+        live_chart("line_accel", [(address, 'accel', address) for address in addresses], seconds,
+                   'Acceleration Magnitude', 'Acceleration (g)')
+    with col2:
+        live_chart("line_gyro", [(address, 'gyro', address) for address in addresses], seconds,
+                   'Gyroscope Magnitude', 'Gyroscope (°/s)')
+
+# Main container for the live data of the production line
 with st.container():
     st.title("Production Line")
     # Create two rows for sensors display
     st.markdown("#### Section 1")
-    with st.container():
-        
-        col1, col2 = st.columns(2)
+    live_production_line()
 
-        with col1:
-            fig1 = go.Figure()
-            # plot accel_x, accel_y, accel_z in the same figure
-            fig1.add_trace(go.Scatter(x=dates, y=accel_x, mode='lines+markers', name='accel_x',
-                                        line=dict(color='#1f77b4')))
-            fig1.add_trace(go.Scatter(x=dates, y=accel_y, mode='lines+markers', name='accel_y',
-                                        line=dict(color='#ff7f0e')))
-            fig1.add_trace(go.Scatter(x=dates, y=accel_z, mode='lines+markers', name='accel_z',
-                                        line=dict(color='#2ca02c')))
-            fig1.update_layout(title='Acceleration', xaxis_title='Date', yaxis_title='Acceleration (m/s^2)', template="plotly_white")
-            st.plotly_chart(fig1, use_container_width=True)
-        
-        # Create a line chart for Humidity
-        with col2:
-            fig2 = go.Figure()
-            # plot gyro_x, gyro_y, gyro_z in the same figure
-            fig2.add_trace(go.Scatter(x=dates, y=gyro_x, mode='lines+markers', name='gyro_x',
-                                        line=dict(color='#1f77b4')))
-            fig2.add_trace(go.Scatter(x=dates, y=gyro_y, mode='lines+markers', name='gyro_y',
-                                        line=dict(color='#ff7f0e')))
-            fig2.add_trace(go.Scatter(x=dates, y=gyro_z, mode='lines+markers', name='gyro_z',
-                                        line=dict(color='#2ca02c')))
-            fig2.update_layout(title='Gyroscope', xaxis_title='Date', yaxis_title='Gyroscope (°/s)', template="plotly_white")
-            st.plotly_chart(fig2, use_container_width=True)
-    
     with st.container():
         col3, col4 = st.columns(2)
         with col3:
@@ -123,3 +140,32 @@ with st.container():
             st.plotly_chart(fig4, use_container_width=True)
         
         st.markdown('</div>', unsafe_allow_html=True)
+
+# Overview of the production line over long time ranges
+with st.container():
+    st.title("Production Line Overview")
+    if not INFLUXDB_URL:
+        st.info("Set the InfluxDB settings to show the overview")
+    else:
+        col5, col6 = st.columns(2)
+        range_name = col5.selectbox("Range", list(overview_ranges))
+        production_line = col6.text_input("Production line", value="test")
+        tier, overview = load_overview(range_name, production_line)
+        st.caption(f"Source: {tier} data")
+        if overview.empty:
+            st.info("No data in this range")
+        else:
+            col7, col8 = st.columns(2)
+            with col7:
+                fig5 = go.Figure()
+                for address, device in overview.groupby('address'):
+                    fig5.add_trace(go.Scatter(x=device['_time'], y=device['accel_max'], mode='lines', name=f'{address} max'))
+                    fig5.add_trace(go.Scatter(x=device['_time'], y=device['accel_rms'], mode='lines', name=f'{address} rms'))
+                fig5.update_layout(title='Acceleration Magnitude', xaxis_title='Date', yaxis_title='Acceleration (g)', template="plotly_white")
+                st.plotly_chart(fig5, use_container_width=True)
+            with col8:
+                fig6 = go.Figure()
+                for address, device in overview.groupby('address'):
+                    fig6.add_trace(go.Bar(x=device['_time'], y=device['impacts'], name=address))
+                fig6.update_layout(title=f'Impacts (above {TRIGGER:g} g)', xaxis_title='Date', yaxis_title='Impacts', barmode='stack', template="plotly_white")
+                st.plotly_chart(fig6, use_container_width=True)
@@ -1,3 +1,4 @@
+import os
 import streamlit as st
 import plotly.graph_objects as go
 import numpy as np
@@ -18,6 +19,15 @@ def local_css(file_name):
 # Apply the custom styles defined in the 'style.css' file
 local_css('style.css')
 
+# Impact tables written by data-analysis/process_data.py, one row per impact and one Parquet file per run
+impacts_dir = os.environ.get('SMARTAPPLE_IMPACTS', os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', '..', 'data-analysis', 'acquisitions', 'onsite_test', 'impacts')))
+level_colors = {1: '#ffd633', 2: '#ffa31a', 3: '#ff3333'}
+
+@st.cache_data(ttl=60)
+def load_impacts(path):
+    return pd.read_parquet(path, columns=['run', 'peak_time', 'peak_g', 'level', 'energy_g2s', 'zone'])
+
 # Generate placeholder data
 dates = pd.date_range(start="2023-01-01", periods=30, freq="D")
 power_consumption = np.random.normal(loc=500, scale=50, size=len(dates))  # Simulate power consumption
@@ -46,3 +56,33 @@ with st.container():
                                   fill='tozeroy', line=dict(color='skyblue')))
         fig6.update_layout(title='Forecast', xaxis_title='Date', yaxis_title='Temperature (°C)', template="plotly_white")
         st.plotly_chart(fig6, use_container_width=True)
+
+# Impact events of all the processed runs
+with st.container():
+    st.title("Impact Events")
+    if not os.path.isdir(impacts_dir):
+        st.info(f"No impact tables in {impacts_dir}, run data-analysis/process_data.py first")
+    else:
+        impacts = load_impacts(impacts_dir)
+        col7, col8, col9 = st.columns(3)
+        col7.metric("Runs", impacts['run'].nunique())
+        col8.metric("Impacts", len(impacts))
+        col9.metric("Impacts above 3 g", int((impacts['level'] >= 3).sum()))
+        col10, col11 = st.columns(2)
+
+        # Impacts per zone, stacked by level
+        with col10:
+            counts = impacts.groupby(['zone', 'level']).size().unstack(fill_value=0)
+            fig7 = go.Figure()
+            for level in counts.columns:
+                fig7.add_trace(go.Bar(x=counts.index, y=counts[level], name=f'Level {level}',
+                                      marker_color=level_colors.get(level)))
+            fig7.update_layout(title='Impacts per Zone', xaxis_title='Zone', yaxis_title='Impacts', barmode='stack',
+                               template="plotly_white")
+            st.plotly_chart(fig7, use_container_width=True)
+
+        # Distribution of the impact peaks
+        with col11:
+            fig8 = go.Figure(go.Histogram(x=impacts['peak_g'], nbinsx=50, marker_color='skyblue'))
+            fig8.update_layout(title='Impact Peaks', xaxis_title='Peak (g)', yaxis_title='Impacts', template="plotly_white")
+            st.plotly_chart(fig8, use_container_width=True)
@@ -1,12 +1,30 @@
+import json
+import os
 import sys
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+import threading
+import time
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
 import paho.mqtt.client as paho
-from datetime import datetime
 from decouple import config
 
-nicla_address = ["EE:DF:46:E7:08:80", "9C:E3:E6:C9:4A:C8"]
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from smartapple.ingest import BulkWriter
+from smartapple.payload import REPLAY_KIND, decode_payload
+from smartapple.registry import DeviceRegistry
+from smartapple.rollups import TIERS, Rollups, ensure_buckets, tier_bucket
+from smartapple.spool import Spool
+
+# known apples and their starting production line, any other apple publishing is registered on the fly
+production_lines = {"EE:DF:46:E7:08:80": "test", "9C:E3:E6:C9:4A:C8": "test"}
 send2influxdb = True
-prod_line_id = ["test", "test"]
+report_interval = 10.0  # s between the printed reports and the link summaries written to InfluxDB
+# write-ahead log of every InfluxDB writer, so nothing received is lost while InfluxDB is slow or down
+wal_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wal')
+wal_max_bytes = 2_000_000_000  # per bucket, the oldest batches are dropped above this
+dead_letter_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dead_letter')
+writer_max_memory = 64_000_000  # bytes of samples held in memory before add() blocks the MQTT loop
 
 if send2influxdb:
     # InfluxDB Settings
@@ -18,64 +36,88 @@ if send2influxdb:
     # Setup InfluxDB client
     influxdb_client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, debug=True, org=INFLUXDB_ORG)
 
-    # Configure batch write client
-    write_api = influxdb_client.write_api(write_options=WriteOptions(
-            batch_size=50,
-            flush_interval=10_000,
-            jitter_interval=2_000,
-            retry_interval=5_000,
-            max_retries=5,
-            max_retry_delay=30_000,
-            max_close_wait=300_000,
-            exponential_base=2
-        ))
-
-# Helper function to write to InfluxDB directly without appending
-def write_to_influxdb(address, prod_line_id, data, timestamp):
-    measurement = "nicla"
-    tags = {
-        "address": address,
-        "production_line": prod_line_id,
-    }
-
-    point = Point(measurement).time(timestamp)
-    for key, value in tags.items():
-        point = point.tag(key, value)
-    for key, value in data.items():
-        point = point.field(key, value)
-
-    write_api.write(INFLUXDB_BUCKET, INFLUXDB_ORG, point)
+    def bulk_writer(bucket, **options):
+        # line protocol batches go through a WAL on disk, the ones InfluxDB rejects to dead-letter files
+        return BulkWriter(write_api, bucket, INFLUXDB_ORG, wal=Spool(os.path.join(wal_directory, bucket), max_bytes=wal_max_bytes),
+                          max_memory=writer_max_memory, dead_letter_dir=dead_letter_directory, **options)
 
-def message_handling(client, userdata, msg):
-    # print(f"{msg.topic}: {msg.payload.decode()}")
-    data = msg.payload.decode().split(",")
-    curr_addr_idx = nicla_address.index(msg.topic.split("/")[1])
-    if "prod_line" in msg.topic:
-        # Extract the production line string from the message
-        prod_line_id[curr_addr_idx] = data[0]
-    elif "movement_sensor_data" in msg.topic:
-        # measurement = f"nicla.{nicla_address[curr_addr_idx]}.movement_sensor_data.{prod_line_id[curr_addr_idx]}"
-        timestamp = datetime.strptime(data[0], "%Y-%m-%d %H:%M:%S.%f")
-
-        # Extract the data values from the message
-        fields = {
-            "packet_id": int(data[1]),
-            "g_x": float(data[2]),
-            "g_y": float(data[3]),
-            "g_z": float(data[4]),
-            "a_x": float(data[5]),
-            "a_y": float(data[6]),
-            "a_z": float(data[7]),
-            "q_x": float(data[8]),
-            "q_y": float(data[9]),
-            "q_z": float(data[10]),
-            "q_w": float(data[11]),
-        }
-
-        # print(f"{measurement}: {fields}: {timestamp}")
+    # Samples are buffered per apple and written as line protocol in large batches
+    write_api = influxdb_client.write_api(write_options=SYNCHRONOUS)
+    writer = bulk_writer(INFLUXDB_BUCKET, max_points=5000, max_delay=1.0)
+    writer.start()
+
+    # 1 s and 1 min statistics per apple, each tier in its own bucket and retention, for the long range views
+    rollups = None
+    try:
+        ensure_buckets(influxdb_client, INFLUXDB_ORG, INFLUXDB_BUCKET)
+    except Exception as e:
+        # e.g. a token not allowed to create buckets: the samples are still written
+        print(f"Couldn't create the rollup buckets, rollups disabled: {e}")
+    else:
+        rollup_writers = {tier.name: bulk_writer(tier_bucket(INFLUXDB_BUCKET, tier), max_delay=5.0) for tier in TIERS}
+        for rollup_writer in rollup_writers.values():
+            rollup_writer.start()
+        rollups = Rollups(rollup_writers)
+
+def handle_prod_line(device, topic, payload):
+    # Extract the production line string from the message
+    device.production_line = payload.decode().split(",")[0]
+
+def handle_movement(device, topic, payload):
+    # legacy text lines or packed columns, depending on the topic suffix
+    columns = decode_payload(topic, payload)
+    if not len(columns["packet_id"]):
+        return
+    device.samples += len(columns["packet_id"])
+    device.last_packet_id = int(columns["packet_id"][-1])
+    device.sequence.observe(columns["packet_id"], time.time_ns())
+
+    if send2influxdb:
+        # Queue for the bulk InfluxDB writer, blocks for a while when it is behind (backpressure on the MQTT loop)
+        writer.add(device.address, device.production_line, columns)
+        if rollups is not None:
+            rollups.add(device.address, device.production_line, columns)
+
+def handle_replay(device, topic, payload):
+    # samples spooled by the slave during an outage: stored and rolled up, but kept out of the
+    # live packet accounting, they are minutes behind the live ones
+    columns = decode_payload(topic, payload)
+    if not len(columns["packet_id"]):
+        return
+    device.replayed += len(columns["packet_id"])
+
+    if send2influxdb:
+        writer.add(device.address, device.production_line, columns)
+        if rollups is not None:
+            rollups.backfill(device.address, device.production_line, columns)
+
+def handle_link_stats(device, topic, payload):
+    # packet loss summary of the BLE link, published by the slave gateway
+    if send2influxdb:
+        writer.add_record("nicla_link", {"address": device.address, "gateway": "slave"}, json.loads(payload))
+
+registry = DeviceRegistry(production_lines)
+registry.route("prod_line", handle_prod_line)
+registry.route("movement_sensor_data", handle_movement)
+registry.route(REPLAY_KIND, handle_replay)
+registry.route("link_stats", handle_link_stats)
+
+def report_loop():
+    while True:
+        time.sleep(report_interval)
+        registry.report()
         if send2influxdb:
-            # Write to InfluxDB
-            write_to_influxdb(nicla_address[curr_addr_idx], prod_line_id[curr_addr_idx], fields, timestamp)
+            writer.report()
+            # windows of the apples gone quiet
+            if rollups is not None:
+                rollups.flush()
+                rollups.report()
+            # loss summary of the whole chain, as seen by the master
+            for device in list(registry.devices.values()):
+                writer.add_record("nicla_link", {"address": device.address, "gateway": "master"}, device.sequence.summary())
+
+def message_handling(client, userdata, msg):
+    registry.dispatch(msg.topic, msg.payload)
 
 client = paho.Client()
 client.on_message = message_handling
@@ -83,9 +125,11 @@ if client.connect("localhost", 1883, 60) != 0:
     print("Couldn't connect to the mqtt broker")
     sys.exit(1)
 
-for address in nicla_address:
-    client.subscribe(f"nicla/{address}/movement_sensor_data", 0)
-    client.subscribe(f"nicla/{address}/prod_line", 0)
+# every apple, including the format suffixed variants (movement_sensor_data/bin1)
+for topic in registry.subscriptions():
+    client.subscribe(topic, 0)
+
+threading.Thread(target=report_loop, name="report", daemon=True).start()
 
 try:
     print("Press CTRL+C to exit...")
@@ -94,4 +138,13 @@ except Exception:
     print("Caught an Exception, something went wrong...")
 finally:
     print("Disconnecting from the MQTT broker")
-    client.disconnect()
\ No newline at end of file
+    client.disconnect()
+    registry.report()
+    if send2influxdb:
+        writer.stop()
+        writer.report()
+        if rollups is not None:
+            rollups.flush(force=True)
+            for rollup_writer in rollup_writers.values():
+                rollup_writer.stop()
+            rollups.report()
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from influxdb_client import InfluxDBClient, Point, WriteOptions
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from smartapple.ingest import BulkWriter
+from smartapple.payload import FIELDS
+
+# Compares the per-Point write path of the master with the bulk line protocol one,
+# against a local HTTP server standing in for InfluxDB (it only counts the lines)
+num_points = 50_000
+num_devices = 2
+samples_per_message = 100  # as coalesced by the slave publisher
+cpu_budget = 1  # cores the benchmark may use, roughly one Raspberry Pi 4 core; None for all
+port = 8099
+
+
+class FakeInfluxHandler(BaseHTTPRequestHandler):
+    lines = 0
+    requests = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        FakeInfluxHandler.lines += body.count(b"\n") + 1
+        FakeInfluxHandler.requests += 1
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_messages():
+    # decoded payloads, as handed over by smartapple.payload.decode_payload
+    rng = np.random.default_rng(0)
+    start_ns = int(time.time() * 1e9)
+    messages = []
+    for first in range(0, num_points, samples_per_message):
+        count = min(samples_per_message, num_points - first)
+        columns = {"time_ns": start_ns + (first + np.arange(count)) * 5_000_000,
+                   "packet_id": first + np.arange(count)}
+        for name in FIELDS[1:]:
+            columns[name] = rng.integers(-4096, 4096, count).astype(np.float64)
+        messages.append((f"AA:BB:CC:DD:EE:{len(messages) % num_devices:02X}", columns))
+    return messages
+
+
+def wait_for_lines(expected, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while FakeInfluxHandler.lines < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def per_point(influxdb_client, messages):
+    # the previous master path: one Point per sample, batched by the client
+    write_api = influxdb_client.write_api(write_options=WriteOptions(batch_size=50, flush_interval=10_000))
+    for address, columns in messages:
+        for i in range(len(columns["time_ns"])):
+            timestamp = datetime.utcfromtimestamp(0) + timedelta(microseconds=int(columns["time_ns"][i]) // 1000)
+            point = Point("nicla").time(timestamp)
+            point = point.tag("address", address).tag("production_line", "test")
+            for key in FIELDS:
+                value = columns[key][i].item()
+                point = point.field(key, int(value) if key == "packet_id" else value)
+            write_api.write("bucket", "org", point)
+    write_api.close()
+
+
+def bulk(influxdb_client, messages):
+    writer = BulkWriter(influxdb_client.write_api(write_options=SYNCHRONOUS), "bucket", "org")
+    writer.start()
+    for address, columns in messages:
+        writer.add(address, "test", columns)
+    writer.stop()
+
+
+def run(name, path, messages):
+    FakeInfluxHandler.lines = FakeInfluxHandler.requests = 0
+    with InfluxDBClient(url=f"http://127.0.0.1:{port}", token="token", org="org") as influxdb_client:
+        start = time.perf_counter()
+        path(influxdb_client, messages)
+        wait_for_lines(num_points)
+        elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {FakeInfluxHandler.lines} points in {FakeInfluxHandler.requests} requests, "
+          f"{elapsed:.2f}s, {FakeInfluxHandler.lines / elapsed:,.0f} points/s")
+
+
+def main():
+    if cpu_budget and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, list(os.sched_getaffinity(0))[:cpu_budget])
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeInfluxHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    messages = make_messages()
+    try:
+        run("per-Point", per_point, messages)
+        run("bulk", bulk, messages)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
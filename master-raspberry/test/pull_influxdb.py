@@ -1,59 +1,54 @@
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.write_api import SYNCHRONOUS
+import argparse
+import os
+import sys
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
+from influxdb_client import InfluxDBClient
 from decouple import config
 
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from smartapple.export import FORMAT_CSV, SINKS, export_devices, list_addresses, utc
+
 # InfluxDB Settings
 INFLUXDB_URL = config('INFLUXDB_URL', cast=str)
 INFLUXDB_TOKEN = config('INFLUXDB_TOKEN', cast=str)
 INFLUXDB_ORG = config('INFLUXDB_ORG', cast=str)
 INFLUXDB_BUCKET = config('INFLUXDB_BUCKET', cast=str)
 
-# Setup InfluxDB client
-client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-
-# Configure batch write client
-write_api = client.write_api(write_options=SYNCHRONOUS)
-
-# Query data from InfluxDB
-query1 = '''
-from(bucket: "Smart-Apple")
-  |> range(start: -1m)
-  |> filter(fn: (r) => r["_measurement"] == "nicla")
-  |> filter(fn: (r) => r["address"] == "EE:DF:46:E7:08:80" and r["production_line"] == "test")
-  |> filter(fn: (r) => r["_field"] == "a_x" or r["_field"] == "a_y" or r["_field"] == "a_z")
-'''
-
-# Query data from InfluxDB
-query2 = '''
-from(bucket: "Smart-Apple")
-  |> range(start: -6h)
-  |> filter(fn: (r) => r["_measurement"] == "movement_sensor_data")
-'''
-
-tables = client.query_api().query(query2, org=INFLUXDB_ORG)
-
-dataframes = []
-
-# Extract relevant information from FluxRecords
-for table in tables:
-    for record in table.records:
-        data = {
-            '_time': record['_time'],
-            '_value': record['_value'],
-            '_field': record['_field'],
-        }
-        dataframes.append(pd.DataFrame([data]))
-
-# Concatenate DataFrames
-df = pd.concat(dataframes)
-
-# Pivot the DataFrame to get columns for each sensor type
-df_pivot = df.pivot(index='_time', columns='_field', values='_value')
-
-# Reset index to make '_time' a regular column
-df_pivot.reset_index(inplace=True)
-# Save to CSV
-df_pivot.to_csv('sensor_data.csv', index=False)
+# Export defaults
+measurement = "nicla"
+duration = pd.Timedelta(hours=6)  # exported window when --start is not given
+page_minutes = 10  # time slice of each query
+workers = 4  # devices exported at once
+output_dir = "exports"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the samples of InfluxDB to one file per device.')
+    parser.add_argument('--address', action='append', help='device address, repeatable (default: every address with data)')
+    parser.add_argument('--production-line', action='append', help='production line, repeatable')
+    parser.add_argument('--field', action='append', help='field, repeatable (default: all of them)')
+    parser.add_argument('--start', help=f'UTC start time (default: {duration} before --stop)')
+    parser.add_argument('--stop', help='UTC stop time (default: now)')
+    parser.add_argument('--measurement', default=measurement)
+    parser.add_argument('--format', default=FORMAT_CSV, choices=sorted(SINKS))
+    parser.add_argument('--page-minutes', type=float, default=page_minutes)
+    parser.add_argument('--workers', type=int, default=workers)
+    parser.add_argument('--out', default=output_dir)
+    args = parser.parse_args()
+
+    stop = utc(args.stop) if args.stop else pd.Timestamp.now(tz='UTC')
+    start = utc(args.start) if args.start else stop - duration
+
+    with InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG, timeout=60_000) as client:
+        addresses = args.address or list_addresses(client, INFLUXDB_ORG, INFLUXDB_BUCKET, args.measurement, start, stop)
+        print(f"Exporting {len(addresses)} devices from {start} to {stop}")
+        results = export_devices(client, INFLUXDB_ORG, INFLUXDB_BUCKET, addresses, start, stop, args.out,
+                                 measurement=args.measurement, production_lines=args.production_line, fields=args.field,
+                                 file_format=args.format, page=pd.Timedelta(minutes=args.page_minutes),
+                                 workers=args.workers)
+    print(f"{sum(rows for _, rows in results.values())} rows of {len(results)}/{len(addresses)} devices exported")
+
+
+if __name__ == '__main__':
+    main()
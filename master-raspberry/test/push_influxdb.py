@@ -1,12 +1,14 @@
 import asyncio
+import os
+import sys
 from bleak import BleakClient, BleakError
 from decouple import config
 from influxdb_client import InfluxDBClient, Point, WriteOptions
 from datetime import datetime
-import re
 
-# Precompiled regular expression pattern
-pattern = re.compile(r'(\d+),(-?\d+),G:([\d.-]+),([\d.-]+),([\d.-]+),A:([\d.-]+),([\d.-]+),([\d.-]+),Q:([\d.-]+),([\d.-]+),([\d.-]+),([\d.-]+)')
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from smartapple.packet import decode_packet, read_format_version, sample_timestamps
 
 # 0 means stop notification, 1 means start notification
 PROGRAM_COMMAND_UUID = "19b10000-8002-537e-4f6c-d104768a1214" 
@@ -48,13 +50,14 @@ def write_to_influxdb(measurement, data, timestamp):
     write_api.write(INFLUXDB_BUCKET, INFLUXDB_ORG, point)
 
 def notification_handler(sender: int, data: bytearray):
-    global pattern
+    samples = decode_packet(data)
+    if not samples:
+        print("Invalid data received:", bytes(data))
+        return
 
-    raw_data = data.decode('utf-8')
-    match = pattern.match(raw_data)
-    if match:
-        packet_id, rssi, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w = match.groups()
-        timestamp = datetime.utcnow()
+    # batched packets carry several samples, each one gets its own timestamp
+    timestamps = sample_timestamps(samples, datetime.utcnow())
+    for timestamp, (packet_id, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w, _) in zip(timestamps, samples):
         if push2influxdb:
             write_to_influxdb("movement_sensor_data", {
                 "packet_id": int(packet_id),
@@ -71,36 +74,36 @@ def notification_handler(sender: int, data: bytearray):
             }, timestamp)
         
         print(f"Packet ID: {packet_id}")
-        print(f"RSSI: {rssi}")
         print(f"Gyroscope: [{g_x}, {g_y}, {g_z}]")
         print(f"Accelerometer: [{a_x}, {a_y}, {a_z}]")
         print(f"Quaternion: [{q_x}, {q_y}, {q_z}, {q_w}]")
-    else:
-        print("Invalid data received:", raw_data)
 
 async def main_loop(address):
     global isStarted, client
     while True:
+        # set by bleak as soon as the link is lost, no need to poll is_connected
+        disconnected = asyncio.Event()
         try:
-            async with BleakClient(address) as client:
+            async with BleakClient(address, disconnected_callback=lambda c: disconnected.set()) as client:
                 print("Connected successfully!")
+                print(f"Packet format: v{await read_format_version(client)}")
                 if not isStarted:
                     # send a byte 1 to start the program to the command characteristic
                     await client.write_gatt_char(PROGRAM_COMMAND_UUID, bytearray([1]))
                     await client.start_notify(SENSORS_UUID, notification_handler)
                     isStarted = True
 
-                while client.is_connected:
-                    await asyncio.sleep(1)
+                await disconnected.wait()
 
         except BleakError as e:
             print(f"BleakError while connecting: {e}")
+            await asyncio.sleep(0.5)
         except Exception as e:
             print(f"Unexpected error while connecting: {e}")
+            await asyncio.sleep(0.5)
         finally:
             print("Disconnected. Trying to reconnect...")
             isStarted = False
-            await asyncio.sleep(0.5)
        
 async def main():
     global nicla_address, client
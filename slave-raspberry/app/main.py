@@ -1,24 +1,24 @@
 import asyncio
-from bleak import BleakClient, BleakScanner
+import os
+import sys
 from decouple import config
 import paho.mqtt.client as paho
-from datetime import datetime
-import re
 
-# Precompiled regular expression pattern
-pattern = re.compile(r'(\d+),G:([\d.-]+),([\d.-]+),([\d.-]+),A:([\d.-]+),([\d.-]+),([\d.-]+),Q:([\d.-]+),([\d.-]+),([\d.-]+),([\d.-]+)')
-
-# 0 means stop notification, 1 means start notification
-PROGRAM_COMMAND_UUID = "19b10000-8002-537e-4f6c-d104768a1214" 
-SENSORS_UUID = "19b10000-A001-537e-4f6c-d104768a1214" # UUID to read from
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from smartapple.packet import packet_sample_count
+from smartapple.payload import PAYLOAD_BINARY, encode_binary
+from smartapple.publisher import MqttPublisher, encode_text
+from smartapple.session_manager import SessionManager
+from smartapple.spool import Spool
 
 nicla_address = ["EE:DF:46:E7:08:80", "9C:E3:E6:C9:4A:C8"]
-connected_address = None
-device_name = None
-ble_client = None
 mqtt_client = None
-isStarted = False
 send2mqtt = True
+binary_payload = True  # packed columns on movement_sensor_data/bin1, False for the legacy text lines
+use_spool = True  # keep the messages on the SD card while the broker is unreachable, replay them afterwards
+spool_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool')
+spool_max_bytes = 512_000_000  # the oldest messages are dropped above this
 
 if send2mqtt:
     # MQTT Settings
@@ -29,95 +29,48 @@ if send2mqtt:
     # Setup MQTT client
     mqtt_client = paho.Client(client_id=MQTT_ID, clean_session=True, userdata=None, protocol=paho.MQTTv311, transport="tcp")
 
-    if mqtt_client.connect(MQTT_HOST, MQTT_PORT, 60) != 0:
-        print("Couldn't connect to the mqtt broker")
-    else:
-        print("Connected to the mqtt broker")
+    def on_connect(client, userdata, flags, rc):
+        print("Connected to the mqtt broker" if rc == 0 else f"Couldn't connect to the mqtt broker: {paho.connack_string(rc)}")
 
-# send through MQTT
-def send_to_mqtt(topic, data):
-    global mqtt_client
-    mqtt_client.publish(topic, data, 0)
+    def on_disconnect(client, userdata, rc):
+        print(f"Disconnected from the mqtt broker ({rc}), retrying in the background")
 
-def notification_handler(sender: int, data: bytearray):
-    global pattern, connected_address, send2mqtt
+    mqtt_client.on_connect = on_connect
+    mqtt_client.on_disconnect = on_disconnect
+    # the network loop of the publisher connects, and reconnects after every outage
+    mqtt_client.reconnect_delay_set(min_delay=1, max_delay=30)
+    mqtt_client.connect_async(MQTT_HOST, MQTT_PORT, 60)
 
-    raw_data = data.decode('utf-8')
-    match = pattern.match(raw_data)
-    if match:
-        packet_id, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w = match.groups()
-        timestamp = datetime.utcnow()
-        if send2mqtt:
-            # print(f"nicla/{connected_address}/movement_sensor_data", f"{timestamp},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}")
-            send_to_mqtt(f"nicla/{connected_address}/movement_sensor_data", f"{timestamp},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}")
+    # decode, coalesce and publish on a background thread
+    spool = Spool(spool_directory, max_bytes=spool_max_bytes) if use_spool else None
+    if binary_payload:
+        publisher = MqttPublisher(mqtt_client, topic=f"nicla/{{address}}/movement_sensor_data/{PAYLOAD_BINARY}", encode=encode_binary, spool=spool)
     else:
-        print("Invalid data received:", raw_data)
+        publisher = MqttPublisher(mqtt_client, encode=encode_text, spool=spool)
+    publisher.start()
 
-async def main_loop(address):
-    global isStarted, ble_client, connected_address
-    isStarted = False
-    
-    while True:
-        async with BleakClient(address) as ble_client:
-            print("Connected successfully!")
-            if not isStarted:
-                # send a byte 1 to start the program to the command characteristic
-                await ble_client.write_gatt_char(PROGRAM_COMMAND_UUID, bytearray([1]))
-                await ble_client.start_notify(SENSORS_UUID, notification_handler)
-                isStarted = True
+def notification_handler(address, data: bytearray):
+    # runs on the BLE event loop: only queue the raw packet, the publisher thread does the rest
+    if send2mqtt:
+        publisher.submit(address, data)
+    return packet_sample_count(data)
 
-            while ble_client.is_connected:
-                await asyncio.sleep(0.1)
-            
-            # exit the loop if client is disconnected
-            print("Disconnected from device.")
-            connected_address = None
-            break
-       
 async def main():
-    global nicla_address, connected_address, ble_client, isStarted
-    while True:
-        try:
-            # if client is not connected, scan for devices
-            if not ble_client or not ble_client.is_connected:
-                connected_address = None
-                print("Scanning for devices...")
-                # scan for devices
-                while not connected_address:
-                    devices = await BleakScanner.discover(1)
-                    for d in devices:
-                        if d.address in nicla_address:
-                            device_name = d.name
-                            connected_address = d.address
-                            print(f"Found {device_name} at {d.address}")
-                            await main_loop(connected_address)
-                            break
-                    else:
-                        print("No SmartApples available found.")
-        
-            if connected_address is not None:
-                await main_loop(connected_address)        
-
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-        except KeyboardInterrupt:
-            print("Interrupted by user.")
-        finally:
-            print("Disconnected, cleaning up...")
-            if ble_client:
-                try:
-                    await ble_client.stop_notify(SENSORS_UUID)
-                    await ble_client.disconnect()
-                    ble_client = None
-                    connected_address = None
-                    isStarted = False
-                    await asyncio.sleep(1)
-                except Exception as e:
-                    print(f"Error during cleanup: {e}")
+    # stream all the SmartApples at the same time, one session per address
+    manager = SessionManager(nicla_address, notification_handler, reporters=[publisher.report] if send2mqtt else [])
+    try:
+        await manager.run()
+    except KeyboardInterrupt:
+        print("Interrupted by user.")
+    finally:
+        print("Disconnected, cleaning up...")
+        manager.report()
 
 loop = asyncio.get_event_loop()
 
 try:
     loop.run_until_complete(main())
 finally:
+    if send2mqtt:
+        publisher.stop()
     loop.close()
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+import time
+import random
+from collections import deque
+import paho.mqtt.client as paho
+
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from smartapple.packet import BATCH_HEADER, BATCH_SAMPLE, BATCH_TICK_US, FORMAT_BATCH, decode_packet, sample_timestamps
+from smartapple.payload import PAYLOAD_BINARY, decode_payload, encode_binary
+from smartapple.publisher import MqttPublisher
+from datetime import datetime
+
+# Rates of the Nicla batch firmware
+sensor_rate = 200.0  # batchSampleRate, IMU samples per second
+notification_rate = 20.0  # connection events per second, each carries at most one notification
+tx_buffers = 2  # notifications the BLE stack holds until a connection event
+batch_sizes = range(1, 11)
+num_packets = 20000
+measure_duration = 5.0  # s of streaming per batch size
+
+# Set to a SmartApple address to also measure the delivered rate of a real device
+nicla_address = None
+SENSORS_UUID = "19b10000-A001-537e-4f6c-d104768a1214"
+PROGRAM_COMMAND_UUID = "19b10000-8002-537e-4f6c-d104768a1214"
+live_duration = 10.0  # s
+
+def encode_batch(packet_id, batch_size, sample_period_us, device_us=0):
+    # Same layout the firmware writes in PACKET_FORMAT_BATCH
+    data = bytearray(BATCH_HEADER.pack(FORMAT_BATCH, batch_size, packet_id, device_us & 0xFFFFFFFF))
+    for i in range(batch_size):
+        values = [random.randint(-4096, 4096) for _ in range(10)]
+        data += BATCH_SAMPLE.pack(int(i * sample_period_us / BATCH_TICK_US), *values)
+    return bytes(data)
+
+
+class CountingClient:
+    """Subset of paho.mqtt.client.Client used by MqttPublisher, counting the samples of every message."""
+
+    def __init__(self):
+        self.samples = 0
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def publish(self, topic, payload, qos=0):
+        self.samples += len(decode_payload(topic, payload)['time_ns'])
+        return paho.MQTTMessageInfo(0)
+
+
+async def stream(publisher, batch_size, duration, address="AA:BB:CC:DD:EE:00"):
+    # The firmware fills a batch at sensor_rate and queues its notification in the BLE stack,
+    # each connection event sends the oldest queued one. A batch written while the tx_buffers
+    # are full is lost. The connection events are not in phase with the sensor
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    phase = random.uniform(0, 1 / notification_rate)
+    queued = deque()
+
+    async def device():
+        sample_period_us = 1e6 / sensor_rate
+        packet_id = 0
+        while loop.time() - start < duration:
+            await asyncio.sleep(max(0.0, start + (packet_id + batch_size) / sensor_rate - loop.time()))
+            if len(queued) < tx_buffers:
+                queued.append(encode_batch(packet_id, batch_size, sample_period_us, int(packet_id * sample_period_us)))
+            packet_id += batch_size
+
+    async def connection_events():
+        event = 0
+        while loop.time() - start < duration:
+            await asyncio.sleep(max(0.0, start + phase + event / notification_rate - loop.time()))
+            event += 1
+            if queued:
+                publisher.submit(address, queued.popleft())
+
+    await asyncio.gather(device(), connection_events())
+
+print(f"{'batch':>5} {'bytes':>6} {'delivered samples/s':>20} {'lost':>6} {'gateway decode samples/s':>25}")
+for batch_size in batch_sizes:
+    # delivered: the firmware stream through the gateway decode, timestamp, encode and publish path
+    client = CountingClient()
+    publisher = MqttPublisher(client, topic=f"nicla/{{address}}/movement_sensor_data/{PAYLOAD_BINARY}", encode=encode_binary)
+    publisher.start()
+    asyncio.run(stream(publisher, batch_size, measure_duration))
+    publisher.stop()
+    delivered = client.samples / measure_duration
+    lost = sum(sequence.lost for sequence in publisher.sequences.values())
+
+    # decode throughput of the gateway alone
+    packets = [encode_batch(i * batch_size, batch_size, 1e6 / sensor_rate) for i in range(num_packets // batch_size)]
+    start = time.perf_counter()
+    decoded = 0
+    for packet in packets:
+        samples = decode_packet(packet)
+        sample_timestamps(samples, datetime.utcnow())
+        decoded += len(samples)
+    elapsed = time.perf_counter() - start
+
+    print(f"{batch_size:>5} {len(packets[0]):>6} {delivered:>20.1f} {lost:>6} {decoded / elapsed:>25.0f}")
+
+async def measure_live(address):
+    from bleak import BleakClient
+    received = 0
+
+    def notification_handler(sender, data):
+        nonlocal received
+        received += len(decode_packet(data))
+
+    async with BleakClient(address) as client:
+        await client.write_gatt_char(PROGRAM_COMMAND_UUID, bytearray([1]))
+        await client.start_notify(SENSORS_UUID, notification_handler)
+        await asyncio.sleep(live_duration)
+        await client.stop_notify(SENSORS_UUID)
+    print(f"{address}: {received / live_duration:.1f} samples/s delivered")
+
+if nicla_address:
+    asyncio.run(measure_live(nicla_address))
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import random
+import sys
+import time
+
+# make the shared smartapple package importable
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from smartapple.packet import BATCH_HEADER, BATCH_SAMPLE, BATCH_TICK_US, FORMAT_BATCH, VERSION_UUID, decode_packet
+from smartapple.sequence import SequenceTracker
+from smartapple.session_manager import SessionManager
+
+# Simulation settings
+num_devices = 5
+duration = 30.0  # s
+sample_rate = 200.0  # Hz, per device
+batch_size = 10
+mean_connection_time = 10.0  # s before a simulated drop, None to never drop
+out_of_range_time = 2.0  # s the device stays away after a drop
+advertising_interval = 0.1  # s
+
+
+class FakeDevice:
+    def __init__(self, address):
+        self.address = address
+        self.name = f"SmartApple-{address[-5:-3]}{address[-2:]}"
+        self.in_range = True
+        self.connected = False
+        self.packet_id = 0
+        self.device_us = 0
+
+
+class FakeClient:
+    """Subset of BleakClient used by the gateway, streaming synthetic batched packets."""
+
+    def __init__(self, device, disconnected_callback=None):
+        self.device = device
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self._stream_task = None
+
+    async def connect(self):
+        await asyncio.sleep(random.uniform(0.05, 0.3))
+        if not self.device.in_range or self.device.connected:
+            raise ConnectionError(f"{self.device.address} not found")
+        self.is_connected = True
+        self.device.connected = True
+
+    async def disconnect(self):
+        self._drop()
+
+    async def read_gatt_char(self, uuid):
+        if uuid == VERSION_UUID:
+            return (FORMAT_BATCH | (batch_size << 8)).to_bytes(4, 'little')
+        return bytearray([0])
+
+    async def write_gatt_char(self, uuid, data):
+        pass
+
+    async def start_notify(self, uuid, callback):
+        self._stream_task = asyncio.create_task(self._stream(callback))
+
+    async def stop_notify(self, uuid):
+        if self._stream_task:
+            self._stream_task.cancel()
+
+    def _drop(self):
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        self.device.connected = False
+        if self._stream_task:
+            self._stream_task.cancel()
+        if self.disconnected_callback:
+            self.disconnected_callback(self)
+
+    async def _away(self):
+        # the apple leaves the gateway range for a while
+        self.device.in_range = False
+        await asyncio.sleep(out_of_range_time)
+        self.device.in_range = True
+
+    async def _stream(self, callback):
+        period = batch_size / sample_rate
+        dropped_at = asyncio.get_running_loop().time() + random.expovariate(1 / mean_connection_time) \
+            if mean_connection_time else None
+        while self.is_connected:
+            await asyncio.sleep(period)
+            if dropped_at and asyncio.get_running_loop().time() > dropped_at:
+                self._drop()
+                asyncio.create_task(self._away())
+                return
+            device = self.device
+            data = bytearray(BATCH_HEADER.pack(FORMAT_BATCH, batch_size, device.packet_id, device.device_us & 0xFFFFFFFF))
+            for i in range(batch_size):
+                offset = int(i * 1e6 / sample_rate / BATCH_TICK_US)
+                data += BATCH_SAMPLE.pack(offset, *[random.randint(-4096, 4096) for _ in range(10)])
+            device.packet_id += batch_size
+            device.device_us += int(period * 1e6)
+            callback(None, data)
+
+
+class FakeScanner:
+    """Reports an advertisement of every reachable, not connected device each advertising interval."""
+
+    def __init__(self, devices, detection_callback):
+        self.devices = devices
+        self.detection_callback = detection_callback
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._advertise())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _advertise(self):
+        while True:
+            await asyncio.sleep(advertising_interval)
+            for device in self.devices.values():
+                if device.in_range and not device.connected:
+                    self.detection_callback(device, None)
+
+
+class FakeBackend:
+    """Drop-in replacement of smartapple.session_manager.BleakBackend simulating N SmartApples."""
+
+    def __init__(self, addresses):
+        self.devices = {address: FakeDevice(address) for address in addresses}
+
+    def scanner(self, detection_callback):
+        return FakeScanner(self.devices, detection_callback)
+
+    def client(self, device, disconnected_callback=None):
+        return FakeClient(self.devices[device.address], disconnected_callback)
+
+
+sequences = {}
+
+
+def count_samples(address, data):
+    samples = decode_packet(data)
+    sequences.setdefault(address, SequenceTracker()).observe([sample.packet_id for sample in samples], time.time_ns())
+    return len(samples)
+
+
+async def main():
+    addresses = [f"AA:BB:CC:DD:EE:{i:02X}" for i in range(num_devices)]
+    manager = SessionManager(addresses, count_samples, backend=FakeBackend(addresses), report_interval=5.0)
+    try:
+        await asyncio.wait_for(manager.run(), duration)
+    except asyncio.TimeoutError:
+        pass
+    total = sum(stats.samples for stats in manager.stats().values())
+    print(f"{num_devices} devices, {total / duration:.1f} samples/s in total "
+          f"(expected at most {num_devices * sample_rate:.0f})")
+    for address, stats in manager.stats().items():
+        sequence = sequences.get(address, SequenceTracker())
+        print(f"[{address}] {stats.samples} samples, {stats.reconnects} reconnects, {stats.failed_connects} failed connects, "
+              f"reconnect latency {stats.reconnect_latency.summary()}, {sequence.lost} lost, {sequence.resets} resets, "
+              f"inter-arrival {sequence.interarrival.summary()}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
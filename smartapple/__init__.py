@@ -0,0 +1,3 @@
+# Code shared by the gateways (slave-raspberry, data-analysis/acquisition_app.py)
+# and the server (master-raspberry). The scripts add the repository root to
+# sys.path before importing it.
@@ -0,0 +1,81 @@
+from collections import deque
+import numpy as np
+
+US_WRAP = 1 << 32  # device_us is a uint32 micros() counter
+
+
+class DeviceClock:
+    """Maps the device time of every sample of a SmartApple to host time, in integer ns since the epoch.
+
+    The device time is the device_us counter of batched packets, or the packet_id at
+    the nominal packet rate for the formats without it. Host time = offset + skew * device
+    time is fitted online on the receive time of each packet, with old packets
+    exponentially forgotten so that the drift is followed. BLE only ever delays a
+    notification, so the offset is lowered to the envelope of the recent residuals.
+    The fit restarts when the device time jumps (reconnection, reset of the apple).
+    """
+
+    def __init__(self, packet_rate=30.0, half_life=2000, window=200, max_error=1.0):
+        # packet_rate: packets/s of the single sample formats, only a starting guess of the skew
+        # half_life: packets after which a packet weights half in the fit
+        # window: packets the latency envelope is taken over
+        # max_error: s between prediction and receive time considered a discontinuity
+        self.packet_period = 1.0 / packet_rate
+        self.decay = 0.5 ** (1.0 / half_life)
+        self.window = window
+        self.max_error = max_error
+        self.resets = 0
+        self.reset()
+
+    def reset(self):
+        self._origin = None  # (device s, host ns) of the first packet of the fit
+        self._last_us = None
+        self._wraps = 0
+        self._sums = np.zeros(5)  # weights, x, y, x*x, x*y
+        self._residuals = deque(maxlen=self.window)
+        self.skew = 1.0
+        self.intercept = 0.0
+
+    def _device_time(self, samples):
+        # device time of every sample in s
+        if samples[-1].device_us is None:
+            return np.array([s.packet_id for s in samples], dtype=np.float64) * self.packet_period
+        device_us = []
+        for s in samples:
+            if self._last_us is not None and s.device_us < self._last_us - US_WRAP // 2:
+                self._wraps += 1
+            self._last_us = s.device_us
+            device_us.append(s.device_us + self._wraps * US_WRAP)
+        return np.array(device_us, dtype=np.float64) * 1e-6
+
+    def _predict(self, x):
+        return self.intercept + self.skew * x
+
+    def timestamps(self, samples, receive_ns):
+        # receive_ns: host time the packet holding samples arrived, time.time_ns()
+        if not samples:
+            return np.empty(0, dtype=np.int64)
+        device_s = self._device_time(samples)
+        if self._origin is None:
+            self._origin = (device_s[-1], receive_ns)
+        x = device_s - self._origin[0]
+        y = (receive_ns - self._origin[1]) * 1e-9
+
+        if self._sums[0] and abs(y - self._predict(x[-1]) - min(self._residuals)) > self.max_error:
+            self.resets += 1
+            self.reset()
+            return self.timestamps(samples, receive_ns)
+
+        self._sums *= self.decay
+        self._sums += (1.0, x[-1], y, x[-1] * x[-1], x[-1] * y)
+        weights, sx, sy, sxx, sxy = self._sums
+        variance = sxx / weights - (sx / weights) ** 2
+        if variance > 1e-2:
+            # drift is a few ppm for device_us, the packet rate is only nominal for packet ids
+            limit = 0.01 if samples[-1].device_us is not None else 0.5
+            self.skew = min(max((sxy / weights - sx * sy / weights ** 2) / variance, 1.0 - limit), 1.0 + limit)
+        self.intercept = (sy - self.skew * sx) / weights
+        self._residuals.append(y - self._predict(x[-1]))
+
+        host_s = self._predict(x) + min(self._residuals)
+        return self._origin[1] + np.rint(host_s * 1e9).astype(np.int64)
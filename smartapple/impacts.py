@@ -0,0 +1,52 @@
+import numpy as np
+
+# Impact events: runs of the acceleration magnitude above TRIGGER g, extended while it
+# stays above the release level (hysteresis) and merged when closer than REFRACTORY s.
+# data-analysis/impacts.py tables them per acquisition, smartapple.rollups counts them per window
+LEVELS = (1.0, 2.0, 3.0)  # g, the critical thresholds, the level of an impact is the number of these below its peak
+# The firmware streams the linear acceleration (gravity removed, near 0 g at rest), so the
+# trigger is the first critical threshold, every impact has a level. Recordings made with
+# gravity included (before 20240215) sit at 1 g at rest and are not comparable
+TRIGGER = LEVELS[0]  # g, an event needs a sample above this
+HYSTERESIS = 0.25  # g, the event lasts while the magnitude is above TRIGGER - HYSTERESIS
+REFRACTORY = 0.05  # s, events closer than this are one impact
+
+
+class ImpactDetector:
+    """Streaming impact detection of one magnitude series, fed in time order one batch at a time.
+
+    rises() marks the sample each impact is counted at: the first one above trigger of a run
+    above the release level, unless the run starts less than refractory s after the last
+    sample of the previous impact, then both are the same impact.
+    """
+
+    def __init__(self, trigger=TRIGGER, hysteresis=HYSTERESIS, refractory=REFRACTORY):
+        self.trigger = trigger
+        self.release = trigger - hysteresis
+        self.refractory_ns = int(refractory * 1e9)
+        self._run = None  # [start ns, reached the trigger] of the run still open at the end of the last batch
+        self._last_end = None  # ns of the last sample of the last impact
+
+    def rises(self, time_ns, magnitude):
+        time_ns = np.asarray(time_ns, dtype=np.int64)
+        magnitude = np.asarray(magnitude, dtype=np.float64)
+        rises = np.zeros(len(magnitude), dtype=bool)
+        if not len(magnitude):
+            return rises
+        edges = np.diff((magnitude > self.release).astype(np.int8), prepend=0, append=0)
+        starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        triggered = magnitude > self.trigger
+        run = None
+        for start, end in zip(starts, ends):
+            # the first run goes on with the one open at the end of the last batch
+            run = self._run if start == 0 and self._run is not None else [int(time_ns[start]), False]
+            if not run[1]:
+                above = np.flatnonzero(triggered[start:end])
+                if len(above):
+                    run[1] = True
+                    if self._last_end is None or run[0] - self._last_end >= self.refractory_ns:
+                        rises[start + above[0]] = True
+            if run[1]:
+                self._last_end = int(time_ns[end - 1])
+        self._run = run if len(ends) and ends[-1] == len(magnitude) else None
+        return rises
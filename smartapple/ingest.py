@@ -0,0 +1,348 @@
+import os
+import threading
+import time
+from collections import deque
+from itertools import islice
+import numpy as np
+from influxdb_client import WritePrecision
+from smartapple.metrics import Histogram
+from smartapple.payload import FIELDS
+
+# one line protocol row: packet_id is an integer field, the rest are floats, time in ns
+FIELD_TEMPLATE = ",".join(f"{name}=%di" if name == "packet_id" else f"{name}=%r" for name in FIELDS)
+
+
+def escape_tag(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def tag_set(measurement, tags):
+    return measurement + "".join(f",{key}={escape_tag(value)}" for key, value in sorted(tags.items()))
+
+
+def fields_line(measurement, tags, fields, time_ns):
+    # one line protocol row from a dict of int/float fields
+    field_set = ",".join(f"{escape_tag(key)}={value}i" if isinstance(value, int) else f"{escape_tag(key)}={float(value)!r}"
+                         for key, value in fields.items())
+    return f"{tag_set(measurement, tags)} {field_set} {time_ns}"
+
+
+def to_line_protocol(measurement, tags, columns):
+    # columns: time_ns + FIELDS arrays, as returned by smartapple.payload.decode_payload
+    line = tag_set(measurement, tags) + " " + FIELD_TEMPLATE + " %d"
+    rows = zip(*[columns[name].tolist() for name in FIELDS], columns["time_ns"].tolist())
+    return "\n".join([line % row for row in rows])
+
+
+class MemoryLog:
+    """In-memory stand-in for smartapple.spool.Spool, the queue of a BulkWriter without a WAL."""
+
+    def __init__(self):
+        self._records = deque()
+        self._lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.segments = 1
+        self.max_bytes = None
+
+    def append(self, topic, payload):
+        with self._lock:
+            self._records.append((topic, payload))
+            self.records += 1
+            self.bytes += len(payload)
+
+    def read(self, max_records=500, max_bytes=1_000_000):
+        records, size = [], 0
+        with self._lock:
+            for topic, payload in islice(self._records, max_records):
+                if records and size + len(payload) > max_bytes:
+                    break
+                records.append((topic, payload))
+                size += len(payload)
+        return records, (len(records), size)
+
+    def commit(self, position):
+        count, size = position
+        with self._lock:
+            for _ in range(count):
+                self._records.popleft()
+            self.records -= count
+            self.bytes -= size
+
+    def close(self):
+        pass
+
+
+def error_text(error):
+    # one line, without the HTTP headers of an ApiException
+    if getattr(error, "status", None) is not None:
+        return f"({error.status}) {' '.join(str(error.body or error.reason).split())}"
+    return " ".join(str(error).split())
+
+
+# InfluxDB refused the data itself (bad line protocol, schema conflict), retrying the same body will not help.
+# Other 4xx (401, 403, 404: token, permissions, bucket) are about the setup and are retried until fixed
+REJECTED_STATUSES = (400, 422)
+
+
+def is_rejected(error):
+    return getattr(error, "status", None) in REJECTED_STATUSES
+
+
+class BulkWriter:
+    """Buffers decoded columns per (address, production line) and writes them as line protocol.
+
+    add() only appends the column arrays; a worker thread serializes everything buffered
+    once max_points samples are pending or the oldest one is max_delay seconds old, and
+    appends it to the log: a smartapple.spool.Spool as write-ahead log when wal is given,
+    so that nothing accepted is lost by a restart or an InfluxDB outage, or a MemoryLog.
+    A second thread writes the log to InfluxDB, adapting the request size between
+    min_batch_bytes and max_batch_bytes to keep the write latency under target_latency.
+    Failed writes are retried with exponential backoff until the server is back. A batch
+    InfluxDB rejects (400/422, it would be rejected again) is not retried but bisected down
+    to the rejected records, which go to a dead-letter file in dead_letter_dir.
+
+    Backpressure: above high_water of max_memory (pending columns plus an in-memory log)
+    or of the WAL size, `backpressure` is set and reported; at max_memory add() blocks for
+    up to max_block seconds, then drops the samples, counts them and returns False.
+    write_api should be a synchronous one, the batching is done here.
+    """
+
+    def __init__(self, write_api, bucket, org, measurement="nicla", max_points=5000, max_delay=1.0,
+                 wal=None, max_memory=64_000_000, high_water=0.8, max_block=1.0, record_points=1000,
+                 target_latency=0.5, min_batch_bytes=64_000, max_batch_bytes=4_000_000,
+                 max_backoff=30.0, dead_letter_dir=None, drain_timeout=10.0):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.measurement = measurement
+        self.max_points = max_points
+        self.max_delay = max_delay
+        self.log = wal if wal is not None else MemoryLog()
+        self.max_memory = max_memory
+        self.high_water = high_water
+        self.max_block = max_block
+        self.record_points = record_points
+        self.target_latency = target_latency
+        self.min_batch_bytes = min_batch_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.batch_bytes = min_batch_bytes
+        self.max_backoff = max_backoff
+        self.dead_letter_dir = dead_letter_dir
+        self.drain_timeout = drain_timeout
+        self._buffers = {}  # (address, production line) -> list of column dicts
+        self._records = []  # ready line protocol rows, e.g. summaries
+        self._pending = 0
+        self._pending_bytes = 0  # as line protocol, estimated with the expansion of the last flush
+        self._expansion = 2.0  # line protocol bytes / column bytes
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)  # notified when memory is released
+        self._wakeup = threading.Event()
+        self._send_wakeup = threading.Event()
+        self._running = False
+        self._sending = False
+        self._drain_until = 0.0
+        self._thread = None
+        self._sender = None
+
+        # statistics
+        self.points = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.rejected = 0  # samples refused by add() at the memory ceiling
+        self.dead_letters = 0  # points written to dead-letter files
+        self.backpressure = False
+        self.write_latency = Histogram()
+
+    @property
+    def memory(self):
+        # bytes held in memory: pending columns, plus the queued batches without a WAL
+        return self._pending_bytes + (self.log.bytes if isinstance(self.log, MemoryLog) else 0)
+
+    def _update_backpressure(self):
+        wal_full = self.log.max_bytes is not None and self.log.bytes >= self.high_water * self.log.max_bytes
+        backpressure = wal_full or self.memory >= self.high_water * self.max_memory
+        if backpressure != self.backpressure:
+            self.backpressure = backpressure
+            print(f"InfluxDB writer {self.bucket}: backpressure {'on' if backpressure else 'off'}, "
+                  f"{self.memory / 1e6:.1f} MB in memory, {self.log.bytes / 1e6:.1f} MB queued")
+
+    def add(self, address, production_line, columns):
+        # False when the samples were dropped at the memory ceiling
+        count = len(columns["time_ns"])
+        if not count:
+            return True
+        size = int(sum(column.nbytes for column in columns.values()) * self._expansion)
+        with self._lock:
+            deadline = time.monotonic() + self.max_block
+            while self.memory + size > self.max_memory:
+                # hold the caller (the MQTT network loop) until the writer catches up
+                self._wakeup.set()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    self.rejected += count
+                    return False
+                self._drained.wait(remaining)
+            self._buffers.setdefault((address, production_line), []).append(columns)
+            self._pending += count
+            self._pending_bytes += size
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = self._pending >= self.max_points
+        if full:
+            self._wakeup.set()
+        return True
+
+    def add_record(self, measurement, tags, fields, time_ns=None):
+        # a single row written with the next batch
+        line = fields_line(measurement, tags, fields, time_ns or time.time_ns())
+        with self._lock:
+            self._records.append(line)
+            self._pending_bytes += len(line)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def start(self):
+        self._running = True
+        self._sending = True
+        self._thread = threading.Thread(target=self._run, name="influxdb-batcher", daemon=True)
+        self._thread.start()
+        self._sender = threading.Thread(target=self._send, name="influxdb-writer", daemon=True)
+        self._sender.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+        # write what is queued, a WAL keeps whatever is left for the next start
+        self._drain_until = time.monotonic() + self.drain_timeout
+        self._sending = False
+        self._send_wakeup.set()
+        if self._sender:
+            self._sender.join()
+        self.log.close()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self.max_delay / 2)
+            self._wakeup.clear()
+            oldest = self._oldest
+            if (self._pending >= self.max_points or self.memory > self.high_water * self.max_memory
+                    or (oldest is not None and time.monotonic() - oldest >= self.max_delay)):
+                self.flush()
+            self._update_backpressure()
+
+    def flush(self):
+        # serializes the buffered samples to the log, records of at most record_points rows
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+            lines, self._records = self._records, []
+            count, self._pending = self._pending, 0
+            self._pending_bytes = 0
+            self._oldest = None
+        if not count and not lines:
+            return
+
+        records = ["\n".join(lines)] if lines else []
+        column_bytes = 0
+        for (address, production_line), chunks in buffers.items():
+            columns = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+            column_bytes += sum(column.nbytes for column in columns.values())
+            tags = {"address": address, "production_line": production_line}
+            for first in range(0, len(columns["time_ns"]), self.record_points):
+                part = {name: column[first:first + self.record_points] for name, column in columns.items()}
+                records.append(to_line_protocol(self.measurement, tags, part))
+        if column_bytes:
+            self._expansion = (sum(len(record) for record in records) - len(records[0] if lines else "")) / column_bytes
+        try:
+            for record in records:
+                self.log.append(self.bucket, record.encode())
+        except OSError as e:
+            # WAL full or unwritable
+            self.rejected += count
+            print(f"InfluxDB writer {self.bucket}: {count} points lost, WAL append failed: {e}")
+        with self._lock:
+            self._drained.notify_all()
+        self._send_wakeup.set()
+
+    def _send(self):
+        attempts = 0
+        # records of a rejected batch left before its rejected record is found, read `chunk` at a time
+        suspect, chunk = 0, 0
+        while self._sending or (self.log.records and time.monotonic() < self._drain_until):
+            records, position = self.log.read(max_records=chunk if suspect else 100_000, max_bytes=self.batch_bytes)
+            if not records:
+                self._send_wakeup.wait(self.max_delay / 2)
+                self._send_wakeup.clear()
+                continue
+            body = b"\n".join(payload for _, payload in records)
+            points = body.count(b"\n") + 1
+            start = time.monotonic()
+            try:
+                self.write_api.write(self.bucket, self.org, body, write_precision=WritePrecision.NS)
+            except Exception as e:
+                self.write_errors += 1
+                if is_rejected(e):
+                    # the same body would be rejected again: bisect down to the records InfluxDB rejects
+                    if len(records) > 1:
+                        suspect = suspect or len(records)
+                        chunk = len(records) // 2
+                        continue
+                    # found, back to whole batches, another rejected record is bisected again
+                    self._dead_letter(body, points, e)
+                    self._commit(position)
+                    suspect = attempts = 0
+                    continue
+                attempts += 1
+                self.batch_bytes = max(self.min_batch_bytes, self.batch_bytes // 2)
+                backoff = min(self.max_backoff, 0.5 * 2 ** attempts)
+                print(f"InfluxDB write of {points} points failed (attempt {attempts}), retrying in {backoff:.1f} s: {error_text(e)}")
+                self._send_wakeup.wait(backoff if self._sending else min(backoff, max(0.0, self._drain_until - time.monotonic())))
+                self._send_wakeup.clear()
+                continue
+            latency = time.monotonic() - start
+            self.write_latency.observe(latency)
+            self._commit(position)
+            self.points += points
+            self.batches += 1
+            suspect = max(0, suspect - len(records))
+            attempts = 0
+            # additive increase while the server keeps up, multiplicative decrease when it does not
+            if latency < self.target_latency:
+                self.batch_bytes = min(self.max_batch_bytes, self.batch_bytes + max(self.batch_bytes // 4, self.min_batch_bytes))
+            else:
+                self.batch_bytes = max(self.min_batch_bytes, self.batch_bytes // 2)
+
+    def _commit(self, position):
+        self.log.commit(position)
+        with self._lock:
+            self._drained.notify_all()
+
+    def _dead_letter(self, body, points, error):
+        self.dead_letters += points
+        if self.dead_letter_dir is None:
+            print(f"InfluxDB rejected {points} points, dropped: {error_text(error)}")
+            return
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+        path = os.path.join(self.dead_letter_dir, f"{self.bucket}_{time.strftime('%Y%m%d_%H%M%S')}_{time.time_ns() % 10**9:09d}.lp")
+        # line protocol with the error as a comment, `influx write --file` takes it back
+        reason = error_text(error)
+        with open(path, "wb") as f:
+            f.write(f"# {reason}\n".encode() + body + b"\n")
+        print(f"InfluxDB rejected {points} points, written to {path}: {reason}")
+
+    def report(self):
+        print(f"InfluxDB writer: {self.pending} pending, {self.points} points in {self.batches} batches, "
+              f"{self.write_errors} errors, write latency {self.write_latency.summary()}")
+        print(f"InfluxDB writer: queue {self.log.records} records ({self.log.bytes / 1e6:.1f} MB), "
+              f"memory {self.memory / 1e6:.1f} of {self.max_memory / 1e6:.0f} MB, batch {self.batch_bytes / 1e3:.0f} kB, "
+              f"backpressure {'on' if self.backpressure else 'off'}, {self.rejected} rejected, "
+              f"{self.dead_letters} dead-lettered, {self.log.dropped} dropped from the WAL")
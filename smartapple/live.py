@@ -0,0 +1,176 @@
+import threading
+import time
+import numpy as np
+import paho.mqtt.client as paho
+from smartapple.payload import decode_payload
+from smartapple.registry import TOPIC_ROOT
+from smartapple.rollups import ACCEL_LSB_PER_G, GYRO_LSB_PER_DPS
+
+# channels kept per sample, in g and °/s, with the magnitudes
+CHANNELS = ['a_x', 'a_y', 'a_z', 'g_x', 'g_y', 'g_z', 'accel', 'gyro']
+
+
+def minmax_decimate(time_ns, values, points):
+    """At most `points` samples of a window: the min and the max of each of points / 2 buckets.
+
+    Spikes survive, unlike with a plain stride. time_ns (n,) and values (n, channels),
+    the bucket min comes first, at the bucket start, and the max at the bucket end.
+    """
+    n = len(time_ns)
+    buckets = points // 2
+    if n <= points or buckets < 1:
+        return time_ns, values
+    starts = np.linspace(0, n, buckets, endpoint=False).astype(np.int64)
+    ends = np.append(starts[1:], n) - 1
+    times = np.empty(2 * buckets, dtype=np.int64)
+    times[0::2], times[1::2] = time_ns[starts], time_ns[ends]
+    decimated = np.empty((2 * buckets, values.shape[1]), dtype=values.dtype)
+    decimated[0::2] = np.minimum.reduceat(values, starts, axis=0)
+    decimated[1::2] = np.maximum.reduceat(values, starts, axis=0)
+    return times, decimated
+
+
+class RingBuffer:
+    """The last `capacity` samples of one apple in preallocated arrays."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.time_ns = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(CHANNELS)), dtype=np.float32)
+        self.written = 0  # samples ever appended
+
+    def append(self, time_ns, values):
+        count = len(time_ns)
+        if count > self.capacity:
+            time_ns, values = time_ns[-self.capacity:], values[-self.capacity:]
+            self.written += count - self.capacity
+            count = self.capacity
+        start = self.written % self.capacity
+        first = min(count, self.capacity - start)
+        self.time_ns[start:start + first], self.values[start:start + first] = time_ns[:first], values[:first]
+        self.time_ns[:count - first], self.values[:count - first] = time_ns[first:], values[first:]
+        self.written += count
+
+    def last(self, seconds):
+        # samples of the `seconds` before the last one received, in time order. Arrival order is
+        # not time order (reordered batches, device clock resets), so the window is a mask: after
+        # a reset the samples stamped ahead of the new clock fall out of it
+        count = min(self.written, self.capacity)
+        if not count:
+            return self.time_ns[:0], self.values[:0]
+        newest = self.time_ns[(self.written - 1) % self.capacity]
+        stored = self.time_ns[:count]
+        index = np.flatnonzero((stored >= newest - int(seconds * 1e9)) & (stored <= newest))
+        index = index[np.argsort(stored[index], kind='stable')]
+        return stored[index], self.values[index]
+
+
+class LiveFeed:
+    """One MQTT subscription feeding per-apple ring buffers, shared by every page and browser tab.
+
+    Messages are decoded on the paho network thread into a RingBuffer of `capacity`
+    samples per apple. window() returns a decimated view of the last seconds; a window is
+    recomputed at most every min_interval seconds and only when new samples arrived, so the
+    work does not grow with the number of readers.
+    """
+
+    def __init__(self, host, port=1883, capacity=60_000, min_interval=0.5, client_id=""):
+        self.host = host
+        self.port = port
+        self.capacity = capacity
+        self.min_interval = min_interval
+        self.client = paho.Client(client_id=client_id, clean_session=True)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self._buffers = {}  # address -> RingBuffer
+        self._windows = {}  # (address, seconds, points) -> (computed at, samples written, times, values)
+        self._lock = threading.Lock()
+        self.production_lines = {}  # address -> last production line published
+
+        # statistics
+        self.messages = 0
+        self.samples = 0
+        self.errors = 0
+        self.computed = 0
+        self.served = 0
+
+    def start(self):
+        # connects, and reconnects, in the background
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.connect_async(self.host, self.port, 60)
+        self.client.loop_start()
+        return self
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe([(f"{TOPIC_ROOT}/+/movement_sensor_data/#", 0), (f"{TOPIC_ROOT}/+/prod_line/#", 0)])
+
+    def _on_message(self, client, userdata, msg):
+        parts = msg.topic.split("/")
+        address = parts[1]
+        try:
+            if parts[2] == "prod_line":
+                self.production_lines[address] = msg.payload.decode().split(",")[0]
+                return
+            columns = decode_payload(msg.topic, msg.payload)
+        except Exception:
+            self.errors += 1
+            return
+        count = len(columns["time_ns"])
+        if not count:
+            return
+        values = np.empty((count, len(CHANNELS)), dtype=np.float32)
+        for i, name in enumerate(CHANNELS[:6]):
+            values[:, i] = columns[name] / (ACCEL_LSB_PER_G if name[0] == 'a' else GYRO_LSB_PER_DPS)
+        values[:, 6] = np.sqrt((values[:, 0:3] ** 2).sum(axis=1))
+        values[:, 7] = np.sqrt((values[:, 3:6] ** 2).sum(axis=1))
+        with self._lock:
+            buffer = self._buffers.get(address)
+            if buffer is None:
+                buffer = self._buffers[address] = RingBuffer(self.capacity)
+            buffer.append(np.asarray(columns["time_ns"], dtype=np.int64), values)
+        self.messages += 1
+        self.samples += count
+
+    @property
+    def connected(self):
+        return self.client.is_connected()
+
+    def devices(self, production_line=None):
+        return sorted(address for address in list(self._buffers)
+                      if production_line is None or self.production_lines.get(address) == production_line)
+
+    def version(self, address):
+        # changes whenever samples of the apple arrive
+        buffer = self._buffers.get(address)
+        return buffer.written if buffer is not None else 0
+
+    def window(self, address, seconds=10.0, points=1000):
+        """(version, time as datetime64[ns], {channel: values}) of the last seconds of an apple, at most `points` long.
+
+        The version is the one of the samples the window was computed from, equal versions mean equal windows.
+        """
+        key = (address, seconds, points)
+        cached = self._windows.get(key)
+        now = time.monotonic()
+        version = self.version(address)
+        if cached is None or (cached[1] != version and now - cached[0] >= self.min_interval):
+            with self._lock:
+                buffer = self._buffers.get(address)
+                if buffer is None:
+                    time_ns, values = np.zeros(0, dtype=np.int64), np.zeros((0, len(CHANNELS)), dtype=np.float32)
+                else:
+                    time_ns, values = buffer.last(seconds)
+            time_ns, values = minmax_decimate(time_ns, values, points)
+            cached = self._windows[key] = (now, version, time_ns.astype('datetime64[ns]'), values)
+            self.computed += 1
+        self.served += 1
+        return cached[1], cached[2], {name: cached[3][:, i] for i, name in enumerate(CHANNELS)}
+
+    def summary(self):
+        return (f"{len(self._buffers)} apples, {self.messages} messages, {self.samples} samples, {self.errors} errors, "
+                f"{self.computed} windows computed for {self.served} served")
@@ -0,0 +1,45 @@
+from bisect import bisect_left
+
+# Default bucket upper bounds in seconds
+LATENCY_BOUNDS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram, cheap enough to update from callbacks."""
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th value (max for the overflow bucket)
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.max
+
+    def buckets(self):
+        return list(zip(self.bounds + (float('inf'),), self.counts))
+
+    def summary(self, unit='s'):
+        if not self.count:
+            return "n=0"
+        return (f"n={self.count} mean={self.mean():.3f}{unit} p50<={self.quantile(0.5)}{unit} "
+                f"p95<={self.quantile(0.95)}{unit} max={self.max:.3f}{unit}")
@@ -0,0 +1,113 @@
+import re
+import struct
+from collections import namedtuple
+from datetime import timedelta
+
+# Characteristic exposing the firmware packet format (see arduino-nicla-firmware)
+VERSION_UUID = "19b10000-1001-537e-4f6c-d104768a1214"
+
+# Packet formats, the low byte of the version characteristic
+FORMAT_TEXT = 0    # legacy "id,G:x,y,z,A:x,y,z,Q:x,y,z,w" ASCII line
+FORMAT_BINARY = 1  # header + one packed int16 sample
+FORMAT_BATCH = 2   # header + up to 10 packed int16 samples with relative timestamps
+
+# Binary header: format version, reserved byte, packet id (little endian)
+HEADER = struct.Struct('<BxI')
+# Binary sample: gyro[3], accel[3] in LSB and quaternion[4] in Q14 fixed point
+SAMPLE = struct.Struct('<10h')
+QUAT_SCALE = 1.0 / 16384.0
+
+# Batch header: format version, sample count, packet id of the first sample,
+# device time of the first sample (us, wraps every ~71 minutes)
+BATCH_HEADER = struct.Struct('<BBII')
+# Batch sample: offset from the header time in 100 us ticks followed by a SAMPLE
+BATCH_SAMPLE = struct.Struct('<H10h')
+BATCH_TICK_US = 100
+
+# Precompiled regular expression pattern for the legacy text format
+pattern = re.compile(r'(\d+),G:([\d.-]+),([\d.-]+),([\d.-]+),A:([\d.-]+),([\d.-]+),([\d.-]+),Q:([\d.-]+),([\d.-]+),([\d.-]+),([\d.-]+)')
+
+# One decoded sample, gyro and accel in raw LSB units as sent by the Nicla.
+# device_us is the device clock of the sample, None for formats without it.
+Sample = namedtuple('Sample', ['packet_id', 'g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z', 'q_x', 'q_y', 'q_z', 'q_w', 'device_us'],
+                    defaults=(None,))
+
+
+def decode_text(data):
+    match = pattern.match(data.decode('utf-8', errors='replace'))
+    if not match:
+        return []
+    packet_id, *values = match.groups()
+    return [Sample(int(packet_id), *map(float, values))]
+
+
+def decode_binary(data):
+    if len(data) < HEADER.size + SAMPLE.size:
+        return []
+    version, packet_id = HEADER.unpack_from(data)
+    if version != FORMAT_BINARY:
+        return []
+    g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w = SAMPLE.unpack_from(data, HEADER.size)
+    return [Sample(packet_id, g_x, g_y, g_z, a_x, a_y, a_z,
+                   q_x * QUAT_SCALE, q_y * QUAT_SCALE, q_z * QUAT_SCALE, q_w * QUAT_SCALE)]
+
+
+def decode_batch(data):
+    if len(data) < BATCH_HEADER.size:
+        return []
+    version, count, packet_id, base_us = BATCH_HEADER.unpack_from(data)
+    if version != FORMAT_BATCH or len(data) < BATCH_HEADER.size + count * BATCH_SAMPLE.size:
+        return []
+    samples = []
+    end = BATCH_HEADER.size + count * BATCH_SAMPLE.size
+    for i, (ticks, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w) in enumerate(
+            BATCH_SAMPLE.iter_unpack(data[BATCH_HEADER.size:end])):
+        samples.append(Sample(packet_id + i, g_x, g_y, g_z, a_x, a_y, a_z,
+                              q_x * QUAT_SCALE, q_y * QUAT_SCALE, q_z * QUAT_SCALE, q_w * QUAT_SCALE,
+                              (base_us + ticks * BATCH_TICK_US) & 0xFFFFFFFF))
+    return samples
+
+
+_binary_decoders = {
+    FORMAT_BINARY: decode_binary,
+    FORMAT_BATCH: decode_batch,
+}
+
+
+def decode_packet(data):
+    # Text packets always start with an ASCII digit, binary ones with the format version byte
+    if not data:
+        return []
+    if data[0] >= 0x30:
+        return decode_text(data)
+    decoder = _binary_decoders.get(data[0])
+    return decoder(data) if decoder else []
+
+
+def packet_sample_count(data):
+    # number of samples in a packet without decoding it
+    if not data:
+        return 0
+    if data[0] == FORMAT_BATCH:
+        return data[1] if len(data) > 1 else 0
+    return 1
+
+
+def sample_timestamps(samples, receive_time):
+    # The notification arrives right after its last sample, earlier samples are
+    # placed back in time using the device clock offsets
+    if not samples or samples[-1].device_us is None:
+        return [receive_time] * len(samples)
+    last_us = samples[-1].device_us
+    return [receive_time - timedelta(microseconds=(last_us - s.device_us) & 0xFFFFFFFF) for s in samples]
+
+
+async def read_format_version(client):
+    # Older firmware reports 0 (text), the low byte holds the packet format
+    # and the next one the number of samples per notification
+    try:
+        value = await client.read_gatt_char(VERSION_UUID)
+    except Exception as e:
+        print(f"Couldn't read the firmware version, assuming text packets: {e}")
+        return FORMAT_TEXT
+    return int.from_bytes(value, 'little') & 0xFF
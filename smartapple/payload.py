@@ -0,0 +1,95 @@
+import struct
+import numpy as np
+
+# MQTT payload formats of nicla/<address>/movement_sensor_data[/<format>]
+PAYLOAD_TEXT = None    # no suffix: "timestamp,packet_id,g_x,...,q_w" lines (legacy)
+PAYLOAD_BINARY = "bin1"  # packed little endian columns, see encode_binary
+
+FIELDS = ['packet_id', 'g_x', 'g_y', 'g_z', 'a_x', 'a_y', 'a_z', 'q_x', 'q_y', 'q_z', 'q_w']
+
+# bin1 header: format version, sample count, base time (ns since the epoch, UTC)
+HEADER = struct.Struct('<BHq')
+BINARY_VERSION = 1
+# bin1 columns, in order, each `count` values long
+COLUMNS = [
+    ('time_delta', '<i4'),  # us from the base time
+    ('packet_id', '<u4'),
+    ('g_x', '<i2'), ('g_y', '<i2'), ('g_z', '<i2'),  # raw LSB
+    ('a_x', '<i2'), ('a_y', '<i2'), ('a_z', '<i2'),  # raw LSB
+    ('q_x', '<i2'), ('q_y', '<i2'), ('q_z', '<i2'), ('q_w', '<i2'),  # Q14 fixed point
+]
+QUAT_SCALE = 16384.0
+MAX_SAMPLES = 0xFFFF
+
+
+# samples spooled by the slave during an outage are sent again on nicla/<address>/movement_sensor_replay[/<format>],
+# so that the live consumers (sequence tracking, live charts) never see them
+REPLAY_KIND = "movement_sensor_replay"
+
+
+def topic_suffix(topic):
+    # payload format from "nicla/<address>/movement_sensor_data[/<format>]"
+    parts = topic.split("/")
+    return parts[3] if len(parts) > 3 else PAYLOAD_TEXT
+
+
+def replay_topic(topic):
+    # the replay topic of a movement_sensor_data topic, same address and format
+    parts = topic.split("/")
+    parts[2] = REPLAY_KIND
+    return "/".join(parts)
+
+
+def encode_binary(samples, timestamps):
+    # timestamps in integer ns since the epoch, see smartapple.clock
+    count = len(samples)
+    if count > MAX_SAMPLES:
+        raise ValueError(f"Too many samples for one payload: {count}")
+    time_ns = np.asarray(timestamps, dtype=np.int64)
+    base_ns = int(time_ns[0]) if count else 0
+    values = np.array([sample[:11] for sample in samples], dtype=np.float64).reshape(count, 11)
+
+    chunks = [HEADER.pack(BINARY_VERSION, count, base_ns),
+              ((time_ns - base_ns) // 1000).astype('<i4').tobytes(),
+              values[:, 0].astype('<u4').tobytes()]
+    chunks += [np.rint(values[:, i]).astype('<i2').tobytes() for i in range(1, 7)]
+    chunks += [np.rint(values[:, i] * QUAT_SCALE).astype('<i2').tobytes() for i in range(7, 11)]
+    return b"".join(chunks)
+
+
+def decode_binary(payload):
+    version, count, base_ns = HEADER.unpack_from(payload)
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unknown binary payload version {version}")
+    columns = {}
+    offset = HEADER.size
+    for name, dtype in COLUMNS:
+        column = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += column.nbytes
+        columns[name] = column
+    time_ns = base_ns + columns.pop('time_delta').astype(np.int64) * 1000
+    decoded = {'time_ns': time_ns, 'packet_id': columns['packet_id'].astype(np.int64)}
+    for name in FIELDS[1:7]:
+        decoded[name] = columns[name].astype(np.float64)
+    for name in FIELDS[7:]:
+        decoded[name] = columns[name] / QUAT_SCALE
+    return decoded
+
+
+def decode_text(payload):
+    rows = [line.split(",") for line in payload.decode().splitlines() if line]
+    decoded = {'time_ns': np.array([row[0] for row in rows], dtype='datetime64[ns]').astype(np.int64),
+               'packet_id': np.array([int(row[1]) for row in rows], dtype=np.int64)}
+    for i, name in enumerate(FIELDS[1:], start=2):
+        decoded[name] = np.array([float(row[i]) for row in rows], dtype=np.float64)
+    return decoded
+
+
+def decode_payload(topic, payload):
+    # columns dict (time_ns + FIELDS) for any supported payload format
+    suffix = topic_suffix(topic)
+    if suffix == PAYLOAD_TEXT:
+        return decode_text(payload)
+    if suffix == PAYLOAD_BINARY:
+        return decode_binary(payload)
+    raise ValueError(f"Unknown payload format {suffix}")
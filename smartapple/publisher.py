@@ -0,0 +1,250 @@
+import json
+import threading
+import time
+from collections import deque
+import numpy as np
+import paho.mqtt.client as paho
+from smartapple.clock import DeviceClock
+from smartapple.metrics import Histogram
+from smartapple.packet import decode_packet
+from smartapple.payload import replay_topic
+from smartapple.sequence import SequenceTracker
+
+
+def encode_text(samples, timestamps):
+    # legacy payload, one "timestamp,packet_id,g_x,...,q_w" line per sample, timestamps in ns since the epoch
+    strings = np.datetime_as_string(np.asarray(timestamps, dtype='datetime64[ns]'), unit='us')
+    return "\n".join(f"{timestamp.replace('T', ' ')},{packet_id},{g_x},{g_y},{g_z},{a_x},{a_y},{a_z},{q_x},{q_y},{q_z},{q_w}"
+                     for timestamp, (packet_id, g_x, g_y, g_z, a_x, a_y, a_z, q_x, q_y, q_z, q_w, _)
+                     in zip(strings, samples))
+
+
+class MqttPublisher:
+    """Decodes and publishes BLE packets on a worker thread, away from the BLE event loop.
+
+    The notification callback only calls submit(), which appends the raw bytes and the
+    receive time to a bounded ring buffer (the oldest packets are dropped when full).
+    The worker timestamps the samples with each device clock, then coalesces up to
+    max_samples samples per device into one MQTT message, or whatever arrived within
+    max_delay seconds.
+
+    With a spool (smartapple.spool.Spool) messages are published with QoS 1 and written
+    to the spool instead when the client is disconnected, when more than max_inflight are
+    waiting for their PUBACK (slow broker), or when one is not acknowledged within
+    ack_timeout seconds. A replay thread publishes the spool back, on the replay topic of
+    each message (smartapple.payload.replay_topic), in batches of replay_batch messages once
+    the broker is reachable, at most replay_rate bytes/s and
+    only while the live messages are flowing, and commits a batch once all of it is acknowledged.
+    """
+
+    def __init__(self, client, topic="nicla/{address}/movement_sensor_data", encode=encode_text,
+                 max_queue=20000, max_samples=100, max_delay=0.1, qos=0, link_topic="nicla/{address}/link_stats",
+                 spool=None, max_inflight=200, ack_timeout=10.0, replay_batch=500, replay_rate=250_000):
+        self.client = client
+        self.topic = topic
+        self.link_topic = link_topic
+        self.encode = encode
+        self.max_samples = max_samples
+        self.max_delay = max_delay
+        self.qos = 1 if spool is not None else qos
+        self.spool = spool
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        self.replay_batch = replay_batch
+        self.replay_rate = replay_rate
+        self._inflight = deque()  # (MQTTMessageInfo, topic, payload, publish time) waiting for the PUBACK
+        self._replay_thread = None
+        self._queue = deque(maxlen=max_queue)
+        self.clocks = {}  # address -> DeviceClock
+        self.sequences = {}  # address -> SequenceTracker of the BLE link
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+        # statistics
+        self.dropped = 0
+        self.invalid = 0
+        self.messages = 0
+        self.samples = 0
+        self.publish_errors = 0
+        self.max_depth = 0
+        self.publish_latency = Histogram()
+        self.spooled = 0
+        self.replayed = 0
+        self.replayed_bytes = 0
+        self._last_report = (time.monotonic(), 0, 0)  # replay throughput since the last report
+
+    def submit(self, address, data):
+        # called from the BLE callback: no decoding, no formatting, never blocks
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append((address, bytes(data), time.time_ns()))
+        self._wakeup.set()
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def start(self):
+        # the paho network loop runs on its own thread as well
+        if self.spool is not None:
+            self.client.max_inflight_messages_set(self.max_inflight)
+        self.client.loop_start()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="mqtt-publisher", daemon=True)
+        self._thread.start()
+        if self.spool is not None:
+            self._replay_thread = threading.Thread(target=self._replay, name="mqtt-replay", daemon=True)
+            self._replay_thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+        if self._replay_thread:
+            self._replay_thread.join()
+        if self.spool is not None:
+            # whatever is not acknowledged yet is replayed at the next start
+            self._check_inflight(drain=self.ack_timeout if self.client.is_connected() else 0.0)
+            self.spool.close()
+        self.client.loop_stop()
+
+    def _run(self):
+        pending = {}  # address -> [samples, timestamps, oldest receive time]
+        while self._running or self._queue:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            self.max_depth = max(self.max_depth, len(self._queue))
+
+            while self._queue:
+                address, data, receive_time = self._queue.popleft()
+                samples = decode_packet(data)
+                if not samples:
+                    self.invalid += 1
+                    continue
+                clock = self.clocks.get(address)
+                if clock is None:
+                    clock = self.clocks[address] = DeviceClock()
+                    self.sequences[address] = SequenceTracker()
+                self.sequences[address].observe([sample.packet_id for sample in samples], receive_time)
+                timestamps = clock.timestamps(samples, receive_time)
+                batch = pending.setdefault(address, [[], [], receive_time])
+                batch[0].extend(samples)
+                batch[1].extend(timestamps.tolist())
+                if len(batch[0]) >= self.max_samples:
+                    self._publish(address, pending.pop(address))
+
+            now = time.time_ns()
+            for address in [a for a, batch in pending.items() if now - batch[2] >= self.max_delay * 1e9 or not self._running]:
+                self._publish(address, pending.pop(address))
+            if self.spool is not None:
+                self._check_inflight()
+
+    def _publish(self, address, batch):
+        samples, timestamps, oldest = batch
+        topic, payload = self.topic.format(address=address), self.encode(samples, timestamps)
+        if self.spool is not None and (not self.client.is_connected() or len(self._inflight) >= self.max_inflight):
+            self._spool(topic, payload)
+            return
+        info = self.client.publish(topic, payload, self.qos)
+        if info.rc != paho.MQTT_ERR_SUCCESS:
+            self.publish_errors += 1
+            if self.spool is not None:
+                self._spool(topic, payload)
+            return
+        if self.spool is not None:
+            self._inflight.append((info, topic, payload, time.monotonic()))
+        self.messages += 1
+        self.samples += len(samples)
+        self.publish_latency.observe((time.time_ns() - oldest) * 1e-9)
+
+    def _spool(self, topic, payload):
+        self.spool.append(topic, payload)
+        self.spooled += 1
+
+    def _check_inflight(self, drain=None):
+        # forget the acknowledged messages and spool the ones older than ack_timeout,
+        # or when draining everything not acknowledged within drain seconds
+        deadline = time.monotonic() + (drain or 0.0)
+        while self._inflight:
+            info, topic, payload, published = self._inflight[0]
+            now = time.monotonic()
+            if info.is_published():
+                self._inflight.popleft()
+            elif now - published >= self.ack_timeout or (drain is not None and now >= deadline):
+                # a duplicate if the PUBACK was only late, InfluxDB keeps one point per timestamp
+                self._inflight.popleft()
+                self._spool(topic, payload)
+            elif drain is not None:
+                time.sleep(0.01)
+            else:
+                break
+
+    def _replay(self):
+        # drains the spool while the broker is reachable, never faster than replay_rate
+        while self._running:
+            try:
+                self._replay_batch()
+            except Exception as e:
+                # e.g. a spool error, the batch is read again
+                print(f"Spool replay failed, retrying: {e}")
+                time.sleep(1.0)
+
+    def _replay_batch(self):
+        if (not self.client.is_connected() or not self.spool.records
+                or len(self._inflight) >= self.max_inflight // 2):
+            # offline, nothing to replay, or the broker is busy with the live messages
+            time.sleep(0.5)
+            return
+        records, position = self.spool.read(self.replay_batch)
+        if not records:
+            time.sleep(0.5)
+            return
+        started, size, infos = time.monotonic(), 0, []
+        for topic, payload in records:
+            info = self.client.publish(replay_topic(topic), payload, 1)
+            if info.rc != paho.MQTT_ERR_SUCCESS:
+                break
+            infos.append(info)
+            size += len(payload)
+            # spread the batch at replay_rate, the live messages go out in between
+            time.sleep(max(0.0, size / self.replay_rate - (time.monotonic() - started)))
+        # commit once the whole batch is acknowledged, otherwise read it again later
+        deadline = time.monotonic() + self.ack_timeout
+        while not all(info.is_published() for info in infos) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if len(infos) == len(records) and all(info.is_published() for info in infos):
+            self.spool.commit(position)
+            self.replayed += len(records)
+            self.replayed_bytes += size
+        else:
+            time.sleep(1.0)
+
+    def publish_link_stats(self):
+        # packet loss summary of every apple, the master writes it to InfluxDB
+        if not self.client.is_connected():
+            return
+        for address, sequence in list(self.sequences.items()):
+            self.client.publish(self.link_topic.format(address=address), json.dumps(sequence.summary()), self.qos)
+
+    def report(self):
+        print(f"MQTT publisher: depth {self.depth} (max {self.max_depth}), {self.dropped} dropped, "
+              f"{self.invalid} invalid, {self.messages} messages, {self.samples} samples, "
+              f"{self.publish_errors} errors, latency {self.publish_latency.summary()}")
+        if self.spool is not None:
+            now = time.monotonic()
+            last, replayed, replayed_bytes = self._last_report
+            elapsed = max(now - last, 1e-9)
+            print(f"Spool: {self.spool.records} messages ({self.spool.bytes / 1e6:.1f} MB in {self.spool.segments} segments), "
+                  f"{self.spooled} spooled, {self.replayed} replayed "
+                  f"({(self.replayed - replayed) / elapsed:.0f} msg/s, {(self.replayed_bytes - replayed_bytes) / elapsed / 1e3:.0f} kB/s), "
+                  f"{len(self._inflight)} waiting for PUBACK, {self.spool.dropped} dropped")
+            self._last_report = (now, self.replayed, self.replayed_bytes)
+        for address, sequence in list(self.sequences.items()):
+            print(f"[{address}] BLE link: {sequence.lost} lost in {sequence.gaps} gaps, "
+                  f"{sequence.duplicates} duplicates, {sequence.reorders} reordered, {sequence.resets} resets, "
+                  f"loss {sequence.loss_rate():.2%} (recent {sequence.rolling_loss_rate():.2%}), "
+                  f"inter-arrival {sequence.interarrival.summary()}")
+        if self.link_topic:
+            self.publish_link_stats()
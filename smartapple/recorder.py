@@ -0,0 +1,138 @@
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+# fsync policies
+FSYNC_NEVER = "never"    # leave it to the OS
+FSYNC_ROTATE = "rotate"  # when a file is closed
+FSYNC_FLUSH = "flush"    # after every buffer written
+
+
+class CsvRecorder:
+    """Records timestamped samples to CSV files without blocking the caller.
+
+    append() copies one row into a preallocated buffer; full buffers (or the partial
+    one every flush_interval seconds) are formatted and written by a background thread.
+    Files only ever contain whole rows and are flushed after each write, so they can be
+    read while recording. A new file is started every max_bytes or max_seconds.
+    """
+
+    def __init__(self, directory, name, columns, buffer_rows=1000, flush_interval=1.0,
+                 max_bytes=100_000_000, max_seconds=3600.0, fsync=FSYNC_ROTATE, int_columns=("packet_id",)):
+        # columns: header, the first one is the timestamp (ns since the epoch, written as UTC date time)
+        self.directory = directory
+        self.name = name
+        self.columns = list(columns)
+        self.buffer_rows = buffer_rows
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.fsync = fsync
+        self.row_format = ",".join(["%s"] + ["%d" if c in int_columns else "%r" for c in self.columns[1:]])
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._free = []  # buffers ready for reuse
+        self._times, self._values = self._new_buffer()
+        self._count = 0
+        self._queue = queue.Queue()
+        self._running = False
+        self._thread = None
+        self._file = None
+        self._file_bytes = 0
+        self._file_opened = None
+
+        # statistics
+        self.paths = []
+        self.rows = 0
+        self.flushes = 0
+        self.max_queue = 0
+
+    def _new_buffer(self):
+        if self._free:
+            return self._free.pop()
+        return np.empty(self.buffer_rows, dtype=np.int64), np.empty((self.buffer_rows, len(self.columns) - 1))
+
+    def append(self, time_ns, values):
+        with self._lock:
+            self._times[self._count] = time_ns
+            self._values[self._count] = values
+            self._count += 1
+            if self._count == self.buffer_rows:
+                self._swap()
+
+    def _swap(self):
+        # hand the current buffer to the writer thread, called with the lock held
+        self._queue.put((self._times, self._values, self._count))
+        self.max_queue = max(self.max_queue, self._queue.qsize())
+        self._times, self._values = self._new_buffer()
+        self._count = 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"recorder-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            if self._count:
+                self._swap()
+        self._running = False
+        self._queue.put(None)
+        if self._thread:
+            self._thread.join()
+        self._close()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # write whatever arrived since the last flush
+                with self._lock:
+                    if self._count:
+                        self._swap()
+                continue
+            if item is None:
+                break
+            times, values, count = item
+            self._write(times[:count], values[:count])
+            with self._lock:
+                self._free.append((times, values))
+
+    def _open(self):
+        part = len(self.paths)
+        path = os.path.join(self.directory, f"{self.name}.csv" if not part else f"{self.name}_{part:03d}.csv")
+        self._file = open(path, "w", newline="")
+        self._file.write(",".join(self.columns) + "\n")
+        self._file_bytes = 0
+        self._file_opened = time.monotonic()
+        self.paths.append(path)
+
+    def _close(self):
+        if self._file is None:
+            return
+        if self.fsync != FSYNC_NEVER:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def _write(self, times, values):
+        if self._file is not None and (self._file_bytes >= self.max_bytes
+                                       or time.monotonic() - self._file_opened >= self.max_seconds):
+            self._close()
+        if self._file is None:
+            self._open()
+        strings = np.char.replace(np.datetime_as_string(times.astype('datetime64[ns]'), unit='us'), 'T', ' ')
+        columns = [strings.tolist()] + [values[:, i].tolist() for i in range(values.shape[1])]
+        text = "\n".join([self.row_format % row for row in zip(*columns)]) + "\n"
+        self._file.write(text)
+        self._file.flush()
+        if self.fsync == FSYNC_FLUSH:
+            os.fsync(self._file.fileno())
+        self._file_bytes += len(text)
+        self.rows += len(times)
+        self.flushes += 1
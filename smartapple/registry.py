@@ -0,0 +1,89 @@
+import time
+from smartapple.sequence import SequenceTracker
+
+TOPIC_ROOT = "nicla"
+
+
+class DeviceState:
+    """What the master knows about one SmartApple."""
+
+    def __init__(self, address, production_line="test"):
+        self.address = address
+        self.production_line = production_line
+        self.last_packet_id = None
+        self.last_seen = None
+        self.messages = 0
+        self.samples = 0
+        self.replayed = 0  # samples sent again by the slave after an outage
+        self.errors = 0
+        # packet_id accounting of the samples reaching the master
+        self.sequence = SequenceTracker()
+
+
+class DeviceRegistry:
+    """Per-apple state keyed by address, with MQTT topics routed in constant time.
+
+    Topics look like nicla/<address>/<kind>[/<suffix>]: each kind has a handler
+    called as handler(device, topic, payload). A topic is split only the first time
+    it is seen, unknown apples are registered on their first message and handler
+    errors are counted per device instead of escaping the MQTT callback.
+    """
+
+    def __init__(self, production_lines=None, default_production_line="test"):
+        self.default_production_line = default_production_line
+        self.devices = {}
+        self.handlers = {}
+        self._routes = {}  # topic -> (handler, device)
+        self.unroutable = 0
+        for address, production_line in (production_lines or {}).items():
+            self.devices[address] = DeviceState(address, production_line)
+
+    def route(self, kind, handler):
+        self.handlers[kind] = handler
+        self._routes.clear()
+
+    def subscriptions(self):
+        # wildcard topics covering every apple, for client.subscribe()
+        return [f"{TOPIC_ROOT}/+/{kind}/#" for kind in self.handlers]
+
+    def device(self, address):
+        device = self.devices.get(address)
+        if device is None:
+            device = self.devices[address] = DeviceState(address, self.default_production_line)
+            print(f"[{address}] New SmartApple registered")
+        return device
+
+    def _resolve(self, topic):
+        parts = topic.split("/", 3)
+        if len(parts) < 3 or parts[0] != TOPIC_ROOT or not parts[1]:
+            return None
+        handler = self.handlers.get(parts[2])
+        if handler is None:
+            return None
+        route = self._routes[topic] = (handler, self.device(parts[1]))
+        return route
+
+    def dispatch(self, topic, payload):
+        route = self._routes.get(topic) or self._resolve(topic)
+        if route is None:
+            self.unroutable += 1
+            return False
+        handler, device = route
+        device.messages += 1
+        device.last_seen = time.time()
+        try:
+            handler(device, topic, payload)
+        except Exception as e:
+            device.errors += 1
+            print(f"[{device.address}] Error handling {topic}: {e}")
+        return True
+
+    def report(self):
+        for device in list(self.devices.values()):
+            sequence = device.sequence
+            print(f"[{device.address}] line {device.production_line}, {device.messages} messages, "
+                  f"{device.samples} samples ({device.replayed} replayed), last packet {device.last_packet_id}, {device.errors} errors, "
+                  f"{sequence.lost} lost in {sequence.gaps} gaps, loss {sequence.loss_rate():.2%} "
+                  f"(recent {sequence.rolling_loss_rate():.2%})")
+        if self.unroutable:
+            print(f"{self.unroutable} messages on unknown topics")
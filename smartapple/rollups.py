@@ -0,0 +1,280 @@
+import math
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from smartapple.impacts import ImpactDetector
+
+# Downsampled tiers of the nicla samples, each in its own bucket (<bucket>_<name>) with its own retention
+Tier = namedtuple("Tier", ["name", "seconds", "retention_days"])
+TIERS = (Tier("1s", 1, 30), Tier("1m", 60, 400))
+MEASUREMENT = "nicla_rollup"
+
+# Sensor units of the raw fields (Nicla datasheet)
+ACCEL_LSB_PER_G = 4096.0
+GYRO_LSB_PER_DPS = 16.4
+
+# Window accumulators: count, then sum, sum of squares, min and max of the accel and gyro magnitudes, impacts
+_COUNT, _A_SUM, _A_SQ, _A_MIN, _A_MAX, _G_SUM, _G_SQ, _G_MIN, _G_MAX, _IMPACTS = range(10)
+
+
+def tier_bucket(bucket, tier):
+    return f"{bucket}_{tier.name}"
+
+
+def ensure_buckets(client, org, bucket, tiers=TIERS):
+    # creates the missing tier buckets with their retention, existing ones are left as they are
+    from influxdb_client import BucketRetentionRules
+    buckets_api = client.buckets_api()
+    for tier in tiers:
+        name = tier_bucket(bucket, tier)
+        if buckets_api.find_bucket_by_name(name) is None:
+            rules = BucketRetentionRules(type="expire", every_seconds=tier.retention_days * 86400)
+            buckets_api.create_bucket(bucket_name=name, retention_rules=rules, org=org)
+            print(f"Created bucket {name}, retention {tier.retention_days} days")
+
+
+def _merge(accumulator, other):
+    accumulator[_COUNT] += other[_COUNT]
+    for i in (_A_SUM, _A_SQ, _G_SUM, _G_SQ, _IMPACTS):
+        accumulator[i] += other[i]
+    for i in (_A_MIN, _G_MIN):
+        accumulator[i] = min(accumulator[i], other[i])
+    for i in (_A_MAX, _G_MAX):
+        accumulator[i] = max(accumulator[i], other[i])
+
+
+def _fields(accumulator):
+    count = accumulator[_COUNT]
+    fields = {"samples": int(count), "impacts": int(accumulator[_IMPACTS])}
+    for prefix, first in (("accel", _A_SUM), ("gyro", _G_SUM)):
+        fields[f"{prefix}_min"] = accumulator[first + 2]
+        fields[f"{prefix}_max"] = accumulator[first + 3]
+        fields[f"{prefix}_mean"] = accumulator[first] / count
+        fields[f"{prefix}_rms"] = math.sqrt(accumulator[first + 1] / count)
+    return fields
+
+
+class Rollups:
+    """Per (address, production line) window statistics of the sample stream, written to the tier buckets.
+
+    add() takes the decoded columns as they arrive; a window is written once the samples of its
+    device are `lateness` seconds past its end (or by flush() once the wall clock is). Each tier
+    is computed from the closed windows of the one before it. writers maps the tier names to a
+    BulkWriter of their bucket.
+
+    Written windows are kept for `history` seconds after their last change: samples of a
+    written window (late ones, or the ones backfill() takes, replayed by the slave after an
+    outage) are merged into it and into the coarser windows holding it, and flush() writes
+    them again over the previous points. Older written windows are started from scratch.
+    """
+
+    def __init__(self, writers, tiers=TIERS, measurement=MEASUREMENT, lateness=2.0, history=900.0):
+        self.writers = writers
+        self.tiers = tiers
+        self.measurement = measurement
+        self.lateness_ns = int(lateness * 1e9)
+        self.history = history
+        self._windows = [{} for _ in tiers]  # per tier: (address, production line) -> {window start: accumulator}
+        self._closed = [{} for _ in tiers]  # per tier: (address, production line) -> end of the last closed window
+        self._written = [{} for _ in tiers]  # per tier: (address, production line) -> {window start: [accumulator, changed at]}
+        self._dirty = set()  # (tier, key, window start) of written windows to write again
+        self._detectors = {}  # (address, production line[, "replay"]) -> ImpactDetector of smartapple.impacts
+        self._lock = threading.Lock()
+        self.windows = [0] * len(tiers)
+        self.late = 0
+        self.backfilled = 0
+
+    def _magnitudes(self, columns):
+        time_ns = np.asarray(columns["time_ns"], dtype=np.int64)
+        accel = np.sqrt(np.asarray(columns["a_x"], dtype=np.float64) ** 2 + np.asarray(columns["a_y"], dtype=np.float64) ** 2
+                        + np.asarray(columns["a_z"], dtype=np.float64) ** 2) / ACCEL_LSB_PER_G
+        gyro = np.sqrt(np.asarray(columns["g_x"], dtype=np.float64) ** 2 + np.asarray(columns["g_y"], dtype=np.float64) ** 2
+                       + np.asarray(columns["g_z"], dtype=np.float64) ** 2) / GYRO_LSB_PER_DPS
+        return time_ns, accel, gyro
+
+    def add(self, address, production_line, columns):
+        time_ns, accel, gyro = self._magnitudes(columns)
+        if not len(time_ns):
+            return
+        key = (address, production_line)
+        with self._lock:
+            rises = self._impacts(key, time_ns, accel)
+            self._add_windows(key, time_ns, accel, gyro, rises)
+            self._close(key, int(time_ns.max()) - self.lateness_ns)
+
+    def backfill(self, address, production_line, columns):
+        # samples sent again after an outage, in their own time order: they never move the watermark of the live ones
+        time_ns, accel, gyro = self._magnitudes(columns)
+        if not len(time_ns):
+            return
+        key = (address, production_line)
+        with self._lock:
+            rises = self._impacts(key + ("replay",), time_ns, accel)
+            self._add_windows(key, time_ns, accel, gyro, rises)
+            self.backfilled += len(time_ns)
+
+    def _impacts(self, key, time_ns, accel):
+        # the samples the impacts start at, with the definition of the impact tables of data-analysis:
+        # above the first critical threshold (smartapple.impacts.TRIGGER), as the dashboard levels
+        detector = self._detectors.get(key)
+        if detector is None:
+            detector = self._detectors[key] = ImpactDetector()
+        return detector.rises(time_ns, accel)
+
+    def _add_windows(self, key, time_ns, accel, gyro, rises):
+        period_ns = self.tiers[0].seconds * 10**9
+        window = time_ns // period_ns
+        order = np.argsort(window, kind="stable")
+        window, accel, gyro, rises = window[order], accel[order], gyro[order], rises[order]
+        starts = np.flatnonzero(np.diff(window, prepend=window[0] - 1))
+        stats = np.stack([np.diff(np.append(starts, len(window))),
+                          np.add.reduceat(accel, starts), np.add.reduceat(accel ** 2, starts),
+                          np.minimum.reduceat(accel, starts), np.maximum.reduceat(accel, starts),
+                          np.add.reduceat(gyro, starts), np.add.reduceat(gyro ** 2, starts),
+                          np.minimum.reduceat(gyro, starts), np.maximum.reduceat(gyro, starts),
+                          np.add.reduceat(rises.astype(np.int64), starts)], axis=1)
+        for start, accumulator in zip((window[starts] * period_ns).tolist(), stats.tolist()):
+            self._merge_window(key, 0, start, accumulator)
+
+    def _merge_window(self, key, level, start, accumulator):
+        # adds samples to an open window, or to a written one and to the coarser windows holding it
+        if start >= self._closed[level].get(key, -1):
+            current = self._windows[level].setdefault(key, {}).get(start)
+            if current is None:
+                self._windows[level][key][start] = list(accumulator)
+            else:
+                _merge(current, accumulator)
+            return
+        if level == 0:
+            self.late += int(accumulator[_COUNT])
+        written = self._written[level].setdefault(key, {})
+        entry = written.get(start)
+        if entry is None:
+            written[start] = [list(accumulator), time.monotonic()]
+        else:
+            _merge(entry[0], accumulator)
+            entry[1] = time.monotonic()
+        self._dirty.add((level, key, start))
+        if level + 1 < len(self.tiers):
+            coarse_ns = self.tiers[level + 1].seconds * 10**9
+            self._merge_window(key, level + 1, start // coarse_ns * coarse_ns, accumulator)
+
+    def _close(self, key, watermark_ns, level=0):
+        # writes the windows of key ending before the watermark and feeds them to the next tier
+        period_ns = self.tiers[level].seconds * 10**9
+        windows = self._windows[level].get(key, {})
+        ready = sorted(start for start in windows if start + period_ns <= watermark_ns)
+        if not ready:
+            if math.isinf(watermark_ns) and level + 1 < len(self.tiers):
+                self._close(key, watermark_ns, level + 1)
+            return
+        tags = {"address": key[0], "production_line": key[1]}
+        written = self._written[level].setdefault(key, {})
+        for start in ready:
+            accumulator = windows.pop(start)
+            self.writers[self.tiers[level].name].add_record(self.measurement, tags, _fields(accumulator), start)
+            written[start] = [accumulator, time.monotonic()]
+            self.windows[level] += 1
+            if level + 1 < len(self.tiers):
+                coarse_ns = self.tiers[level + 1].seconds * 10**9
+                coarse_windows = self._windows[level + 1].setdefault(key, {})
+                current = coarse_windows.get(start // coarse_ns * coarse_ns)
+                if current is None:
+                    coarse_windows[start // coarse_ns * coarse_ns] = list(accumulator)
+                else:
+                    _merge(current, accumulator)
+        self._closed[level][key] = max(self._closed[level].get(key, -1), ready[-1] + period_ns)
+        if level + 1 < len(self.tiers):
+            # the coarser windows are complete up to the end of the last closed one, or forced too
+            self._close(key, watermark_ns if math.isinf(watermark_ns) else self._closed[level][key], level + 1)
+
+    def flush(self, now_ns=None, force=False):
+        # closes the windows of the devices gone quiet, or all of them
+        watermark_ns = (now_ns or time.time_ns()) - self.lateness_ns
+        with self._lock:
+            keys = {key for level in self._windows for key in level}
+            for key in keys:
+                self._close(key, math.inf if force else watermark_ns)
+            # written windows that changed since, then forget the ones unchanged for `history` seconds
+            for level, key, start in sorted(self._dirty, key=lambda item: item[0]):
+                entry = self._written[level][key].get(start)
+                tags = {"address": key[0], "production_line": key[1]}
+                self.writers[self.tiers[level].name].add_record(self.measurement, tags, _fields(entry[0]), start)
+            self._dirty.clear()
+            expired = time.monotonic() - self.history
+            for level in self._written:
+                for key, written in level.items():
+                    for start in [start for start, entry in written.items() if entry[1] < expired]:
+                        del written[start]
+
+    def report(self):
+        pending = sum(len(windows) for level in self._windows for windows in level.values())
+        kept = sum(len(windows) for level in self._written for windows in level.values())
+        print(f"Rollups: {', '.join(f'{n} {t.name}' for t, n in zip(self.tiers, self.windows))} windows written, "
+              f"{pending} open, {kept} kept for late samples, {self.late} late samples merged "
+              f"({self.backfilled} replayed after outages)")
+
+
+def choose_tier(start, stop, width, tiers=TIERS):
+    """Coarsest tier with at least one window per pixel of a `width` pixel view of [start, stop), None for the raw samples."""
+    seconds_per_pixel = (pd.Timestamp(stop) - pd.Timestamp(start)).total_seconds() / max(width, 1)
+    fitting = [tier for tier in tiers if tier.seconds <= seconds_per_pixel]
+    return max(fitting, key=lambda tier: tier.seconds) if fitting else None
+
+
+def _rollup_frame(df, every):
+    # re-aggregates rollup rows (or raw magnitude rows with samples=1) to `every` windows per device
+    df = df.assign(_time=pd.to_datetime(df["_time"].str.rstrip("Z"), format="ISO8601"))
+    for prefix in ("accel", "gyro"):
+        df[f"{prefix}_sum"] = df[f"{prefix}_mean"] * df["samples"]
+        df[f"{prefix}_sq"] = df[f"{prefix}_rms"] ** 2 * df["samples"]
+    grouped = df.groupby(["address", "production_line", pd.Grouper(key="_time", freq=every)])
+    out = grouped.agg(samples=("samples", "sum"), impacts=("impacts", "sum"),
+                      accel_min=("accel_min", "min"), accel_max=("accel_max", "max"),
+                      accel_sum=("accel_sum", "sum"), accel_sq=("accel_sq", "sum"),
+                      gyro_min=("gyro_min", "min"), gyro_max=("gyro_max", "max"),
+                      gyro_sum=("gyro_sum", "sum"), gyro_sq=("gyro_sq", "sum"))
+    out = out[out["samples"] > 0]
+    for prefix in ("accel", "gyro"):
+        out[f"{prefix}_mean"] = out.pop(f"{prefix}_sum") / out["samples"]
+        out[f"{prefix}_rms"] = np.sqrt(out.pop(f"{prefix}_sq") / out["samples"])
+    return out.reset_index()
+
+
+def query_overview(query_api, org, bucket, start, stop, width, addresses=None, production_lines=None, tiers=TIERS):
+    """Per device statistics of [start, stop) at about one row per pixel, from the coarsest tier that fits.
+
+    Returns (tier name or 'raw', DataFrame with _time, address, production_line, samples, impacts
+    and the min/max/mean/rms of the accel (g) and gyro (°/s) magnitudes).
+    """
+    from smartapple.export import build_query, read_query
+    tier = choose_tier(start, stop, width, tiers)
+    seconds = max((pd.Timestamp(stop) - pd.Timestamp(start)).total_seconds() / max(width, 1), tier.seconds if tier else 0)
+    every = pd.Timedelta(seconds=seconds).ceil("ms")
+    if tier is not None:
+        query = build_query(tier_bucket(bucket, tier), MEASUREMENT, start, stop, addresses, production_lines)
+        frames = list(read_query(query_api, org, query))
+    else:
+        # raw samples, as one-sample windows
+        query = build_query(bucket, "nicla", start, stop, addresses, production_lines,
+                            fields=["a_x", "a_y", "a_z", "g_x", "g_y", "g_z"])
+        frames = []
+        detectors = {}  # address -> ImpactDetector, across the chunks of the query
+        for df in read_query(query_api, org, query):
+            accel = np.sqrt(df["a_x"] ** 2 + df["a_y"] ** 2 + df["a_z"] ** 2) / ACCEL_LSB_PER_G
+            gyro = np.sqrt(df["g_x"] ** 2 + df["g_y"] ** 2 + df["g_z"] ** 2) / GYRO_LSB_PER_DPS
+            # impacts of each apple, as in the rollups
+            time_ns = pd.DatetimeIndex(df["_time"]).asi8
+            rises = np.zeros(len(df), dtype=bool)
+            for address, index in df.groupby("address").indices.items():
+                rises[index] = detectors.setdefault(address, ImpactDetector()).rises(time_ns[index], accel.to_numpy()[index])
+            frames.append(pd.DataFrame({"_time": df["_time"], "address": df["address"],
+                                        "production_line": df["production_line"], "samples": 1,
+                                        "impacts": rises.astype(int), "accel_min": accel, "accel_max": accel, "accel_mean": accel,
+                                        "accel_rms": accel, "gyro_min": gyro, "gyro_max": gyro, "gyro_mean": gyro,
+                                        "gyro_rms": gyro}))
+    if not frames:
+        return (tier.name if tier else "raw"), pd.DataFrame()
+    return (tier.name if tier else "raw"), _rollup_frame(pd.concat(frames, ignore_index=True), every)
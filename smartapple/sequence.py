@@ -0,0 +1,125 @@
+from collections import deque
+from smartapple.metrics import Histogram
+
+# Bucket upper bounds of the packet inter-arrival times, in seconds
+INTERVAL_BOUNDS = (0.005, 0.01, 0.02, 0.035, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+
+class SequenceTracker:
+    """Streaming packet_id accounting of one SmartApple.
+
+    Every sample carries the next packet_id, so a jump forward is a gap (lost samples),
+    an id seen recently is a duplicate, an older unseen id is a late (reordered) sample
+    recovering part of a gap, and a jump back by more than reset_distance, or to 0,
+    is a firmware restart. The loss rate is also kept over the last `window` packets.
+    """
+
+    def __init__(self, window=500, history=1024, reset_distance=1000):
+        self.reset_distance = reset_distance
+        self.last_id = None
+        self.received = 0
+        self.lost = 0
+        self.gaps = 0
+        self.duplicates = 0
+        self.reorders = 0
+        self.resets = 0
+        self.interarrival = Histogram(INTERVAL_BOUNDS)
+        self._last_arrival = None
+        self._recent = deque(maxlen=history)
+        self._recent_ids = set()
+        self._window = deque(maxlen=window)  # (expected, lost) per packet
+        self._window_expected = 0
+        self._window_lost = 0
+
+    def _remember(self, packet_id):
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_ids.discard(self._recent[0])
+        self._recent.append(packet_id)
+        self._recent_ids.add(packet_id)
+
+    def observe(self, packet_ids, arrival_ns=None):
+        # packet_ids of the samples of one packet (or message), in arrival order
+        packet_ids = packet_ids.tolist() if hasattr(packet_ids, 'tolist') else list(packet_ids)
+        if arrival_ns is not None:
+            if self._last_arrival is not None:
+                self.interarrival.observe((arrival_ns - self._last_arrival) * 1e-9)
+            self._last_arrival = arrival_ns
+        if not len(packet_ids):
+            return
+
+        lost_before = self.lost
+        expected = len(packet_ids)
+        if self.last_id is not None and packet_ids == list(range(self.last_id + 1, self.last_id + 1 + expected)):
+            # in order, the common case
+            self.received += expected
+            self.last_id = packet_ids[-1]
+            for packet_id in packet_ids[-self._recent.maxlen:]:
+                self._remember(packet_id)
+        else:
+            for packet_id in packet_ids:
+                expected += self._observe_one(packet_id)
+
+        if len(self._window) == self._window.maxlen:
+            # the oldest packet leaves the window
+            old_expected, old_lost = self._window[0]
+            self._window_expected -= old_expected
+            self._window_lost -= old_lost
+        self._window.append((expected, self.lost - lost_before))
+        self._window_expected += expected
+        self._window_lost += self.lost - lost_before
+
+    def _observe_one(self, packet_id):
+        # extra samples that were expected before this one (the gap length)
+        if self.last_id is None or packet_id == self.last_id + 1:
+            self.received += 1
+            self.last_id = packet_id
+            self._remember(packet_id)
+            return 0
+        if packet_id > self.last_id:
+            gap = packet_id - self.last_id - 1
+            self.gaps += 1
+            self.lost += gap
+            self.received += 1
+            self.last_id = packet_id
+            self._remember(packet_id)
+            return gap
+        if packet_id == 0 or self.last_id - packet_id > self.reset_distance:
+            self.resets += 1
+            self.received += 1
+            self.last_id = packet_id
+            self._recent.clear()
+            self._recent_ids.clear()
+            self._remember(packet_id)
+            return 0
+        if packet_id in self._recent_ids:
+            self.duplicates += 1
+            return -1
+        # late sample, it had been counted as lost
+        self.reorders += 1
+        self.lost -= 1
+        self.received += 1
+        self._remember(packet_id)
+        return -1
+
+    def loss_rate(self):
+        total = self.received + self.lost
+        return self.lost / total if total else 0.0
+
+    def rolling_loss_rate(self):
+        return self._window_lost / self._window_expected if self._window_expected > 0 else 0.0
+
+    def summary(self):
+        # flat fields, for reports and the InfluxDB summary series
+        return {
+            "received": self.received,
+            "lost": self.lost,
+            "gaps": self.gaps,
+            "duplicates": self.duplicates,
+            "reorders": self.reorders,
+            "resets": self.resets,
+            "loss_rate": self.loss_rate(),
+            "rolling_loss_rate": self.rolling_loss_rate(),
+            "interarrival_mean": self.interarrival.mean(),
+            "interarrival_p95": float(self.interarrival.quantile(0.95)),
+            "interarrival_max": self.interarrival.max,
+        }
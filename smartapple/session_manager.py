@@ -0,0 +1,299 @@
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from bleak import BleakClient, BleakScanner
+from bleak.assigned_numbers import AdvertisementDataType
+from smartapple.metrics import Histogram
+from smartapple.packet import read_format_version
+
+# 0 means stop notification, 1 means start notification
+PROGRAM_COMMAND_UUID = "19b10000-8002-537e-4f6c-d104768a1214"
+SENSORS_UUID = "19b10000-A001-537e-4f6c-d104768a1214" # UUID to read from
+SERVICE_UUID = "19b10000-0000-537e-4f6c-d104768a1214" # advertised by the firmware
+
+
+class BleakBackend:
+    """Real BLE stack, the fake one in slave-raspberry/test/fake_ble.py has the same interface.
+
+    Scans passively where the platform allows it: the address is all the sessions need, so
+    no scan requests are sent and the apples spend no airtime on scan responses.
+    """
+
+    def __init__(self, scanning_mode="passive"):
+        self.scanning_mode = scanning_mode
+
+    def scanner(self, detection_callback):
+        return FallbackScanner(self, detection_callback)
+
+    def client(self, device, disconnected_callback=None):
+        return BleakClient(device, disconnected_callback=disconnected_callback, timeout=10.0)
+
+
+class FallbackScanner:
+    """BleakScanner in the scanning mode of the backend, active once passive scanning failed.
+
+    BlueZ only scans passively through its advertisement monitor (bluetoothd started with
+    --experimental), matched here on the service UUID the SmartApples advertise, and macOS
+    not at all.
+    """
+
+    def __init__(self, backend, detection_callback):
+        self.backend = backend
+        self.detection_callback = detection_callback
+        self._scanner = None
+
+    async def start(self):
+        if self._scanner is None and self.backend.scanning_mode == "passive":
+            service = uuid.UUID(SERVICE_UUID).bytes[::-1]  # little endian in the advertising data
+            or_patterns = [(0, AdvertisementDataType.INCOMPLETE_LIST_SERVICE_UUID128, service),
+                           (0, AdvertisementDataType.COMPLETE_LIST_SERVICE_UUID128, service)]
+            try:
+                self._scanner = BleakScanner(detection_callback=self.detection_callback, scanning_mode="passive",
+                                             bluez={"or_patterns": or_patterns})
+                await self._scanner.start()
+                return
+            except Exception as e:
+                print(f"Passive scanning not available, scanning actively: {e}")
+                self.backend.scanning_mode = "active"
+                self._scanner = None
+        if self._scanner is None:
+            self._scanner = BleakScanner(detection_callback=self.detection_callback)
+        await self._scanner.start()
+
+    async def stop(self):
+        if self._scanner is not None:
+            await self._scanner.stop()
+
+
+class DeviceStats:
+    def __init__(self):
+        self.connected = False
+        self.packets = 0
+        self.samples = 0
+        self.invalid = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.failed_connects = 0
+        # time from a disconnection to the first packet after the reconnection
+        self.reconnect_latency = Histogram()
+        # samples count at the last report, used for the throughput
+        self._last_samples = 0
+        self._last_time = time.monotonic()
+
+    def throughput(self):
+        # samples/s since the previous call
+        now = time.monotonic()
+        rate = (self.samples - self._last_samples) / max(now - self._last_time, 1e-6)
+        self._last_samples = self.samples
+        self._last_time = now
+        return rate
+
+
+class DeviceSession:
+    """Connection, streaming and reconnect backoff of a single SmartApple."""
+
+    def __init__(self, address, scanner, backend, on_notification, connect_lock,
+                 min_backoff=0.5, max_backoff=30.0):
+        self.address = address
+        self.scanner = scanner
+        self.backend = backend
+        self.on_notification = on_notification
+        self.connect_lock = connect_lock
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.format_version = None
+        self.stats = DeviceStats()
+        self._disconnected = asyncio.Event()
+        self._disconnected_at = None
+
+    def _notification_handler(self, sender, data):
+        if self._disconnected_at is not None:
+            self.stats.reconnect_latency.observe(time.monotonic() - self._disconnected_at)
+            self._disconnected_at = None
+        self.stats.packets += 1
+        samples = self.on_notification(self.address, data)
+        if samples:
+            self.stats.samples += samples
+        elif samples is not None:
+            self.stats.invalid += 1
+
+    def _disconnected_callback(self, client):
+        # called by the BLE stack as soon as the link is lost
+        self._disconnected_at = time.monotonic()
+        self._disconnected.set()
+
+    async def run(self):
+        while True:
+            # any advertisement received after the disconnection means the apple is back in range
+            device = await self.scanner.wait_for(self.address, since=self._disconnected_at)
+            try:
+                await self._stream(device)
+                # the link was up, reconnect right away
+                self.backoff = self.min_backoff
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats.failed_connects += 1
+                print(f"[{self.address}] Connection error: {e}")
+            finally:
+                self.stats.connected = False
+            print(f"[{self.address}] Retrying in {self.backoff:.1f}s")
+            await asyncio.sleep(self.backoff)
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    async def _stream(self, device):
+        self._disconnected.clear()
+        client = self.backend.client(device, disconnected_callback=self._disconnected_callback)
+        # BlueZ does not cope well with simultaneous connection attempts or scanning while connecting
+        async with self.connect_lock, self.scanner.paused():
+            await client.connect()
+        try:
+            if self.stats.connects:
+                self.stats.reconnects += 1
+            self.stats.connects += 1
+            self.stats.connected = True
+            self.format_version = await read_format_version(client)
+            print(f"[{self.address}] Connected, packet format: v{self.format_version}")
+
+            # send a byte 1 to start the program to the command characteristic
+            await client.write_gatt_char(PROGRAM_COMMAND_UUID, bytearray([1]))
+            await client.start_notify(SENSORS_UUID, self._notification_handler)
+
+            await self._disconnected.wait()
+            print(f"[{self.address}] Disconnected from device.")
+        finally:
+            if client.is_connected:
+                try:
+                    await client.stop_notify(SENSORS_UUID)
+                    await client.disconnect()
+                except Exception as e:
+                    print(f"[{self.address}] Error during cleanup: {e}")
+            if self._disconnected_at is None:
+                self._disconnected_at = time.monotonic()
+
+
+class Scanner:
+    """Persistent background scanner caching the last advertisement of every address."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        # address -> (device, advertisement data, monotonic time of the sighting)
+        self.seen = {}
+        self._waiting = {}
+        self._scanner = None
+        self._failed = None  # future failing with the error of a scanner restart
+        self._pauses = 0
+
+    def _detection_callback(self, device, advertisement_data):
+        self.seen[device.address] = (device, advertisement_data, time.monotonic())
+        found = self._waiting.get(device.address)
+        if found:
+            found.set()
+
+    def last_seen(self, address, since=None):
+        # cached device if it advertised after `since`
+        entry = self.seen.get(address)
+        if entry and (since is None or entry[2] > since):
+            return entry[0]
+        return None
+
+    async def wait_for(self, address, since=None):
+        # no discovery round, return the cached sighting or the next advertisement
+        device = self.last_seen(address, since)
+        while device is None:
+            found = asyncio.Event()
+            self._waiting[address] = found
+            try:
+                await found.wait()
+            finally:
+                self._waiting.pop(address, None)
+            device = self.last_seen(address, since)
+        return device
+
+    @asynccontextmanager
+    async def paused(self):
+        # stop scanning around a connection attempt, nested pauses are counted
+        self._pauses += 1
+        try:
+            if self._pauses == 1 and self._scanner:
+                await self._toggle(self._scanner.stop)
+            yield
+        finally:
+            self._pauses -= 1
+            if self._pauses == 0 and self._scanner:
+                await self._toggle(self._scanner.start)
+
+    async def _toggle(self, action):
+        # a scanner error is not the connection's, run() restarts the scanner
+        try:
+            await action()
+        except Exception as e:
+            if self._failed is not None and not self._failed.done():
+                self._failed.set_exception(e)
+
+    async def run(self, min_backoff=1.0, max_backoff=30.0):
+        # restarts the scanner with backoff, e.g. adapter not powered yet at boot or BlueZ restarted
+        backoff = min_backoff
+        while True:
+            self._failed = asyncio.get_running_loop().create_future()
+            self._scanner = self.backend.scanner(self._detection_callback)
+            try:
+                if not self._pauses:
+                    await self._scanner.start()
+                backoff = min_backoff
+                await self._failed
+            except Exception as e:
+                print(f"Scanner error, restarting in {backoff:.0f}s: {e}")
+            finally:
+                scanner, self._scanner = self._scanner, None
+                try:
+                    await scanner.stop()
+                except Exception:
+                    pass
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+
+class SessionManager:
+    """Streams every configured SmartApple concurrently, one task per device."""
+
+    def __init__(self, addresses, on_notification, backend=None, report_interval=10.0, reporters=()):
+        # on_notification(address, data) returns the number of decoded samples,
+        # reporters are extra callables run with each periodic report
+        self.backend = backend or BleakBackend()
+        self.report_interval = report_interval
+        self.reporters = list(reporters)
+        self.scanner = Scanner(self.backend)
+        connect_lock = asyncio.Lock()
+        self.sessions = {address: DeviceSession(address, self.scanner, self.backend, on_notification, connect_lock)
+                         for address in addresses}
+
+    def stats(self):
+        return {address: session.stats for address, session in self.sessions.items()}
+
+    def report(self):
+        for address, stats in self.stats().items():
+            state = "connected" if stats.connected else "disconnected"
+            print(f"[{address}] {state}, {stats.throughput():.1f} samples/s, "
+                  f"{stats.samples} samples, {stats.invalid} invalid packets, {stats.reconnects} reconnects, "
+                  f"reconnect latency {stats.reconnect_latency.summary()}")
+        for reporter in self.reporters:
+            reporter()
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report()
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.scanner.run()), asyncio.create_task(self._report_loop())]
+        tasks += [asyncio.create_task(session.run()) for session in self.sessions.values()]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
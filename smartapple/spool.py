@@ -0,0 +1,199 @@
+import os
+import struct
+import threading
+import time
+import zlib
+
+# record: payload length, topic length, crc32 of topic + payload, then the topic and the payload
+RECORD_HEADER = struct.Struct('<IHI')
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+
+class Spool:
+    """Append-only MQTT message log on disk, split in segments of segment_bytes.
+
+    append() writes (topic, payload) records to the last segment; read() returns the
+    oldest records not committed yet, and commit() moves the cursor past them, deleting
+    the segments left behind. The cursor is persisted, so a restart replays from where it
+    stopped. When the log exceeds max_bytes the oldest segments are dropped, read or not.
+    Records torn by a power cut are cut off at startup.
+    """
+
+    def __init__(self, directory, segment_bytes=8_000_000, max_bytes=512_000_000, fsync_interval=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._segments = {}  # sequence number -> [bytes, records not committed]
+        self._file = None
+        self._last_fsync = time.monotonic()
+        self._cursor = (0, 0)  # (segment, offset) of the next record to read
+
+        # statistics
+        self.records = 0  # not committed yet
+        self.bytes = 0  # on disk
+        self.appended = 0
+        self.committed = 0
+        self.dropped = 0  # records deleted before being read
+        self._recover()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}{SEGMENT_SUFFIX}")
+
+    def _recover(self):
+        segments = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                          if name.endswith(SEGMENT_SUFFIX))
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                segment, offset = (int(value) for value in f.read().split())
+        except (OSError, ValueError):
+            segment, offset = (segments[0] if segments else 0), 0
+        for number in segments:
+            if number < segment:
+                # consumed before the cursor was saved
+                os.remove(self._path(number))
+                continue
+            size, records = self._scan(number, offset if number == segment else 0, number == segments[-1])
+            self._segments[number] = [size, records]
+            self.bytes += size
+            self.records += records
+        if segment not in self._segments:
+            segment, offset = (min(self._segments) if self._segments else segment), 0
+        self._cursor = (segment, offset)
+        if self.records:
+            print(f"Spool {self.directory}: {self.records} records ({self.bytes / 1e6:.1f} MB) left to replay")
+
+    def _scan(self, segment, start, last):
+        # size and records after start of a segment, the torn tail of the last one is truncated
+        path = self._path(segment)
+        size = os.path.getsize(path)
+        offset, records = start, 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while offset + RECORD_HEADER.size <= size:
+                payload_length, topic_length, crc = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                end = offset + RECORD_HEADER.size + topic_length + payload_length
+                if end > size or (last and zlib.crc32(f.read(topic_length + payload_length)) != crc):
+                    break
+                if not last:
+                    f.seek(end)
+                offset, records = end, records + 1
+        if last and offset < size:
+            print(f"Spool {self.directory}: truncating {size - offset} torn bytes of {path}")
+            os.truncate(path, offset)
+            size = offset
+        return size, records
+
+    def _roll(self):
+        # start a new segment, called with the lock held
+        self._close_file()
+        number = max(self._segments) + 1 if self._segments else self._cursor[0]
+        self._segments[number] = [0, 0]
+        self._file = open(self._path(number), "ab")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def append(self, topic, payload):
+        topic = topic.encode()
+        record = RECORD_HEADER.pack(len(payload), len(topic), zlib.crc32(topic + payload)) + topic + payload
+        with self._lock:
+            if self._file is None or self._segments[max(self._segments)][0] >= self.segment_bytes:
+                if self._file is None and self._segments:
+                    # keep filling the last segment of a previous run
+                    self._file = open(self._path(max(self._segments)), "ab")
+                else:
+                    self._roll()
+            self._file.write(record)
+            self._file.flush()
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+            segment = self._segments[max(self._segments)]
+            segment[0] += len(record)
+            segment[1] += 1
+            self.bytes += len(record)
+            self.records += 1
+            self.appended += 1
+            while self.bytes > self.max_bytes and len(self._segments) > 1:
+                self._drop_oldest()
+
+    def _drop_oldest(self):
+        # the cursor is always in the oldest segment
+        size, unread = self._segments.pop(self._cursor[0])
+        os.remove(self._path(self._cursor[0]))
+        self.bytes -= size
+        self.dropped += unread
+        self.records -= unread
+        self._cursor = (min(self._segments), 0)
+        self._save_cursor()
+
+    def _advance(self):
+        # skip the cursor past a segment read to the end, unless it is still being written
+        segment, offset = self._cursor
+        while segment in self._segments and offset >= self._segments[segment][0] and segment != max(self._segments):
+            self.bytes -= self._segments.pop(segment)[0]
+            os.remove(self._path(segment))
+            segment, offset = min(self._segments), 0
+        if (segment, offset) != self._cursor:
+            self._cursor = (segment, offset)
+            self._save_cursor()
+
+    def read(self, max_records=500, max_bytes=1_000_000):
+        """Oldest records not committed yet, as ([(topic, payload), ...], position for commit())."""
+        with self._lock:
+            self._advance()
+            segment, offset = self._cursor
+            if segment not in self._segments:
+                return [], None
+            # only whole records, the writer may be appending to this segment
+            end = self._segments[segment][0]
+            # opened with the lock held: an append may drop the segment meanwhile, the open file survives the unlink
+            f = open(self._path(segment), "rb")
+        records = []
+        position = offset
+        with f:
+            f.seek(offset)
+            while len(records) < max_records and position - offset < max_bytes and position + RECORD_HEADER.size <= end:
+                payload_length, topic_length, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                body = f.read(topic_length + payload_length)
+                records.append((body[:topic_length].decode(), body[topic_length:]))
+                position += RECORD_HEADER.size + len(body)
+        return records, (segment, position, len(records))
+
+    def commit(self, position):
+        # the records of a read() are delivered, never read them again
+        segment, offset, count = position
+        with self._lock:
+            if segment != self._cursor[0] or segment not in self._segments:
+                # dropped meanwhile
+                return
+            self._cursor = (segment, offset)
+            self._segments[segment][1] -= count
+            self.records -= count
+            self.committed += count
+            self._save_cursor()
+            self._advance()
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._cursor[0]} {self._cursor[1]}\n")
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        with self._lock:
+            self._close_file()
+
+    @property
+    def segments(self):
+        return len(self._segments)